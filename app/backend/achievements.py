@@ -0,0 +1,248 @@
+"""
+Achievement definitions and the event-driven evaluation engine.
+
+Per-user counters live in `user_counters` and are updated incrementally from
+domain events (sync pushes, pomodoro completions, XP awards). Rules are
+indexed by the counter they depend on, so an event only checks the
+achievements its counters can unlock. Each unlock is claimed atomically on
+`user_counters.unlocked`, after its `user_achievements` row is written, so
+racing events cannot unlock (and reward) a code twice and a crash between the
+two writes is repaired by the next event. The claim also stages the
+`achievement_unlocked` event (see `outbox`), so an unlock is never silent.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from zoneinfo import ZoneInfo
+from advanced_models import AchievementModel, UserAchievementModel
+from catalog import StaticCatalog
+from outbox import new_event, publish_staged, stage_events, staged_source
+from indexes import index_registry
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime, timezone
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+index_registry.declare("user_achievements", [("user_id", 1), ("achievement_id", 1)], unique=True)
+index_registry.declare("user_counters", "user_id", unique=True)
+staged_source("user_counters")
+
+# Predefined achievements
+PREDEFINED_ACHIEVEMENTS = [
+    {"code": "first_quest", "name": "Première Quête", "description": "Complétez votre première quête", "icon": "⚔️", "category": "quest", "requirement": {"quests_completed": 1}, "reward_xp": 50, "reward_coins": 10, "rarity": "common"},
+    {"code": "quest_master", "name": "Maître des Quêtes", "description": "Complétez 50 quêtes", "icon": "🏆", "category": "quest", "requirement": {"quests_completed": 50}, "reward_xp": 500, "reward_coins": 100, "rarity": "epic"},
+    {"code": "streak_7", "name": "Série de 7", "description": "Maintenez une série de 7 jours", "icon": "🔥", "category": "streak", "requirement": {"streak_days": 7}, "reward_xp": 100, "reward_coins": 25, "rarity": "common"},
+    {"code": "streak_30", "name": "Série de 30", "description": "Maintenez une série de 30 jours", "icon": "🔥", "category": "streak", "requirement": {"streak_days": 30}, "reward_xp": 500, "reward_coins": 100, "rarity": "rare"},
+    {"code": "streak_100", "name": "Centenaire", "description": "100 jours consécutifs", "icon": "🌟", "category": "streak", "requirement": {"streak_days": 100}, "reward_xp": 2000, "reward_coins": 500, "rarity": "legendary"},
+    {"code": "xp_1000", "name": "Millier d'XP", "description": "Atteignez 1000 XP", "icon": "⭐", "category": "xp", "requirement": {"total_xp": 1000}, "reward_xp": 0, "reward_coins": 50, "rarity": "common"},
+    {"code": "xp_10000", "name": "Dix Mille", "description": "Atteignez 10000 XP", "icon": "🌟", "category": "xp", "requirement": {"total_xp": 10000}, "reward_xp": 0, "reward_coins": 500, "rarity": "epic"},
+    {"code": "level_10", "name": "Niveau 10", "description": "Atteignez le niveau 10", "icon": "🎯", "category": "level", "requirement": {"level": 10}, "reward_xp": 200, "reward_coins": 50, "rarity": "common"},
+    {"code": "level_50", "name": "Niveau 50", "description": "Atteignez le niveau 50", "icon": "👑", "category": "level", "requirement": {"level": 50}, "reward_xp": 1000, "reward_coins": 250, "rarity": "epic"},
+    {"code": "early_bird", "name": "Lève-tôt", "description": "Complétez 10 tâches avant 8h", "icon": "🌅", "category": "habit", "requirement": {"tasks_before_8am": 10}, "reward_xp": 150, "reward_coins": 30, "rarity": "rare", "secret": True},
+    {"code": "night_owl", "name": "Noctambule", "description": "Complétez 10 tâches après 22h", "icon": "🦉", "category": "habit", "requirement": {"tasks_after_10pm": 10}, "reward_xp": 150, "reward_coins": 30, "rarity": "rare", "secret": True},
+    {"code": "social_butterfly", "name": "Papillon Social", "description": "Rejoignez une guilde", "icon": "🦋", "category": "social", "requirement": {"guilds_joined": 1}, "reward_xp": 100, "reward_coins": 20, "rarity": "common"},
+    {"code": "perfectionist", "name": "Perfectionniste", "description": "Complétez 20 quêtes avec 100% de progression", "icon": "💯", "category": "quest", "requirement": {"perfect_quests": 20}, "reward_xp": 300, "reward_coins": 75, "rarity": "rare"},
+    {"code": "bookworm", "name": "Rat de Bibliothèque", "description": "Créez 50 notes", "icon": "📚", "category": "notes", "requirement": {"notes_created": 50}, "reward_xp": 200, "reward_coins": 50, "rarity": "common"},
+    {"code": "fitness_guru", "name": "Gourou du Fitness", "description": "Complétez 30 sessions d'entraînement", "icon": "🏋️", "category": "training", "requirement": {"training_sessions": 30}, "reward_xp": 400, "reward_coins": 100, "rarity": "rare"},
+]
+
+# ==================== CATALOG ====================
+
+ACHIEVEMENT_CATALOG = StaticCatalog([
+    AchievementModel(**ach, id=ach['code']).model_dump() for ach in PREDEFINED_ACHIEVEMENTS
+])
+
+async def seed_achievements(db: AsyncIOMotorDatabase):
+    """Idempotently upsert the predefined achievements (safe across workers)"""
+    await db.achievements.bulk_write([
+        UpdateOne({"code": ach["code"]}, {"$set": dict(ach)}, upsert=True)
+        for ach in ACHIEVEMENT_CATALOG.as_list()
+    ], ordered=False)
+
+# ==================== RULE INDEX ====================
+
+def build_rule_index(achievements: List[Dict[str, Any]]) -> Dict[str, List[Tuple[int, str]]]:
+    """Map counter name -> [(threshold, achievement code)] sorted by threshold"""
+    index: Dict[str, List[Tuple[int, str]]] = {}
+    for ach in achievements:
+        for counter, threshold in ach["requirement"].items():
+            index.setdefault(counter, []).append((threshold, ach["code"]))
+    for rules in index.values():
+        rules.sort()
+    return index
+
+RULES_BY_COUNTER = build_rule_index(PREDEFINED_ACHIEVEMENTS)
+
+def newly_unlocked(counters: Dict[str, int], touched: List[str], unlocked: List[str]) -> List[str]:
+    """Codes whose threshold is reached, checking only rules on touched counters"""
+    already = set(unlocked)
+    codes = []
+    for counter in touched:
+        value = counters.get(counter, 0)
+        for threshold, code in RULES_BY_COUNTER.get(counter, []):
+            if threshold > value:
+                break
+            if code not in already:
+                codes.append(code)
+                already.add(code)
+    return codes
+
+# ==================== SYNC EVENT EXTRACTION ====================
+
+# Collections whose pushes can move achievement counters
+SYNC_TRACKED_COLLECTIONS = {"quests", "tasks", "notes", "training", "habits"}
+
+def _hour(value: Any, zone: ZoneInfo) -> Optional[int]:
+    """Local hour of a timestamp in `zone`; naive timestamps are taken as UTC"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(zone).hour
+
+def counters_from_sync(
+    collection: str,
+    documents: List[Dict[str, Any]],
+    previous: Dict[str, Dict[str, Any]],
+    tz: str = "UTC"
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Derive counter increments and maxima from a batch of pushed documents.
+    `previous` maps document id -> stored version, so only state transitions
+    (not re-pushes of the same state) are counted. Completion hours
+    (tasks_before_8am, tasks_after_10pm) are judged in the user's `tz`.
+    """
+    zone = ZoneInfo(tz)
+    inc: Dict[str, int] = {}
+    maxima: Dict[str, int] = {}
+
+    def bump(counter: str):
+        inc[counter] = inc.get(counter, 0) + 1
+
+    for doc in documents:
+        old = previous.get(doc.get("id")) or {}
+        newly_completed = doc.get("status") == "completed" and old.get("status") != "completed"
+
+        if collection == "quests" and newly_completed:
+            bump("quests_completed")
+            if doc.get("progress", 0) >= 100:
+                bump("perfect_quests")
+        elif collection == "tasks" and newly_completed:
+            hour = _hour(doc.get("completedAt") or doc.get("completed_at"), zone)
+            if hour is not None and hour < 8:
+                bump("tasks_before_8am")
+            elif hour is not None and hour >= 22:
+                bump("tasks_after_10pm")
+        elif collection == "notes" and not old:
+            bump("notes_created")
+        elif collection == "training" and not old:
+            bump("training_sessions")
+        elif collection == "habits":
+            streak = max(doc.get("streak") or 0, doc.get("bestStreak") or 0)
+            if streak > maxima.get("streak_days", 0):
+                maxima["streak_days"] = streak
+
+    return inc, maxima
+
+# ==================== ENGINE ====================
+
+class AchievementEngine:
+    """Incremental counters + atomic per-code unlocks"""
+
+    def __init__(self):
+        self.db: Optional[AsyncIOMotorDatabase] = None
+
+    async def record(
+        self,
+        db: AsyncIOMotorDatabase,
+        user_id: str,
+        inc: Optional[Dict[str, int]] = None,
+        maxima: Optional[Dict[str, int]] = None
+    ) -> List[str]:
+        """Apply counter changes for one event and unlock what they reach"""
+        inc = {k: v for k, v in (inc or {}).items() if v}
+        maxima = maxima or {}
+        touched = [c for c in list(inc) + list(maxima) if c in RULES_BY_COUNTER]
+        if not inc and not maxima:
+            return []
+
+        update: Dict[str, Any] = {}
+        if inc:
+            update["$inc"] = {f"counters.{k}": v for k, v in inc.items()}
+        if maxima:
+            update["$max"] = {f"counters.{k}": v for k, v in maxima.items()}
+
+        doc = await db.user_counters.find_one_and_update(
+            {"user_id": user_id},
+            update,
+            projection={"_id": 0, "counters": 1, "unlocked": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        candidates = newly_unlocked(doc.get("counters", {}), touched, doc.get("unlocked", []))
+        if not candidates:
+            return []
+        return await self._claim(db, user_id, candidates)
+
+    async def _claim(self, db: AsyncIOMotorDatabase, user_id: str, candidates: List[str]) -> List[str]:
+        """
+        Write the unlock rows, then claim each code on user_counters; only the
+        event whose claim modified the document unlocks it. The rows are
+        upserted first, so a crash before the claim loses nothing: the code is
+        still unclaimed and the next event re-proposes it.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for code in candidates:
+            row = UserAchievementModel(user_id=user_id, achievement_id=code).model_dump()
+            row["unlocked_at"] = now
+            rows.append(UpdateOne(
+                {"user_id": user_id, "achievement_id": code}, {"$setOnInsert": row}, upsert=True
+            ))
+        try:
+            await db.user_achievements.bulk_write(rows, ordered=False)
+        except BulkWriteError as e:
+            # Two events upserting the same (user_id, achievement_id) row: the row exists either way
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+        events = {
+            code: new_event(user_id, "achievement_unlocked", {"achievement": code},
+                            event_id=f"achievement_unlocked:{user_id}:{code}")
+            for code in candidates
+        }
+        claims = await asyncio.gather(*(
+            db.user_counters.update_one(
+                {"user_id": user_id, "unlocked": {"$ne": code}},
+                {"$addToSet": {"unlocked": code}, **stage_events([events[code]])}
+            )
+            for code in candidates
+        ))
+        codes = [code for code, claim in zip(candidates, claims) if claim.modified_count == 1]
+        try:
+            await publish_staged(db, "user_counters", {"user_id": user_id}, [events[code] for code in codes])
+        except Exception as e:
+            # Still staged on user_counters: the outbox relay publishes them
+            logger.warning(f"achievement_unlocked events for {user_id} left to the outbox relay: {e}")
+        return codes
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        try:
+            await seed_achievements(db)
+        except Exception as e:
+            logger.error(f"Achievement catalog seeding failed: {e}")
+
+    async def stop(self):
+        self.db = None
+
+
+achievement_engine = AchievementEngine()
@@ -13,6 +13,7 @@ class BacklinkModel(BaseModel):
     target_id: str
     source_type: str = "note"  # note, quest, task
     target_type: str = "note"
+    origin: str = "manual"  # manual, wikilink
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class NoteTemplateModel(BaseModel):
@@ -96,11 +97,21 @@ class GuildModel(BaseModel):
     description: str
     icon: str
     owner_id: str
-    member_ids: List[str] = Field(default_factory=list)
+    member_count: int = 0  # members live in guild_members
     total_xp: int = 0
     level: int = 1
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class GuildMemberModel(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    guild_id: str
+    user_id: str
+    role: str = "member"  # owner, member
+    xp_contributed: int = 0
+    joined_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 # ==================== INTÉGRATIONS ====================
 
 class WebhookModel(BaseModel):
@@ -113,6 +124,7 @@ class WebhookModel(BaseModel):
     events: List[str]  # quest_completed, level_up, etc.
     active: bool = True
     secret: Optional[str] = None
+    batch: bool = False  # deliver events of a short window in one POST
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class IntegrationModel(BaseModel):
@@ -139,7 +151,9 @@ class PomodoroSessionModel(BaseModel):
     duration: int = 25  # minutes
     type: str = "work"  # work, short_break, long_break
     completed: bool = False
+    expired: bool = False  # abandoned: not completed before ends_at + grace
     started_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    ends_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
 
 # ==================== AUTOMATION ====================
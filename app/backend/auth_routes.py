@@ -11,11 +11,21 @@ from auth_utils import (
     get_totp_uri, generate_qr_code, verify_totp_code, generate_secure_token
 )
 from dependencies import get_db, get_current_active_user
+from indexes import index_registry
+from timeseries import as_utc
+from serialization import ORJSONResponse, project
 from datetime import datetime, timedelta, timezone
 import uuid
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
+index_registry.declare("users", "id", unique=True)
+index_registry.declare("users", "email", unique=True)
+index_registry.declare("users", "username")
+index_registry.declare("refresh_tokens", "token")
+# expires_at is stored as a date so MongoDB purges expired refresh tokens itself
+index_registry.declare("refresh_tokens", "expires_at", ttl_seconds=0)
+
 # ==================== REGISTER ====================
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
@@ -108,7 +118,6 @@ async def login(
     
     token_dict = refresh_token_doc.model_dump()
     token_dict['created_at'] = token_dict['created_at'].isoformat()
-    token_dict['expires_at'] = token_dict['expires_at'].isoformat()
     
     await db.refresh_tokens.insert_one(token_dict)
     
@@ -147,8 +156,7 @@ async def refresh_access_token(
         )
     
     # Check if token is expired
-    expires_at = datetime.fromisoformat(token_doc['expires_at']) if isinstance(token_doc['expires_at'], str) else token_doc['expires_at']
-    if expires_at < datetime.now(timezone.utc):
+    if as_utc(token_doc['expires_at']) < datetime.now(timezone.utc):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Refresh token expired"
@@ -186,7 +194,7 @@ async def get_me(
     current_user: UserInDB = Depends(get_current_active_user)
 ):
     """Get current user profile"""
-    return UserResponse(**current_user.model_dump())
+    return ORJSONResponse(project(UserResponse, current_user))
 
 # ==================== 2FA SETUP ====================
 
@@ -316,7 +324,6 @@ async def verify_2fa(
     
     token_dict = refresh_token_doc.model_dump()
     token_dict['created_at'] = token_dict['created_at'].isoformat()
-    token_dict['expires_at'] = token_dict['expires_at'].isoformat()
     
     await db.refresh_tokens.insert_one(token_dict)
     
@@ -0,0 +1,48 @@
+"""
+Immutable, pre-serialized catalogs for static API payloads.
+
+Static lists (achievements, note templates, available integrations) are
+serialized once at import time and served as raw bytes with a strong ETag,
+so requests skip validation/serialization and clients can revalidate with
+If-None-Match.
+"""
+from fastapi import Request, Response
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+import hashlib
+
+from serialization import dumps
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+class StaticCatalog:
+    """Read-only list of items plus its serialized body and ETag"""
+
+    def __init__(self, items: List[Dict[str, Any]], envelope: Optional[str] = None):
+        self.items: Tuple[Mapping[str, Any], ...] = _freeze(list(items))
+        self.items_json = dumps(_thaw(self.items))
+        payload = {envelope: _thaw(self.items)} if envelope else _thaw(self.items)
+        self.body = dumps(payload)
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+    def as_list(self) -> List[Dict[str, Any]]:
+        """Mutable copy for callers that need plain dicts"""
+        return _thaw(self.items)
+
+    def response(self, request: Request, max_age: int = 3600) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={max_age}"}
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
@@ -0,0 +1,85 @@
+"""
+The application's single MongoDB client.
+
+`connect()` is called once from the app lifespan (or by a CLI entry point)
+and builds one AsyncIOMotorClient whose pool, timeouts, compression and
+read/write concerns come from the environment. Routes receive the database
+through `dependencies.get_db`; background services get it at startup.
+`warm_up()` pings the server and opens the minimum pool before traffic
+arrives, so the first requests do not pay for connection setup.
+"""
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import WriteConcern, monitoring
+from pymongo.read_concern import ReadConcern
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[AsyncIOMotorClient] = None
+_db: Optional[AsyncIOMotorDatabase] = None
+
+def _int_env(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+def client_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "maxPoolSize": _int_env("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _int_env("MONGO_MIN_POOL_SIZE", 10),
+        "maxIdleTimeMS": _int_env("MONGO_MAX_IDLE_TIME_MS", 300000),
+        "connectTimeoutMS": _int_env("MONGO_CONNECT_TIMEOUT_MS", 5000),
+        "serverSelectionTimeoutMS": _int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "socketTimeoutMS": _int_env("MONGO_SOCKET_TIMEOUT_MS", 30000),
+        "retryWrites": os.environ.get("MONGO_RETRY_WRITES", "true").lower() == "true",
+        "appname": os.environ.get("MONGO_APP_NAME", "initium-api"),
+        # BSON dates come back as aware UTC datetimes, so they serialize with an offset
+        "tz_aware": True,
+    }
+    # zstd/snappy need optional packages; zlib ships with Python
+    compressors = os.environ.get("MONGO_COMPRESSORS", "zlib")
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
+def _database_options() -> Dict[str, Any]:
+    w: Any = os.environ.get("MONGO_WRITE_CONCERN", "1")
+    return {
+        "write_concern": WriteConcern(w=int(w) if w.isdigit() else w),
+        "read_concern": ReadConcern(os.environ.get("MONGO_READ_CONCERN", "local")),
+    }
+
+def connect(event_listeners: Optional[List[monitoring.CommandListener]] = None) -> AsyncIOMotorDatabase:
+    """Create the shared client (idempotent) and return the application database"""
+    global _client, _db
+    if _db is None:
+        _client = AsyncIOMotorClient(
+            os.environ['MONGO_URL'], event_listeners=event_listeners or [], **client_options()
+        )
+        _db = _client.get_database(os.environ['DB_NAME'], **_database_options())
+    return _db
+
+def get_database() -> AsyncIOMotorDatabase:
+    if _db is None:
+        raise RuntimeError("Database not connected: call database.connect() first")
+    return _db
+
+async def warm_up(db: AsyncIOMotorDatabase):
+    """Fail fast if MongoDB is unreachable and open the minimum pool up front"""
+    await db.command("ping")
+    connections = client_options()["minPoolSize"]
+    if connections > 1:
+        await asyncio.gather(*(db.command("ping") for _ in range(connections)))
+    logger.info(f"MongoDB reachable, {connections} pooled connections warmed")
+
+def close():
+    global _client, _db
+    if _client is not None:
+        _client.close()
+    _client, _db = None, None
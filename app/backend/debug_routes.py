@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from models import UserInDB
+from dependencies import get_db, get_current_active_user
+from query_profiler import query_profiler
+import os
+
+router = APIRouter(prefix="/debug", tags=["debug"])
+
+# Diagnostics are off unless explicitly enabled, and only served to the admins listed in ADMIN_EMAILS
+DEBUG_ENDPOINTS = os.environ.get("DEBUG_ENDPOINTS", "false").lower() == "true"
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+def require_debug_enabled():
+    if not DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+async def require_admin(current_user: UserInDB = Depends(get_current_active_user)) -> UserInDB:
+    # Verified (OAuth) emails only, so nobody can claim an admin address by signing up with it first
+    if not current_user.is_verified or current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+# ==================== SLOW QUERIES ====================
+
+@router.get("/slow-queries", dependencies=[Depends(require_debug_enabled)])
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=100),
+    explain: int = Query(0, ge=0, le=10, description="Attach the winning plan to the N worst shapes"),
+    current_user: UserInDB = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Slowest query shapes (values stripped) by total time, with the routes that issued them"""
+    return await query_profiler.report(db, limit=limit, explain=explain)
+
+@router.delete("/slow-queries", dependencies=[Depends(require_debug_enabled)])
+async def reset_slow_queries(
+    current_user: UserInDB = Depends(require_admin)
+):
+    """Start a fresh profiling window"""
+    query_profiler.reset()
+    return {"success": True}
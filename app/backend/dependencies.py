@@ -4,25 +4,14 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional
 from models import UserInDB, TokenData
 from auth_utils import verify_token
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
-from pathlib import Path
-
-# Load environment variables
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
-
-# Database dependency
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+from database import get_database
+from serialization import trusted
 
 security = HTTPBearer()
 
 async def get_db() -> AsyncIOMotorDatabase:
-    """Get database instance"""
-    return db
+    """Get database instance (shared client created in the app lifespan)"""
+    return get_database()
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -45,7 +34,8 @@ async def get_current_user(
     if user is None:
         raise credentials_exception
     
-    return UserInDB(**user)
+    # Written through UserInDB, so it is not revalidated on every request
+    return trusted(UserInDB, user)
 
 async def get_current_active_user(
     current_user: UserInDB = Depends(get_current_user)
@@ -73,4 +63,4 @@ async def get_optional_current_user(
     if user is None:
         return None
     
-    return UserInDB(**user)
+    return trusted(UserInDB, user)
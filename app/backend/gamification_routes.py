@@ -1,53 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import UserInDB
 from dependencies import get_db, get_current_active_user
 from advanced_models import (
-    AchievementModel, UserAchievementModel, LeaderboardEntryModel, GuildModel
+    UserAchievementModel, LeaderboardEntryModel, GuildModel
 )
-from typing import List
+from rank_index import rank_index
+from leaderboards import WINDOWS, get_window_leaderboard
+from guilds import add_member, remove_member
+from achievements import PREDEFINED_ACHIEVEMENTS, ACHIEVEMENT_CATALOG, achievement_engine
+from indexes import index_registry
 from datetime import datetime, timezone
 
 router = APIRouter(prefix="/gamification", tags=["gamification"])
 
+# Global leaderboard sort and rank counts
+index_registry.declare("users", [("xp", -1)])
+
 # ==================== ACHIEVEMENTS ====================
 
-# Predefined achievements
-PREDEFINED_ACHIEVEMENTS = [
-    {"code": "first_quest", "name": "Première Quête", "description": "Complétez votre première quête", "icon": "⚔️", "category": "quest", "requirement": {"quests_completed": 1}, "reward_xp": 50, "reward_coins": 10, "rarity": "common"},
-    {"code": "quest_master", "name": "Maître des Quêtes", "description": "Complétez 50 quêtes", "icon": "🏆", "category": "quest", "requirement": {"quests_completed": 50}, "reward_xp": 500, "reward_coins": 100, "rarity": "epic"},
-    {"code": "streak_7", "name": "Série de 7", "description": "Maintenez une série de 7 jours", "icon": "🔥", "category": "streak", "requirement": {"streak_days": 7}, "reward_xp": 100, "reward_coins": 25, "rarity": "common"},
-    {"code": "streak_30", "name": "Série de 30", "description": "Maintenez une série de 30 jours", "icon": "🔥", "category": "streak", "requirement": {"streak_days": 30}, "reward_xp": 500, "reward_coins": 100, "rarity": "rare"},
-    {"code": "streak_100", "name": "Centenaire", "description": "100 jours consécutifs", "icon": "🌟", "category": "streak", "requirement": {"streak_days": 100}, "reward_xp": 2000, "reward_coins": 500, "rarity": "legendary"},
-    {"code": "xp_1000", "name": "Millier d'XP", "description": "Atteignez 1000 XP", "icon": "⭐", "category": "xp", "requirement": {"total_xp": 1000}, "reward_xp": 0, "reward_coins": 50, "rarity": "common"},
-    {"code": "xp_10000", "name": "Dix Mille", "description": "Atteignez 10000 XP", "icon": "🌟", "category": "xp", "requirement": {"total_xp": 10000}, "reward_xp": 0, "reward_coins": 500, "rarity": "epic"},
-    {"code": "level_10", "name": "Niveau 10", "description": "Atteignez le niveau 10", "icon": "🎯", "category": "level", "requirement": {"level": 10}, "reward_xp": 200, "reward_coins": 50, "rarity": "common"},
-    {"code": "level_50", "name": "Niveau 50", "description": "Atteignez le niveau 50", "icon": "👑", "category": "level", "requirement": {"level": 50}, "reward_xp": 1000, "reward_coins": 250, "rarity": "epic"},
-    {"code": "early_bird", "name": "Lève-tôt", "description": "Complétez 10 tâches avant 8h", "icon": "🌅", "category": "habit", "requirement": {"tasks_before_8am": 10}, "reward_xp": 150, "reward_coins": 30, "rarity": "rare", "secret": True},
-    {"code": "night_owl", "name": "Noctambule", "description": "Complétez 10 tâches après 22h", "icon": "🦉", "category": "habit", "requirement": {"tasks_after_10pm": 10}, "reward_xp": 150, "reward_coins": 30, "rarity": "rare", "secret": True},
-    {"code": "social_butterfly", "name": "Papillon Social", "description": "Rejoignez une guilde", "icon": "🦋", "category": "social", "requirement": {"guilds_joined": 1}, "reward_xp": 100, "reward_coins": 20, "rarity": "common"},
-    {"code": "perfectionist", "name": "Perfectionniste", "description": "Complétez 20 quêtes avec 100% de progression", "icon": "💯", "category": "quest", "requirement": {"perfect_quests": 20}, "reward_xp": 300, "reward_coins": 75, "rarity": "rare"},
-    {"code": "bookworm", "name": "Rat de Bibliothèque", "description": "Créez 50 notes", "icon": "📚", "category": "notes", "requirement": {"notes_created": 50}, "reward_xp": 200, "reward_coins": 50, "rarity": "common"},
-    {"code": "fitness_guru", "name": "Gourou du Fitness", "description": "Complétez 30 sessions d'entraînement", "icon": "🏋️", "category": "training", "requirement": {"training_sessions": 30}, "reward_xp": 400, "reward_coins": 100, "rarity": "rare"},
-]
-
-@router.get("/achievements", response_model=List[dict])
-async def get_all_achievements(
-    db: AsyncIOMotorDatabase = Depends(get_db)
-):
+@router.get("/achievements")
+async def get_all_achievements(request: Request):
     """Get all available achievements"""
-    # Initialize predefined achievements if not exists
-    existing_count = await db.achievements.count_documents({})
-    
-    if existing_count == 0:
-        # Insert predefined achievements
-        for ach in PREDEFINED_ACHIEVEMENTS:
-            ach_model = AchievementModel(**ach, id=ach['code'])
-            doc = ach_model.model_dump()
-            await db.achievements.insert_one(doc)
-    
-    achievements = await db.achievements.find({}, {"_id": 0}).to_list(1000)
-    return achievements
+    # Seeded at startup; served from the pre-serialized in-memory catalog
+    return ACHIEVEMENT_CATALOG.response(request)
 
 @router.get("/my-achievements")
 async def get_user_achievements(
@@ -90,22 +66,59 @@ async def get_leaderboard(
     
     return {"leaderboard": leaderboard}
 
+@router.get("/leaderboard/{window}")
+async def get_windowed_leaderboard(
+    window: str,
+    bucket: str = None,
+    limit: int = 100,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get daily, weekly or monthly leaderboard (current period by default)"""
+    if window not in WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Invalid window. Allowed: {list(WINDOWS)}")
+    
+    return await get_window_leaderboard(db, window, bucket, limit)
+
 @router.get("/my-rank")
 async def get_my_rank(
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get current user's rank"""
-    # Count users with more XP
-    higher_rank_count = await db.users.count_documents({"xp": {"$gt": current_user.xp}})
+    if not rank_index.ready:
+        # Index still loading: fall back to counting users with more XP
+        higher_rank_count = await db.users.count_documents({"xp": {"$gt": current_user.xp}})
+        rank = higher_rank_count + 1
+    else:
+        # Fresh XP from the auth lookup also corrects drift from other workers
+        rank_index.update(current_user.id, current_user.xp)
+        rank = rank_index.rank(current_user.xp)
     
     return {
-        "rank": higher_rank_count + 1,
+        "rank": rank,
         "username": current_user.username,
         "xp": current_user.xp,
         "level": current_user.level
     }
 
+@router.get("/my-percentile")
+async def get_my_percentile(
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Get current user's percentile (useful outside the top N)"""
+    if not rank_index.ready:
+        raise HTTPException(status_code=503, detail="Rank index is loading")
+    
+    rank_index.update(current_user.id, current_user.xp)
+    
+    return {
+        "rank": rank_index.rank(current_user.xp),
+        "total_users": rank_index.total,
+        "top_percent": rank_index.percentile(current_user.xp),
+        "xp": current_user.xp,
+        "level": current_user.level
+    }
+
 # ==================== GUILDS ====================
 
 @router.post("/guilds")
@@ -121,24 +134,48 @@ async def create_guild(
         name=name,
         description=description,
         icon=icon,
-        owner_id=current_user.id,
-        member_ids=[current_user.id]
+        owner_id=current_user.id
     )
     
     doc = guild.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.guilds.insert_one(doc)
+    await add_member(db, guild.id, current_user.id, role="owner")
+    await achievement_engine.record(db, current_user.id, inc={"guilds_joined": 1})
     
     return {"success": True, "guild_id": guild.id}
 
 @router.get("/guilds")
 async def get_guilds(
+    skip: int = 0,
+    limit: int = 20,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get guilds (paginated, by total XP)"""
+    limit = max(1, min(limit, 100))
+    guilds = await db.guilds.find(
+        {},
+        {"_id": 0, "member_ids": 0}
+    ).sort("total_xp", -1).skip(max(skip, 0)).limit(limit).to_list(limit)
+    
+    return {"guilds": guilds, "skip": skip, "limit": limit}
+
+@router.get("/guilds/{guild_id}/members")
+async def get_guild_members(
+    guild_id: str,
+    skip: int = 0,
+    limit: int = 50,
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Get all guilds"""
-    guilds = await db.guilds.find({}, {"_id": 0}).to_list(1000)
-    return {"guilds": guilds}
+    """Get guild members (paginated)"""
+    limit = max(1, min(limit, 200))
+    members = await db.guild_members.find(
+        {"guild_id": guild_id},
+        {"_id": 0}
+    ).sort("joined_at", 1).skip(max(skip, 0)).limit(limit).to_list(limit)
+    
+    return {"members": members, "skip": skip, "limit": limit}
 
 @router.post("/guilds/{guild_id}/join")
 async def join_guild(
@@ -147,17 +184,26 @@ async def join_guild(
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Join a guild"""
-    guild = await db.guilds.find_one({"id": guild_id})
+    guild = await db.guilds.find_one({"id": guild_id}, {"_id": 0, "id": 1})
     
     if not guild:
         raise HTTPException(status_code=404, detail="Guild not found")
     
-    if current_user.id in guild.get("member_ids", []):
+    if not await add_member(db, guild_id, current_user.id):
         return {"success": True, "message": "Already a member"}
     
-    await db.guilds.update_one(
-        {"id": guild_id},
-        {"$addToSet": {"member_ids": current_user.id}}
-    )
+    await achievement_engine.record(db, current_user.id, inc={"guilds_joined": 1})
     
     return {"success": True, "message": "Joined guild"}
+
+@router.post("/guilds/{guild_id}/leave")
+async def leave_guild(
+    guild_id: str,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Leave a guild"""
+    if not await remove_member(db, guild_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Not a member of this guild")
+    
+    return {"success": True, "message": "Left guild"}
@@ -160,7 +160,6 @@ async def verify_google_token(
         
         token_dict = refresh_token_doc.model_dump()
         token_dict['created_at'] = token_dict['created_at'].isoformat()
-        token_dict['expires_at'] = token_dict['expires_at'].isoformat()
         
         await db.refresh_tokens.insert_one(token_dict)
         
@@ -0,0 +1,143 @@
+"""
+Guild membership and guild XP rollups.
+
+Members are stored one document per (guild, user) in `guild_members` rather
+than in an unbounded array on the guild. Each guild keeps a `member_count`
+that is recounted from `guild_members` after every join or leave (so a
+missed update is repaired by the next one) and reconciled for every guild at
+startup. When the owner leaves, ownership passes to the longest-standing
+member; a guild whose last member leaves is deleted. Guild
+`total_xp`/`level` are updated incrementally as members earn XP, from the
+`xp_awarded` events of the outbox (see `xp_service`).
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from advanced_models import GuildMemberModel
+from indexes import index_registry
+import logging
+
+logger = logging.getLogger(__name__)
+
+GUILD_XP_PER_LEVEL = 1000
+
+index_registry.declare("guild_members", [("guild_id", 1), ("user_id", 1)], unique=True)
+index_registry.declare("guild_members", "user_id")
+index_registry.declare("guild_members", [("guild_id", 1), ("joined_at", 1)])
+index_registry.declare("guilds", [("total_xp", -1)])
+index_registry.declare("guilds", "id", unique=True)
+
+def _member_doc(guild_id: str, user_id: str, role: str = "member") -> dict:
+    member = GuildMemberModel(guild_id=guild_id, user_id=user_id, role=role)
+    doc = member.model_dump()
+    doc['joined_at'] = doc['joined_at'].isoformat()
+    return doc
+
+async def add_member(db: AsyncIOMotorDatabase, guild_id: str, user_id: str, role: str = "member") -> bool:
+    """Add a member; returns False if already a member"""
+    try:
+        await db.guild_members.insert_one(_member_doc(guild_id, user_id, role))
+    except DuplicateKeyError:
+        return False
+    await _recount(db, guild_id)
+    return True
+
+async def remove_member(db: AsyncIOMotorDatabase, guild_id: str, user_id: str) -> bool:
+    """Remove a member, handing ownership over if needed; returns False if not a member"""
+    member = await db.guild_members.find_one_and_delete(
+        {"guild_id": guild_id, "user_id": user_id},
+        projection={"_id": 0, "role": 1}
+    )
+    if member is None:
+        return False
+    if member.get("role") == "owner":
+        await _transfer_ownership(db, guild_id)
+    await _recount(db, guild_id)
+    return True
+
+async def _transfer_ownership(db: AsyncIOMotorDatabase, guild_id: str):
+    """Promote the longest-standing member, or delete the guild once nobody is left"""
+    successor = await db.guild_members.find_one(
+        {"guild_id": guild_id},
+        {"_id": 0, "user_id": 1},
+        sort=[("joined_at", 1)]
+    )
+    if successor is None:
+        await db.guilds.delete_one({"id": guild_id})
+        return
+    await db.guild_members.update_one(
+        {"guild_id": guild_id, "user_id": successor["user_id"]}, {"$set": {"role": "owner"}}
+    )
+    await db.guilds.update_one({"id": guild_id}, {"$set": {"owner_id": successor["user_id"]}})
+
+async def _recount(db: AsyncIOMotorDatabase, guild_id: str):
+    count = await db.guild_members.count_documents({"guild_id": guild_id})
+    await db.guilds.update_one({"id": guild_id}, {"$set": {"member_count": count}})
+
+async def reconcile_member_counts(db: AsyncIOMotorDatabase) -> int:
+    """Reset every guild's member_count from guild_members; returns how many were off"""
+    counts = {
+        doc["_id"]: doc["count"]
+        async for doc in db.guild_members.aggregate([
+            {"$group": {"_id": "$guild_id", "count": {"$sum": 1}}}
+        ])
+    }
+    fixes = [
+        UpdateOne({"id": guild["id"]}, {"$set": {"member_count": counts.get(guild["id"], 0)}})
+        async for guild in db.guilds.find({}, {"_id": 0, "id": 1, "member_count": 1})
+        if guild.get("member_count") != counts.get(guild["id"], 0)
+    ]
+    if fixes:
+        await db.guilds.bulk_write(fixes, ordered=False)
+        logger.info(f"Reconciled member_count of {len(fixes)} guilds")
+    return len(fixes)
+
+async def record_member_xp(db: AsyncIOMotorDatabase, user_id: str, amount: int):
+    """Add a member's XP gain to every guild they belong to"""
+    if not amount:
+        return
+    memberships = await db.guild_members.find(
+        {"user_id": user_id},
+        {"_id": 0, "guild_id": 1}
+    ).to_list(100)
+    if not memberships:
+        return
+    guild_ids = [m["guild_id"] for m in memberships]
+
+    await db.guild_members.update_many(
+        {"user_id": user_id},
+        {"$inc": {"xp_contributed": amount}}
+    )
+    # Pipeline update: total_xp and the level derived from it change atomically
+    await db.guilds.update_many(
+        {"id": {"$in": guild_ids}},
+        [
+            {"$set": {"total_xp": {"$add": [{"$ifNull": ["$total_xp", 0]}, amount]}}},
+            {"$set": {"level": {"$add": [1, {"$floor": {"$divide": ["$total_xp", GUILD_XP_PER_LEVEL]}}]}}},
+        ]
+    )
+
+async def migrate_legacy_members(db: AsyncIOMotorDatabase):
+    """Move embedded member_ids arrays into guild_members (idempotent)"""
+    async for guild in db.guilds.find({"member_ids": {"$exists": True}}, {"_id": 0, "id": 1, "owner_id": 1, "member_ids": 1}):
+        ops = [
+            InsertOne(_member_doc(guild["id"], user_id, "owner" if user_id == guild.get("owner_id") else "member"))
+            for user_id in guild.get("member_ids", [])
+        ]
+        if ops:
+            try:
+                await db.guild_members.bulk_write(ops, ordered=False)
+            except BulkWriteError:
+                pass  # already migrated members
+        count = await db.guild_members.count_documents({"guild_id": guild["id"]})
+        await db.guilds.update_one(
+            {"id": guild["id"]},
+            {"$set": {"member_count": count}, "$unset": {"member_ids": ""}}
+        )
+
+async def setup_guilds(db: AsyncIOMotorDatabase):
+    try:
+        await migrate_legacy_members(db)
+        await reconcile_member_counts(db)
+    except Exception as e:
+        logger.error(f"Guild setup failed: {e}")
@@ -0,0 +1,168 @@
+"""
+Vectorized habit analytics.
+
+Computes moving averages, trend slopes, streak statistics and mood-vs-habit
+correlations from `habit_metrics` and `mood_entries` with numpy/pandas, so
+clients get chart-ready series instead of pulling raw history. Entries are
+first reduced to one point per (series, UTC day) by a `$group` in Mongo, so
+only the daily series leave the database. Results are cached per user and
+invalidated when new entries are logged.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Dict, List, Any, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import asyncio
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 1024
+MAX_WINDOW_DAYS = 365
+
+DAY_BUCKET = {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}
+
+_cache: "OrderedDict[Tuple[str, int], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def invalidate(user_id: str):
+    for key in [k for k in _cache if k[0] == user_id]:
+        del _cache[key]
+
+# ==================== COMPUTATION ====================
+
+def _clean(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(v) else round(float(v), 4) for v in values]
+
+def _slopes(frame: pd.DataFrame) -> pd.Series:
+    """Least-squares slope (units/day) of every column at once, ignoring NaNs"""
+    x = np.arange(len(frame), dtype=float)[:, None]
+    y = frame.to_numpy(dtype=float)
+    mask = ~np.isnan(y)
+    n = mask.sum(axis=0)
+    xm = np.where(mask, x, 0.0)
+    ym = np.where(mask, y, 0.0)
+    sx, sy = xm.sum(axis=0), ym.sum(axis=0)
+    sxx, sxy = (xm * xm).sum(axis=0), (xm * ym).sum(axis=0)
+    denom = n * sxx - sx * sx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where((n >= 2) & (denom != 0), (n * sxy - sx * sy) / denom, np.nan)
+    return pd.Series(slope, index=frame.columns)
+
+def _streaks(active: pd.DataFrame) -> Dict[str, Dict[str, int]]:
+    """Current/longest run of consecutive active days per column"""
+    stats = {}
+    values = active.to_numpy(dtype=bool)
+    for idx, column in enumerate(active.columns):
+        col = values[:, idx]
+        # Run lengths: cumulative count reset at every inactive day
+        resets = np.cumsum(~col)
+        runs = np.bincount(resets[col]) if col.any() else np.array([0])
+        current = 0 if not col[-1] else int((col[::-1].cumprod()).sum())
+        stats[column] = {"current": current, "longest": int(runs.max()), "active_days": int(col.sum())}
+    return stats
+
+def compute_analytics(
+    moods: List[Dict[str, Any]],
+    metrics: List[Dict[str, Any]],
+    days: int,
+    today: Optional[datetime] = None
+) -> Dict[str, Any]:
+    today = (today or datetime.now(timezone.utc)).date()
+    index = pd.date_range(end=pd.Timestamp(today), periods=days, freq="D")
+    dates = [d.strftime("%Y-%m-%d") for d in index]
+
+    def daily(frame: pd.DataFrame, columns: List[str], agg: str) -> pd.DataFrame:
+        if frame.empty:
+            return pd.DataFrame(index=index, columns=columns, dtype=float)
+        frame = frame.assign(day=pd.to_datetime(frame["date"], utc=True).dt.tz_localize(None).dt.normalize())
+        table = frame.pivot_table(index="day", columns="series", values="value", aggfunc=agg)
+        return table.reindex(index=index)
+
+    mood_frame = pd.DataFrame(
+        [{"date": m["date"], "series": "mood", "value": m["energy_level"]} for m in moods],
+        columns=["date", "series", "value"]
+    )
+    metric_frame = pd.DataFrame(
+        [{"date": m["date"], "series": f"{m['habit_id']}|{m['metric_type']}", "value": m["value"]} for m in metrics],
+        columns=["date", "series", "value"]
+    )
+    mood_daily = daily(mood_frame, ["mood"], "mean")
+    metric_daily = daily(metric_frame, [], "sum")
+
+    combined = pd.concat([mood_daily, metric_daily], axis=1)
+    ma7 = combined.rolling(7, min_periods=1).mean()
+    ma30 = combined.rolling(30, min_periods=1).mean()
+    slopes = _slopes(combined)
+    mood_series = combined["mood"] if "mood" in combined else pd.Series(np.nan, index=index)
+    with warnings.catch_warnings():
+        # Series with fewer than two overlapping days correlate to NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        correlations = metric_daily.corrwith(mood_series) if not metric_daily.empty else pd.Series(dtype=float)
+    streaks = _streaks(metric_daily.notna()) if not metric_daily.empty else {}
+
+    def series_payload(column: str) -> Dict[str, Any]:
+        return {
+            "daily": _clean(combined[column].to_numpy()),
+            "ma7": _clean(ma7[column].to_numpy()),
+            "ma30": _clean(ma30[column].to_numpy()),
+            "trend_per_day": _clean(np.array([slopes[column]]))[0],
+        }
+
+    habits = []
+    for column in metric_daily.columns:
+        habit_id, metric_type = column.split("|", 1)
+        corr = correlations.get(column, np.nan)
+        habits.append({
+            "habit_id": habit_id,
+            "metric_type": metric_type,
+            **series_payload(column),
+            "streak": streaks.get(column),
+            "mood_correlation": None if pd.isna(corr) else round(float(corr), 4),
+        })
+
+    return {
+        "window_days": days,
+        "dates": dates,
+        "mood": series_payload("mood") if "mood" in combined else None,
+        "habits": habits,
+    }
+
+# ==================== SERVICE ====================
+
+async def get_analytics(db: AsyncIOMotorDatabase, user_id: str, days: int = 90) -> Dict[str, Any]:
+    days = max(7, min(days, MAX_WINDOW_DAYS))
+    cached = _cache.get((user_id, days))
+    if cached and time.monotonic() - cached[0] < CACHE_TTL_SECONDS:
+        return cached[1]
+
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    match = {"$match": {"user_id": user_id, "date": {"$gte": since}}}
+    # Daily mean mood and daily metric totals: what compute_analytics reduces them to
+    moods = [
+        {"date": doc["_id"], "energy_level": doc["energy_level"]}
+        async for doc in db.mood_entries.aggregate([
+            match,
+            {"$group": {"_id": DAY_BUCKET, "energy_level": {"$avg": "$energy_level"}}},
+        ])
+    ]
+    metrics = [
+        {"date": doc["_id"]["day"], "habit_id": doc["_id"]["habit_id"],
+         "metric_type": doc["_id"]["metric_type"], "value": doc["value"]}
+        async for doc in db.habit_metrics.aggregate([
+            match,
+            {"$group": {
+                "_id": {"day": DAY_BUCKET, "habit_id": "$habit_id", "metric_type": "$metric_type"},
+                "value": {"$sum": "$value"},
+            }},
+        ])
+    ]
+
+    # pandas work is CPU-bound: keep it off the event loop
+    result = await asyncio.to_thread(compute_analytics, moods, metrics, days)
+    _cache[(user_id, days)] = (time.monotonic(), result)
+    while len(_cache) > CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+    return result
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import UserInDB
 from dependencies import get_db, get_current_active_user
 from advanced_models import MoodEntryModel, HabitMetricModel
-from datetime import datetime, timezone
+from timeseries import (
+    PERIODS, MOOD_SERIES, metric_series, mood_point, metric_point,
+    update_rollups, date_range, get_rollups, rollup_gate
+)
+from habit_analytics import get_analytics, invalidate as invalidate_analytics
+from ingest import iter_items, ingest_moods, ingest_metrics
+from streaks import record_completion, get_streaks, get_zone
+from typing import Optional
+from datetime import datetime
 
 router = APIRouter(prefix="/habits-advanced", tags=["habits-advanced"])
 
@@ -27,24 +35,52 @@ async def log_mood(
         notes=notes
     )
     
+    # Real BSON date so history can be range-queried
     doc = mood_entry.model_dump()
-    doc['date'] = doc['date'].isoformat()
     
+    await rollup_gate.wait(db)
     await db.mood_entries.insert_one(doc)
+    await update_rollups(db, current_user.id, [mood_point(doc)])
+    invalidate_analytics(current_user.id)
     
     return {"success": True, "mood_id": mood_entry.id}
 
+@router.post("/mood/batch")
+async def log_mood_batch(
+    request: Request,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Log many mood entries from a JSON array or an NDJSON stream"""
+    try:
+        result = await ingest_moods(db, current_user.id, iter_items(request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result["inserted"]:
+        invalidate_analytics(current_user.id)
+    
+    return result
+
 @router.get("/mood")
 async def get_mood_history(
     days: int = 30,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 1000,
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Get mood history"""
+    """Get mood history over the last `days` days (or a start/end range), newest first"""
+    query = {"user_id": current_user.id}
+    window = date_range(days, start, end)
+    if window:
+        query["date"] = window
+    
+    limit = max(1, min(limit, 5000))
     moods = await db.mood_entries.find(
-        {"user_id": current_user.id},
+        query,
         {"_id": 0}
-    ).sort("date", -1).limit(days).to_list(days)
+    ).sort("date", -1).limit(limit).to_list(limit)
     
     return {"moods": moods}
 
@@ -69,22 +105,113 @@ async def log_metric(
     )
     
     doc = metric.model_dump()
-    doc['date'] = doc['date'].isoformat()
     
+    await rollup_gate.wait(db)
     await db.habit_metrics.insert_one(doc)
+    await update_rollups(db, current_user.id, [metric_point(doc)])
+    invalidate_analytics(current_user.id)
     
     return {"success": True, "metric_id": metric.id}
 
+@router.post("/metrics/batch")
+async def log_metric_batch(
+    request: Request,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Log many habit metrics (e.g. wearable imports) from a JSON array or an NDJSON stream"""
+    try:
+        result = await ingest_metrics(db, current_user.id, iter_items(request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result["inserted"]:
+        invalidate_analytics(current_user.id)
+    
+    return result
+
 @router.get("/metrics/{habit_id}")
 async def get_metrics(
     habit_id: str,
+    days: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 1000,
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Get metrics for a habit"""
+    """Get metrics for a habit (optionally within a date range)"""
+    query = {"user_id": current_user.id, "habit_id": habit_id}
+    window = date_range(days, start, end)
+    if window:
+        query["date"] = window
+    
+    limit = max(1, min(limit, 5000))
     metrics = await db.habit_metrics.find(
-        {"user_id": current_user.id, "habit_id": habit_id},
+        query,
         {"_id": 0}
-    ).sort("date", -1).to_list(1000)
+    ).sort("date", -1).limit(limit).to_list(limit)
     
     return {"metrics": metrics}
+
+# ==================== ROLLUPS ====================
+
+@router.get("/rollups")
+async def get_series_rollups(
+    period: str = "daily",
+    habit_id: Optional[str] = None,
+    metric_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get precomputed mean/min/max/count per period for mood (default) or a habit metric"""
+    if period not in PERIODS:
+        raise HTTPException(status_code=400, detail=f"Invalid period. Allowed: {list(PERIODS)}")
+    
+    if habit_id and metric_type:
+        series = metric_series(habit_id, metric_type)
+    else:
+        series = MOOD_SERIES
+    
+    rollups = await get_rollups(db, current_user.id, series, period, start, end)
+    
+    return {"series": series, "period": period, "rollups": rollups}
+
+# ==================== ANALYTICS ====================
+
+@router.get("/analytics")
+async def get_habit_analytics(
+    days: int = 90,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get moving averages, trends, streaks and mood correlations (chart-ready)"""
+    return await get_analytics(db, current_user.id, days)
+
+# ==================== STREAKS ====================
+
+@router.post("/habits/{habit_id}/complete")
+async def complete_habit(
+    habit_id: str,
+    tz: str = "UTC",
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Record a habit completion and return the updated streaks"""
+    try:
+        get_zone(tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    streaks = await record_completion(db, current_user.id, habit_id, tz=tz)
+    
+    return {"success": True, **streaks}
+
+@router.get("/streaks")
+async def get_habit_streaks(
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get current/longest streak per habit and overall"""
+    return await get_streaks(db, current_user.id)
@@ -0,0 +1,212 @@
+"""
+Declarative index registry.
+
+Modules declare the indexes their queries need next to those queries
+(`index_registry.declare(...)` at import time) instead of calling
+`create_index` from scattered startup hooks. `reconcile()` compares the
+declarations with what the server has and only creates missing indexes or
+rebuilds ones whose options changed, so it is idempotent and cheap to run
+on every startup. Indexes found on the server but not declared are
+reported, and dropped only when asked to.
+
+    python indexes.py               # reconcile
+    python indexes.py --dry-run     # report what would change
+    python indexes.py --prune       # also drop undeclared indexes
+    python indexes.py explain       # check the hot queries use an index
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from dataclasses import dataclass
+from typing import Dict, List, Any, Iterable, Optional, Tuple, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Directions are 1/-1, or index types such as "text", "2dsphere" and "hashed"
+Keys = Tuple[Tuple[str, Union[int, str]], ...]
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: Keys
+    unique: bool = False
+    expire_after_seconds: Optional[int] = None
+    sparse: bool = False
+
+    @property
+    def name(self) -> str:
+        # Same naming scheme as pymongo's create_index
+        return "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+    def options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {}
+        if self.unique:
+            options["unique"] = True
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        if self.sparse:
+            options["sparse"] = True
+        return options
+
+    def model(self) -> IndexModel:
+        return IndexModel(list(self.keys), name=self.name, **self.options())
+
+def _direction(value: Any) -> Union[int, str]:
+    # Servers may report numeric directions as floats (1.0)
+    return value if isinstance(value, str) else int(value)
+
+def _canonical(keys: Iterable[Tuple[str, Any]]) -> Keys:
+    """Text fields form one block in field-name order, since the server does not keep their order"""
+    keys = [(field, _direction(direction)) for field, direction in keys]
+    text = sorted(key for key in keys if key[1] == "text")
+    if not text:
+        return tuple(keys)
+    position = next(i for i, key in enumerate(keys) if key[1] == "text")
+    rest = [key for key in keys if key[1] != "text"]
+    return tuple(rest[:position] + text + rest[position:])
+
+def _existing_keys(info: Dict[str, Any]) -> Keys:
+    keys = list(info["key"])
+    if info.get("weights"):
+        # Text indexes are stored as _fts/_ftsx: report the indexed fields as declared
+        position = next((i for i, (field, _) in enumerate(keys) if field == "_fts"), len(keys))
+        keys = [key for key in keys if key[0] not in ("_fts", "_ftsx")]
+        keys[position:position] = [(field, "text") for field in info["weights"]]
+    return _canonical(keys)
+
+def _existing_options(info: Dict[str, Any]) -> Dict[str, Any]:
+    options: Dict[str, Any] = {}
+    if info.get("unique"):
+        options["unique"] = True
+    if info.get("expireAfterSeconds") is not None:
+        options["expireAfterSeconds"] = int(info["expireAfterSeconds"])
+    if info.get("sparse"):
+        options["sparse"] = True
+    return options
+
+class IndexRegistry:
+    def __init__(self):
+        self.specs: Dict[str, Dict[Keys, IndexSpec]] = {}
+
+    def declare(
+        self,
+        collection: str,
+        keys: Union[str, List[Tuple[str, Union[int, str]]]],
+        unique: bool = False,
+        ttl_seconds: Optional[int] = None,
+        sparse: bool = False
+    ) -> IndexSpec:
+        """Register an index; a single field name means an ascending index on it"""
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        spec = IndexSpec(collection, _canonical(keys), unique, ttl_seconds, sparse)
+        self.specs.setdefault(collection, {})[spec.keys] = spec
+        return spec
+
+    async def reconcile(
+        self,
+        db: AsyncIOMotorDatabase,
+        collections: Optional[Iterable[str]] = None,
+        dry_run: bool = False,
+        prune: bool = False
+    ) -> Dict[str, List[str]]:
+        """Bring the server in line with the declarations; returns what was (or would be) changed"""
+        report: Dict[str, List[str]] = {"created": [], "rebuilt": [], "extra": [], "failed": []}
+        for collection in sorted(collections or self.specs):
+            declared = self.specs.get(collection, {})
+            existing = await db[collection].index_information()
+            by_keys = {_existing_keys(info): (name, info) for name, info in existing.items() if name != "_id_"}
+
+            missing: List[IndexSpec] = []
+            for keys, spec in declared.items():
+                label = f"{collection}.{spec.name}"
+                if keys not in by_keys:
+                    missing.append(spec)
+                    report["created"].append(label)
+                    continue
+                name, info = by_keys.pop(keys)
+                if _existing_options(info) == spec.options():
+                    continue
+                report["rebuilt"].append(label)
+                if not dry_run:
+                    await db[collection].drop_index(name)
+                    missing.append(spec)
+
+            for name, _ in by_keys.values():
+                report["extra"].append(f"{collection}.{name}")
+                if prune and not dry_run:
+                    await db[collection].drop_index(name)
+
+            if missing and not dry_run:
+                try:
+                    await db[collection].create_indexes([spec.model() for spec in missing])
+                except OperationFailure:
+                    # e.g. duplicates blocking a unique index: build the others one by one
+                    for spec in missing:
+                        try:
+                            await db[collection].create_indexes([spec.model()])
+                        except OperationFailure as e:
+                            logger.warning(f"Could not build index {collection}.{spec.name}: {e}")
+                            report["failed"].append(f"{collection}.{spec.name}")
+        return report
+
+
+index_registry = IndexRegistry()
+
+# Representative shapes of the hot queries, checked by `python indexes.py explain`
+HOT_QUERIES: List[Tuple[str, Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    ("users", {"id": "u"}, None),
+    ("users", {"email": "a@b.c"}, None),
+    ("users", {}, [("xp", -1)]),
+    ("users", {"xp": {"$gt": 100}}, None),
+    ("refresh_tokens", {"token": "t", "revoked": False}, None),
+    ("backlinks", {"user_id": "u", "target_id": "n"}, None),
+    ("pomodoro_sessions", {"user_id": "u", "completed": False, "expired": {"$ne": True}}, [("started_at", -1)]),
+    ("habits", {"user_id": "u"}, None),
+    ("notes", {"id": "n", "user_id": "u"}, None),
+    ("note_postings", {"user_id": "u", "term": "t"}, [("tf", -1)]),
+    ("integrations", {"user_id": "u"}, None),
+    ("webhooks", {"user_id": "u"}, None),
+]
+
+def _stages(plan: Dict[str, Any]) -> List[str]:
+    stages = [plan.get("stage", "")]
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        stages.extend(_stages(child))
+    return stages
+
+async def explain_hot_queries(db: AsyncIOMotorDatabase) -> List[Tuple[str, bool]]:
+    """(description, uses an index) for every hot query"""
+    results = []
+    for collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = (await cursor.explain())["queryPlanner"]["winningPlan"]
+        plan = plan.get("queryPlan", plan)  # slot-based engine nests the plan tree
+        stages = _stages(plan)
+        results.append((f"{collection} {query} sort={sort}", "IXSCAN" in stages and "COLLSCAN" not in stages))
+    return results
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    from database import connect
+    import server  # noqa: F401 - importing the app registers every module's declarations
+
+    async def main():
+        db = connect()
+        if "explain" in sys.argv[1:]:
+            results = await explain_hot_queries(db)
+            for description, indexed in results:
+                print(f"{'ok      ' if indexed else 'COLLSCAN'} {description}")
+            return all(indexed for _, indexed in results)
+        report = await index_registry.reconcile(db, dry_run="--dry-run" in sys.argv, prune="--prune" in sys.argv)
+        for action, labels in report.items():
+            for label in labels:
+                print(f"{action:8} {label}")
+        return not report["failed"]
+
+    sys.exit(0 if asyncio.run(main()) else 1)
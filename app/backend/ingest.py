@@ -0,0 +1,211 @@
+"""
+Bulk ingestion of mood entries and habit metrics.
+
+Wearable and fitness imports post many points at once, either as a JSON
+array (or `{"entries": [...]}`) or as an NDJSON stream. NDJSON is read line
+by line, so memory stays bounded by the chunk size; a JSON body has to be
+parsed whole and is therefore refused above MAX_JSON_BODY_BYTES (larger
+imports must use NDJSON). Items are validated
+one by one with module-level TypeAdapters (built once, not per request) so
+a bad point is reported by index instead of failing the batch, and valid
+documents are written with chunked unordered `insert_many`. Rollups are
+updated once per chunk, right after its insert, both behind
+`timeseries.rollup_gate`.
+
+`python ingest.py bench [count]` prints validation and insert (into an
+in-memory mongomock database) throughput in points/sec.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import TypeAdapter, ValidationError
+from pymongo.errors import BulkWriteError
+from fastapi import Request
+from typing import Dict, List, Any, AsyncIterator, Callable, Tuple
+from advanced_models import MoodEntryModel, HabitMetricModel
+from timeseries import mood_point, metric_point, update_rollups, rollup_gate
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+MAX_BATCH_ITEMS = 50000
+MAX_REPORTED_ERRORS = 100
+MAX_JSON_BODY_BYTES = 8 * 1024 * 1024
+MAX_LINE_BYTES = 64 * 1024
+
+MOOD_ADAPTER = TypeAdapter(MoodEntryModel)
+METRIC_ADAPTER = TypeAdapter(HabitMetricModel)
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# ==================== PARSING ====================
+
+async def iter_items(request: Request) -> AsyncIterator[Any]:
+    """Yield raw items from an NDJSON stream or a JSON array body"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in NDJSON_TYPES:
+        buffer = b""
+        skipping = False  # inside an over-long line, dropped up to its newline
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if skipping:
+                    skipping = False
+                elif line.strip():
+                    yield _parse_line(line)
+            if len(buffer) > MAX_LINE_BYTES:
+                if not skipping:
+                    yield _BadLine(f"Line longer than {MAX_LINE_BYTES} bytes")
+                skipping, buffer = True, b""
+        if buffer.strip() and not skipping:
+            yield _parse_line(buffer)
+        return
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_JSON_BODY_BYTES:
+            raise ValueError(f"JSON bodies are limited to {MAX_JSON_BODY_BYTES} bytes; send larger batches as NDJSON")
+    try:
+        body = json.loads(body or b"[]")
+    except ValueError:
+        raise ValueError("Body must be a JSON array or NDJSON")
+    if isinstance(body, dict):
+        body = body.get("entries")
+    if not isinstance(body, list):
+        raise ValueError("Body must be a JSON array or an object with an 'entries' array")
+    for item in body:
+        yield item
+
+class _BadLine:
+    def __init__(self, detail: str):
+        self.detail = detail
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return _BadLine(f"Invalid JSON: {e}")
+
+# ==================== VALIDATION ====================
+
+def validate_item(adapter: TypeAdapter, user_id: str, item: Any) -> Dict[str, Any]:
+    """Validated document for one raw item (ids and ownership are server-assigned)"""
+    if isinstance(item, _BadLine):
+        raise ValueError(item.detail)
+    if not isinstance(item, dict):
+        raise ValueError("Entry must be an object")
+    data = {k: v for k, v in item.items() if k not in ("id", "user_id")}
+    data["user_id"] = user_id
+    return adapter.validate_python(data).model_dump()
+
+def _error_detail(error: Exception) -> Any:
+    if isinstance(error, ValidationError):
+        return [{"loc": list(e["loc"]), "msg": e["msg"]} for e in error.errors()]
+    return str(error)
+
+# ==================== WRITE PATH ====================
+
+async def _insert_chunk(collection, chunk: List[Tuple[int, Dict[str, Any]]], errors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Unordered insert; returns the documents that were written"""
+    docs = [doc for _, doc in chunk]
+    try:
+        await collection.insert_many(docs, ordered=False)
+        return docs
+    except BulkWriteError as e:
+        failed = {err["index"]: err.get("errmsg", "Write failed") for err in e.details.get("writeErrors", [])}
+        for position, message in failed.items():
+            errors.append({"index": chunk[position][0], "detail": message})
+        return [doc for position, doc in enumerate(docs) if position not in failed]
+
+async def ingest(
+    db: AsyncIOMotorDatabase,
+    user_id: str,
+    items: AsyncIterator[Any],
+    adapter: TypeAdapter,
+    collection_name: str,
+    to_point: Callable[[Dict[str, Any]], Tuple[str, Any, float]]
+) -> Dict[str, Any]:
+    collection = db[collection_name]
+    errors: List[Dict[str, Any]] = []
+    chunk: List[Tuple[int, Dict[str, Any]]] = []
+    inserted = 0
+    received = 0
+
+    async def flush():
+        nonlocal inserted
+        await rollup_gate.wait(db)
+        written = await _insert_chunk(collection, chunk, errors)
+        inserted += len(written)
+        if written:
+            await update_rollups(db, user_id, [to_point(doc) for doc in written])
+        chunk.clear()
+
+    async for item in items:
+        if received >= MAX_BATCH_ITEMS:
+            errors.append({"index": received, "detail": f"Batch truncated at {MAX_BATCH_ITEMS} entries"})
+            break
+        index = received
+        received += 1
+        try:
+            chunk.append((index, validate_item(adapter, user_id, item)))
+        except (ValidationError, ValueError) as e:
+            errors.append({"index": index, "detail": _error_detail(e)})
+            continue
+        if len(chunk) >= CHUNK_SIZE:
+            await flush()
+    if chunk:
+        await flush()
+
+    errors.sort(key=lambda e: e["index"])
+    return {
+        "success": not errors,
+        "received": received,
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS]
+    }
+
+async def ingest_moods(db: AsyncIOMotorDatabase, user_id: str, items: AsyncIterator[Any]) -> Dict[str, Any]:
+    return await ingest(db, user_id, items, MOOD_ADAPTER, "mood_entries", mood_point)
+
+async def ingest_metrics(db: AsyncIOMotorDatabase, user_id: str, items: AsyncIterator[Any]) -> Dict[str, Any]:
+    return await ingest(db, user_id, items, METRIC_ADAPTER, "habit_metrics", metric_point)
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    import time
+
+    if sys.argv[1:2] != ["bench"]:
+        print("Usage: python ingest.py bench [count]")
+        sys.exit(1)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    raw = [
+        {"habit_id": "h1", "metric_type": "heart_rate", "value": 60 + i % 40, "unit": "bpm",
+         "date": f"2024-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}Z"}
+        for i in range(count)
+    ]
+    started = time.perf_counter()
+    docs = [validate_item(METRIC_ADAPTER, "bench", item) for item in raw]
+    points = [metric_point(doc) for doc in docs]
+    elapsed = time.perf_counter() - started
+    print(f"Validated {count} points in {elapsed:.3f}s ({count / elapsed:,.0f} points/sec)")
+
+    async def insert_all():
+        from mongomock_motor import AsyncMongoMockClient
+
+        async def items():
+            for item in raw:
+                yield item
+
+        db = AsyncMongoMockClient()["ingest_bench"]
+        started = time.perf_counter()
+        result = await ingest_metrics(db, "bench", items())
+        return result, time.perf_counter() - started
+
+    result, elapsed = asyncio.run(insert_all())
+    print(f"Ingested {result['inserted']} points (validate, insert, rollups) in {elapsed:.3f}s "
+          f"({result['inserted'] / elapsed:,.0f} points/sec, mongomock)")
@@ -0,0 +1,196 @@
+"""
+Integration providers.
+
+A provider knows how to talk to one third-party service: issuing and
+refreshing tokens and, for providers that import data, returning pages of
+changes since an opaque sync cursor and mapping them to documents of one of
+our sync collections.
+
+No third-party API is implemented yet: every provider in
+`AVAILABLE_INTEGRATIONS` is an `UnconfiguredProvider`, which connects
+without credentials and imports nothing, so the refresh and sync schedulers
+leave those integrations alone. With `INTEGRATIONS_FAKE=1` (local
+development and demos only) they are backed by `MockProvider` instead, a
+local fake with a deterministic, growing feed that writes made-up items
+into the user's collections, so the token and sync machinery can be
+exercised end to end without network access.
+"""
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Any, Optional
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import os
+import secrets
+
+import httpx
+
+class ProviderError(Exception):
+    """Raised by providers; `retryable` tells schedulers whether to back off and retry"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+@dataclass
+class SyncPage:
+    items: List[Dict[str, Any]]
+    cursor: Optional[str]
+    has_more: bool = False
+
+class IntegrationProvider(ABC):
+    id: str = ""
+    collection: Optional[str] = None  # sync collection imported items land in, None if the provider imports nothing
+
+    @abstractmethod
+    async def connect(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        """Initial credentials: access_token, refresh_token, expires_at (empty when there are none)"""
+
+    @abstractmethod
+    async def refresh(self, client: httpx.AsyncClient, integration: Dict[str, Any]) -> Dict[str, Any]:
+        """New access_token / expires_at (and refresh_token when the provider rotates it)"""
+
+    @abstractmethod
+    async def fetch_changes(
+        self,
+        client: httpx.AsyncClient,
+        integration: Dict[str, Any],
+        cursor: Optional[str],
+        page_size: int
+    ) -> SyncPage:
+        """Items created or changed since `cursor` (everything when it is None)"""
+
+    @abstractmethod
+    def map_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Sync-collection document for an external item (stable `id` so re-imports upsert)"""
+
+class UnconfiguredProvider(IntegrationProvider):
+    """A listed service without an API implementation: no credentials, nothing to import"""
+
+    def __init__(self, provider_id: str):
+        self.id = provider_id
+        self.collection = None
+
+    async def connect(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        return {}
+
+    async def refresh(self, client: httpx.AsyncClient, integration: Dict[str, Any]) -> Dict[str, Any]:
+        raise ProviderError(f"{self.id} is not configured", retryable=False)
+
+    async def fetch_changes(
+        self,
+        client: httpx.AsyncClient,
+        integration: Dict[str, Any],
+        cursor: Optional[str],
+        page_size: int
+    ) -> SyncPage:
+        return SyncPage(items=[], cursor=cursor)
+
+    def map_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        raise ProviderError(f"{self.id} is not configured", retryable=False)
+
+class MockProvider(IntegrationProvider):
+    """Local fake: a per-integration feed that grows by a couple of items on every fetch"""
+
+    TOKEN_TTL = timedelta(hours=1)
+    INITIAL_ITEMS = 5
+    NEW_ITEMS_PER_FETCH = 2
+
+    def __init__(
+        self,
+        provider_id: str,
+        collection: Optional[str] = None,
+        mapper: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None
+    ):
+        self.id = provider_id
+        self.collection = collection
+        self._mapper = mapper
+        self._feeds: Dict[str, int] = {}
+
+    def _tokens(self) -> Dict[str, Any]:
+        return {
+            "access_token": f"mock-{self.id}-{secrets.token_urlsafe(16)}",
+            "refresh_token": f"mock-refresh-{secrets.token_urlsafe(16)}",
+            "expires_at": datetime.now(timezone.utc) + self.TOKEN_TTL,
+        }
+
+    async def connect(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        return self._tokens()
+
+    async def refresh(self, client: httpx.AsyncClient, integration: Dict[str, Any]) -> Dict[str, Any]:
+        if not integration.get("refresh_token"):
+            raise ProviderError("No refresh token", retryable=False)
+        return self._tokens()
+
+    async def fetch_changes(
+        self,
+        client: httpx.AsyncClient,
+        integration: Dict[str, Any],
+        cursor: Optional[str],
+        page_size: int
+    ) -> SyncPage:
+        if self.collection is None:
+            return SyncPage(items=[], cursor=cursor)
+        if not integration.get("access_token"):
+            raise ProviderError("Not authorized", retryable=False)
+        start = int(cursor) if cursor else 0
+        available = self._feeds.setdefault(integration["id"], self.INITIAL_ITEMS)
+        end = min(start + page_size, available)
+        items = [self._item(integration["id"], seq) for seq in range(start, end)]
+        has_more = end < available
+        if not has_more:
+            self._feeds[integration["id"]] = available + self.NEW_ITEMS_PER_FETCH
+        return SyncPage(items=items, cursor=str(end), has_more=has_more)
+
+    def _item(self, integration_id: str, seq: int) -> Dict[str, Any]:
+        when = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=seq * 6)
+        return {"external_id": f"{integration_id}-{seq}", "seq": seq, "when": when}
+
+    def map_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        doc = self._mapper(self.id, item)
+        doc.update({"id": f"{self.id}:{item['external_id']}", "source": self.id})
+        return doc
+
+def _event(provider: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "title": f"Événement {item['seq']}",
+        "type": "event",
+        "startDate": item["when"],
+        "endDate": item["when"] + timedelta(hours=1),
+    }
+
+def _training(provider: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "cardio",
+        "intensity": "medium",
+        "duration": 30 + item["seq"] % 30,
+        "date": item["when"],
+    }
+
+def _task(provider: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "title": f"Tâche {item['seq']}",
+        "status": "done" if item["seq"] % 3 == 0 else "todo",
+        "createdAt": item["when"],
+    }
+
+def fake_providers() -> Dict[str, IntegrationProvider]:
+    return {
+        "google_calendar": MockProvider("google_calendar", "events", _event),
+        "notion": MockProvider("notion"),
+        "spotify": MockProvider("spotify"),
+        "strava": MockProvider("strava", "training", _training),
+        "todoist": MockProvider("todoist", "tasks", _task),
+        "trello": MockProvider("trello", "tasks", _task),
+    }
+
+INTEGRATIONS_FAKE = os.environ.get("INTEGRATIONS_FAKE", "0") == "1"
+
+PROVIDERS: Dict[str, IntegrationProvider] = fake_providers() if INTEGRATIONS_FAKE else {
+    provider_id: UnconfiguredProvider(provider_id) for provider_id in fake_providers()
+}
+
+def get_provider(provider_id: str) -> IntegrationProvider:
+    provider = PROVIDERS.get(provider_id)
+    if provider is None:
+        raise ProviderError(f"Unknown provider: {provider_id}", retryable=False)
+    return provider
@@ -0,0 +1,153 @@
+"""
+Incremental data import from connected integrations.
+
+For every active integration whose provider imports data, a scheduler
+periodically pulls the changes since the integration's stored
+`sync_cursor` (an opaque provider sync token), maps them to documents of
+the provider's target collection (`events`, `training`, `tasks`) and writes
+them through the same bulk upsert path as client sync. Only new or changed
+items are fetched, never a full re-import. Runs are claimed per
+integration, capped per run in pages, and executed with bounded
+concurrency; cursors and schedule state are written back in one bulk write.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from typing import Dict, List, Any, Optional
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import uuid
+
+import httpx
+
+from integration_providers import PROVIDERS, get_provider, ProviderError
+from sync_store import bulk_upsert
+from indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+SCAN_SECONDS = int(os.environ.get("INTEGRATION_SYNC_SCAN_SECONDS", "60"))
+SYNC_INTERVAL_SECONDS = int(os.environ.get("INTEGRATION_SYNC_INTERVAL_SECONDS", "900"))
+CONCURRENCY = int(os.environ.get("INTEGRATION_SYNC_CONCURRENCY", "4"))
+PAGE_SIZE = 100
+MAX_PAGES_PER_RUN = 10
+BATCH_SIZE = 200
+CLAIM_SECONDS = 600
+MAX_BACKOFF_SECONDS = 6 * 3600
+
+index_registry.declare("integrations", [("active", 1), ("provider", 1), ("sync_after", 1)])
+
+SYNCING_PROVIDERS = [provider_id for provider_id, provider in PROVIDERS.items() if provider.collection]
+
+async def sync_integration(
+    db: AsyncIOMotorDatabase,
+    client: httpx.AsyncClient,
+    integration: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Pull and store one integration's changes; returns the fields to write back"""
+    provider = get_provider(integration["provider"])
+    cursor = integration.get("sync_cursor")
+    imported = 0
+    for _ in range(MAX_PAGES_PER_RUN):
+        page = await provider.fetch_changes(client, integration, cursor, PAGE_SIZE)
+        if page.items:
+            docs = [provider.map_item(item) for item in page.items]
+            imported += await bulk_upsert(db[provider.collection], integration["user_id"], docs)
+        # Persisting the cursor only after the write keeps imports at-least-once
+        cursor = page.cursor
+        if not page.has_more:
+            break
+    return {"sync_cursor": cursor, "imported": imported, "has_more": page.has_more}
+
+class IntegrationSyncScheduler:
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _claim(self, db: AsyncIOMotorDatabase, now: datetime) -> List[Dict[str, Any]]:
+        due = {
+            "active": True,
+            "provider": {"$in": SYNCING_PROVIDERS},
+            "$and": [
+                {"$or": [{"sync_after": None}, {"sync_after": {"$lt": now}}]},
+                {"$or": [{"sync_claimed_until": None}, {"sync_claimed_until": {"$lt": now}}]},
+            ],
+        }
+        ids = [doc["id"] async for doc in db.integrations.find(due, {"_id": 0, "id": 1}).limit(BATCH_SIZE)]
+        if not ids:
+            return []
+        claim = str(uuid.uuid4())
+        await db.integrations.update_many(
+            {**due, "id": {"$in": ids}},
+            {"$set": {"sync_claim": claim, "sync_claimed_until": now + timedelta(seconds=CLAIM_SECONDS)}}
+        )
+        return await db.integrations.find(
+            {"id": {"$in": ids}, "sync_claim": claim},
+            {"_id": 0, "id": 1, "user_id": 1, "provider": 1, "access_token": 1, "sync_cursor": 1, "sync_failures": 1}
+        ).to_list(BATCH_SIZE)
+
+    async def _run_one(self, db: AsyncIOMotorDatabase, integration: Dict[str, Any], limit: asyncio.Semaphore) -> UpdateOne:
+        now = datetime.now(timezone.utc)
+        release = {"sync_claim": None, "sync_claimed_until": None}
+        try:
+            async with limit:
+                result = await sync_integration(db, self.client, integration)
+        except (ProviderError, httpx.HTTPError) as e:
+            failures = integration.get("sync_failures", 0) + 1
+            delay = min(MAX_BACKOFF_SECONDS, SYNC_INTERVAL_SECONDS * 2 ** failures)
+            update: Dict[str, Any] = {
+                **release,
+                "sync_failures": failures,
+                "sync_error": str(e),
+                "sync_after": now + timedelta(seconds=delay),
+            }
+            return UpdateOne({"id": integration["id"]}, {"$set": update})
+
+        # A backlog larger than one run continues on the next scan instead of waiting a full interval
+        next_run = now if result["has_more"] else now + timedelta(seconds=SYNC_INTERVAL_SECONDS)
+        return UpdateOne({"id": integration["id"]}, {
+            "$set": {
+                **release,
+                "sync_cursor": result["sync_cursor"],
+                "last_synced_at": now,
+                "sync_after": next_run,
+                "sync_failures": 0,
+                "sync_error": None,
+            },
+            "$inc": {"imported_count": result["imported"]},
+        })
+
+    async def sync_due(self, db: AsyncIOMotorDatabase) -> int:
+        integrations = await self._claim(db, datetime.now(timezone.utc))
+        if not integrations:
+            return 0
+        limit = asyncio.Semaphore(CONCURRENCY)
+        ops = await asyncio.gather(*(self._run_one(db, i, limit) for i in integrations))
+        await db.integrations.bulk_write(list(ops), ordered=False)
+        return len(ops)
+
+    async def _loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                synced = await self.sync_due(db)
+                if synced:
+                    logger.info(f"Synced {synced} integrations")
+            except Exception as e:
+                logger.error(f"Integration sync failed: {e}")
+            await asyncio.sleep(SCAN_SECONDS)
+
+    async def start(self, db: AsyncIOMotorDatabase, client: Optional[httpx.AsyncClient] = None):
+        self.client = client or httpx.AsyncClient(timeout=30.0)
+        self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+integration_sync_scheduler = IntegrationSyncScheduler()
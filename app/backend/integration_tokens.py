@@ -0,0 +1,144 @@
+"""
+Background OAuth token refresh for connected integrations.
+
+A scheduler scans the (active, expires_at) index for tokens expiring within
+REFRESH_AHEAD_SECONDS, claims them (so only one worker refreshes a given
+integration), refreshes them through their provider with bounded
+concurrency and a random jitter, and writes all results back with one bulk
+write. Failures back off exponentially via `refresh_after`; providers that
+reject a refresh token permanently deactivate the integration.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from typing import Dict, List, Any, Optional
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import random
+import uuid
+
+import httpx
+
+from integration_providers import get_provider, ProviderError
+from indexes import index_registry
+from migrations import run_once
+
+logger = logging.getLogger(__name__)
+
+SCAN_SECONDS = int(os.environ.get("TOKEN_REFRESH_SCAN_SECONDS", "60"))
+REFRESH_AHEAD_SECONDS = int(os.environ.get("TOKEN_REFRESH_AHEAD_SECONDS", "600"))
+CONCURRENCY = int(os.environ.get("TOKEN_REFRESH_CONCURRENCY", "8"))
+JITTER_SECONDS = 2.0
+BATCH_SIZE = 500
+CLAIM_SECONDS = 120
+MAX_BACKOFF_SECONDS = 3600
+
+index_registry.declare("integrations", [("active", 1), ("expires_at", 1)])
+
+class TokenRefreshScheduler:
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _claim(self, db: AsyncIOMotorDatabase, now: datetime) -> List[Dict[str, Any]]:
+        due = {
+            "active": True,
+            "expires_at": {"$lt": now + timedelta(seconds=REFRESH_AHEAD_SECONDS)},
+            "refresh_token": {"$ne": None},
+            "$and": [
+                {"$or": [{"refresh_after": None}, {"refresh_after": {"$lt": now}}]},
+                {"$or": [{"refresh_claimed_until": None}, {"refresh_claimed_until": {"$lt": now}}]},
+            ],
+        }
+        ids = [
+            doc["id"] async for doc in db.integrations.find(due, {"_id": 0, "id": 1}).sort("expires_at", 1).limit(BATCH_SIZE)
+        ]
+        if not ids:
+            return []
+        claim = str(uuid.uuid4())
+        await db.integrations.update_many(
+            {**due, "id": {"$in": ids}},
+            {"$set": {"refresh_claim": claim, "refresh_claimed_until": now + timedelta(seconds=CLAIM_SECONDS)}}
+        )
+        return await db.integrations.find(
+            {"id": {"$in": ids}, "refresh_claim": claim},
+            {"_id": 0, "id": 1, "provider": 1, "refresh_token": 1, "refresh_failures": 1}
+        ).to_list(BATCH_SIZE)
+
+    async def _refresh_one(self, integration: Dict[str, Any], limit: asyncio.Semaphore) -> UpdateOne:
+        # Jitter spreads a burst of expiring tokens instead of hitting providers at once
+        await asyncio.sleep(random.uniform(0, JITTER_SECONDS))
+        now = datetime.now(timezone.utc)
+        release = {"refresh_claim": None, "refresh_claimed_until": None}
+        try:
+            async with limit:
+                tokens = await get_provider(integration["provider"]).refresh(self.client, integration)
+        except (ProviderError, httpx.HTTPError) as e:
+            failures = integration.get("refresh_failures", 0) + 1
+            update: Dict[str, Any] = {**release, "refresh_failures": failures, "refresh_error": str(e)}
+            if isinstance(e, ProviderError) and not e.retryable:
+                update["active"] = False
+            else:
+                delay = min(MAX_BACKOFF_SECONDS, 30 * 2 ** failures)
+                update["refresh_after"] = now + timedelta(seconds=delay)
+            return UpdateOne({"id": integration["id"]}, {"$set": update})
+
+        update = {
+            **release,
+            "access_token": tokens["access_token"],
+            "expires_at": tokens["expires_at"],
+            "refreshed_at": now,
+            "refresh_failures": 0,
+            "refresh_error": None,
+            "refresh_after": None,
+        }
+        if tokens.get("refresh_token"):
+            update["refresh_token"] = tokens["refresh_token"]
+        return UpdateOne({"id": integration["id"]}, {"$set": update})
+
+    async def refresh_due(self, db: AsyncIOMotorDatabase) -> int:
+        """Refresh every claimed integration that is about to expire; returns how many were processed"""
+        integrations = await self._claim(db, datetime.now(timezone.utc))
+        if not integrations:
+            return 0
+        limit = asyncio.Semaphore(CONCURRENCY)
+        ops = await asyncio.gather(*(self._refresh_one(i, limit) for i in integrations))
+        await db.integrations.bulk_write(list(ops), ordered=False)
+        return len(ops)
+
+    async def _loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                refreshed = await self.refresh_due(db)
+                if refreshed:
+                    logger.info(f"Refreshed {refreshed} integration tokens")
+            except Exception as e:
+                logger.error(f"Token refresh failed: {e}")
+            await asyncio.sleep(SCAN_SECONDS)
+
+    async def start(self, db: AsyncIOMotorDatabase, client: Optional[httpx.AsyncClient] = None):
+        self.client = client or httpx.AsyncClient(timeout=10.0)
+        try:
+            await run_once(db, "integration_expiry_dates_v1", _convert_string_expiry)
+        except Exception as e:
+            logger.error(f"Could not prepare integration token refresh: {e}")
+        self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+async def _convert_string_expiry(db: AsyncIOMotorDatabase):
+    """Legacy records stored expires_at as ISO strings, which range queries cannot use"""
+    await db.integrations.update_many(
+        {"expires_at": {"$type": "string"}},
+        [{"$set": {"expires_at": {"$dateFromString": {"dateString": "$expires_at"}}}}]
+    )
+
+
+token_refresh_scheduler = TokenRefreshScheduler()
@@ -1,37 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import UserInDB
 from dependencies import get_db, get_current_active_user
 from advanced_models import WebhookModel, IntegrationModel
+from catalog import StaticCatalog
+from webhooks import webhook_dispatcher, check_webhook_url
+from integration_providers import PROVIDERS
+from integration_tokens import token_refresh_scheduler
+from indexes import index_registry
+from typing import List
 from datetime import datetime, timezone
 import httpx
+import secrets
 
 router = APIRouter(prefix="/integrations", tags=["integrations"])
 
+index_registry.declare("integrations", "user_id")
+
 # ==================== WEBHOOKS ====================
 
 @router.post("/webhooks")
 async def create_webhook(
     name: str,
     url: str,
-    events: list,
+    events: List[str] = Query(...),
+    batch: bool = False,
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Create a webhook"""
+    """Create a webhook (https only, public hosts only)"""
+    try:
+        await check_webhook_url(url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     webhook = WebhookModel(
         user_id=current_user.id,
         name=name,
         url=url,
-        events=events
+        events=events,
+        batch=batch,
+        secret=secrets.token_urlsafe(32)
     )
     
     doc = webhook.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.webhooks.insert_one(doc)
+    await webhook_dispatcher.routes.added(db, doc)
     
-    return {"success": True, "webhook_id": webhook.id}
+    # The secret is only returned once: receivers use it to verify X-Initium-Signature
+    return {"success": True, "webhook_id": webhook.id, "secret": webhook.secret}
 
 @router.get("/webhooks")
 async def get_webhooks(
@@ -41,7 +60,7 @@ async def get_webhooks(
     """Get user's webhooks"""
     webhooks = await db.webhooks.find(
         {"user_id": current_user.id},
-        {"_id": 0}
+        {"_id": 0, "secret": 0}
     ).to_list(1000)
     
     return {"webhooks": webhooks}
@@ -61,23 +80,27 @@ async def delete_webhook(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Webhook not found")
     
+    await webhook_dispatcher.routes.removed(db, webhook_id)
+    
     return {"success": True}
 
 # ==================== INTEGRATIONS ====================
 
+AVAILABLE_INTEGRATIONS = [
+    {"id": "google_calendar", "name": "Google Calendar", "icon": "📅", "status": "mock"},
+    {"id": "notion", "name": "Notion", "icon": "📝", "status": "mock"},
+    {"id": "spotify", "name": "Spotify", "icon": "🎵", "status": "mock"},
+    {"id": "strava", "name": "Strava", "icon": "🏃", "status": "mock"},
+    {"id": "todoist", "name": "Todoist", "icon": "✅", "status": "mock"},
+    {"id": "trello", "name": "Trello", "icon": "📋", "status": "mock"},
+]
+
+INTEGRATIONS_CATALOG = StaticCatalog(AVAILABLE_INTEGRATIONS, envelope="integrations")
+
 @router.get("/available")
-async def get_available_integrations():
+async def get_available_integrations(request: Request):
     """Get list of available integrations"""
-    return {
-        "integrations": [
-            {"id": "google_calendar", "name": "Google Calendar", "icon": "📅", "status": "mock"},
-            {"id": "notion", "name": "Notion", "icon": "📝", "status": "mock"},
-            {"id": "spotify", "name": "Spotify", "icon": "🎵", "status": "mock"},
-            {"id": "strava", "name": "Strava", "icon": "🏃", "status": "mock"},
-            {"id": "todoist", "name": "Todoist", "icon": "✅", "status": "mock"},
-            {"id": "trello", "name": "Trello", "icon": "📋", "status": "mock"},
-        ]
-    }
+    return INTEGRATIONS_CATALOG.response(request)
 
 @router.post("/connect/{provider}")
 async def connect_integration(
@@ -86,16 +109,21 @@ async def connect_integration(
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Connect an integration (mocked)"""
+    provider_impl = PROVIDERS.get(provider)
+    if provider_impl is None:
+        raise HTTPException(status_code=404, detail="Unknown integration")
+    
+    # Tokens are refreshed in the background before expires_at
+    tokens = await provider_impl.connect(token_refresh_scheduler.client)
     integration = IntegrationModel(
         user_id=current_user.id,
         provider=provider,
-        settings={"mock": True}
+        settings={"mock": True},
+        **tokens
     )
     
     doc = integration.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('expires_at'):
-        doc['expires_at'] = doc['expires_at'].isoformat()
     
     await db.integrations.insert_one(doc)
     
@@ -113,7 +141,7 @@ async def get_connected_integrations(
     """Get user's connected integrations"""
     integrations = await db.integrations.find(
         {"user_id": current_user.id},
-        {"_id": 0}
+        {"_id": 0, "access_token": 0, "refresh_token": 0, "refresh_claim": 0}
     ).to_list(1000)
     
     return {"integrations": integrations}
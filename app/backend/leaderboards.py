@@ -0,0 +1,146 @@
+"""
+Time-windowed XP leaderboards.
+
+Every XP award increments one counter document per window (daily, weekly,
+monthly) in `xp_buckets`. A background job periodically rolls the current
+buckets up into a single `leaderboard_rollups` document per window, so a
+leaderboard read touches one small document instead of aggregating events.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timezone
+import asyncio
+import logging
+import os
+
+from indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INTERVAL_SECONDS = int(os.environ.get("LEADERBOARD_ROLLUP_SECONDS", "60"))
+ROLLUP_SIZE = 100
+
+WINDOWS = ("daily", "weekly", "monthly")
+
+index_registry.declare("xp_buckets", [("user_id", 1), ("window", 1), ("bucket", 1)], unique=True)
+index_registry.declare("xp_buckets", [("window", 1), ("bucket", 1), ("xp", -1)])
+index_registry.declare("leaderboard_rollups", [("window", 1), ("bucket", 1)], unique=True)
+
+def bucket_key(window: str, when: datetime) -> str:
+    """Bucket identifier for a window, e.g. 2026-10-19 / 2026-W42 / 2026-10"""
+    if window == "daily":
+        return when.strftime("%Y-%m-%d")
+    if window == "weekly":
+        year, week, _ = when.isocalendar()
+        return f"{year}-W{week:02d}"
+    if window == "monthly":
+        return when.strftime("%Y-%m")
+    raise ValueError(f"Unknown leaderboard window: {window}")
+
+def current_buckets(when: Optional[datetime] = None) -> Dict[str, str]:
+    when = when or datetime.now(timezone.utc)
+    return {window: bucket_key(window, when) for window in WINDOWS}
+
+# ==================== WRITE PATH ====================
+
+async def record_xp(db: AsyncIOMotorDatabase, user_id: str, amount: int, when: Optional[datetime] = None):
+    """Increment the user's XP counter in every window (one bulk round trip)"""
+    await record_xp_batch(db, [(user_id, amount, when or datetime.now(timezone.utc))])
+
+async def record_xp_batch(db: AsyncIOMotorDatabase, awards: List[Tuple[str, int, datetime]]):
+    """Apply many (user_id, amount, when) awards, summed per bucket, in one bulk write"""
+    totals: Dict[Tuple[str, str, str], int] = {}
+    for user_id, amount, when in awards:
+        for window, bucket in current_buckets(when).items():
+            key = (user_id, window, bucket)
+            totals[key] = totals.get(key, 0) + amount
+    if not totals:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    await db.xp_buckets.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "window": window, "bucket": bucket},
+            {"$inc": {"xp": amount}, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for (user_id, window, bucket), amount in totals.items()
+        if amount
+    ], ordered=False)
+
+# ==================== ROLLUPS ====================
+
+async def compute_rollup(db: AsyncIOMotorDatabase, window: str, bucket: str, limit: int = ROLLUP_SIZE) -> List[Dict[str, Any]]:
+    """Top users of one bucket, resolved to usernames with a single $in query"""
+    top = await db.xp_buckets.find(
+        {"window": window, "bucket": bucket},
+        {"_id": 0, "user_id": 1, "xp": 1}
+    ).sort("xp", -1).limit(limit).to_list(limit)
+
+    users = await db.users.find(
+        {"id": {"$in": [row["user_id"] for row in top]}},
+        {"_id": 0, "id": 1, "username": 1, "level": 1, "avatar_url": 1}
+    ).to_list(limit)
+    by_id = {user["id"]: user for user in users}
+
+    entries = []
+    for idx, row in enumerate(top, 1):
+        user = by_id.get(row["user_id"], {})
+        entries.append({
+            "rank": idx,
+            "user_id": row["user_id"],
+            "username": user.get("username", "Anonymous"),
+            "xp": row["xp"],
+            "level": user.get("level", 1),
+            "avatar_url": user.get("avatar_url")
+        })
+    return entries
+
+async def refresh_rollups(db: AsyncIOMotorDatabase):
+    """Recompute the rollup document of every current window"""
+    computed_at = datetime.now(timezone.utc).isoformat()
+    for window, bucket in current_buckets().items():
+        entries = await compute_rollup(db, window, bucket)
+        await db.leaderboard_rollups.update_one(
+            {"window": window, "bucket": bucket},
+            {"$set": {"entries": entries, "computed_at": computed_at}},
+            upsert=True
+        )
+
+async def get_window_leaderboard(db: AsyncIOMotorDatabase, window: str, bucket: Optional[str] = None, limit: int = ROLLUP_SIZE) -> Dict[str, Any]:
+    bucket = bucket or current_buckets()[window]
+    rollup = await db.leaderboard_rollups.find_one({"window": window, "bucket": bucket}, {"_id": 0})
+    if rollup is None:
+        # Not rolled up yet (new bucket or job not run): compute on demand
+        rollup = {"window": window, "bucket": bucket, "entries": await compute_rollup(db, window, bucket), "computed_at": None}
+    return {
+        "window": window,
+        "bucket": bucket,
+        "leaderboard": rollup["entries"][:limit],
+        "computed_at": rollup.get("computed_at")
+    }
+
+# ==================== BACKGROUND JOB ====================
+
+class LeaderboardRollupJob:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                await refresh_rollups(db)
+            except Exception as e:
+                logger.error(f"Leaderboard rollup failed: {e}")
+            await asyncio.sleep(ROLLUP_INTERVAL_SECONDS)
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+leaderboard_rollup_job = LeaderboardRollupJob()
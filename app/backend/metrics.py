@@ -0,0 +1,207 @@
+"""
+Request and MongoDB metrics in the Prometheus text format.
+
+`MetricsMiddleware` (plain ASGI, no BaseHTTPMiddleware overhead) records
+per-route latency histograms, status codes and in-flight requests, labelled
+by route template rather than raw path so cardinality stays bounded.
+`MongoMetricsListener` is a pymongo CommandListener recording per
+collection/command durations, returned document counts and failures.
+
+pymongo calls listeners from Motor's executor threads, so the listener only
+appends finished commands to a deque (an atomic operation) and all
+aggregation happens on the event loop thread when requests finish or
+/metrics is scraped: counters are plain ints and need no locks.
+
+/metrics exposes routes and collections, so it only answers scrapers
+sending `Authorization: Bearer $METRICS_TOKEN`; without METRICS_TOKEN the
+endpoint is disabled.
+"""
+from fastapi import HTTPException, Request, Response
+from pymongo import monitoring
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+import hmac
+import os
+import time
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+MAX_PENDING_COMMANDS = 100000
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# ASGI scope of the request being handled; Motor copies the context into its
+# executor threads, so command listeners can tell which route issued a query
+request_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_scope", default=None)
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """Route template (/api/guilds/{guild_id}) rather than the raw path, to keep cardinality bounded"""
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return ",".join(pairs)
+
+def _histogram_lines(metric: str, names: Tuple[str, ...], series: Dict[tuple, Histogram]) -> List[str]:
+    lines = [f"# TYPE {metric} histogram"]
+    for key, histogram in series.items():
+        labels = _labels(names, key)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+        lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+    return lines
+
+def _counter_lines(metric: str, names: Tuple[str, ...], series: Dict[tuple, int]) -> List[str]:
+    lines = [f"# TYPE {metric} counter"]
+    lines.extend(f"{metric}{{{_labels(names, key)}}} {value}" for key, value in series.items())
+    return lines
+
+# ==================== MONGODB ====================
+
+def _collection(command_name: str, command: Dict[str, Any]) -> str:
+    if command_name == "getMore":
+        return command.get("collection", "")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+def _documents(command_name: str, reply: Dict[str, Any]) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+class MongoMetricsListener(monitoring.CommandListener):
+    def __init__(self):
+        self._started: Dict[Tuple[Any, int], str] = {}
+        # (collection, command, seconds, documents, failed)
+        self.finished: Deque[Tuple[str, str, float, int, bool]] = deque(maxlen=MAX_PENDING_COMMANDS)
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self._started[(event.connection_id, event.request_id)] = _collection(event.command_name, event.command)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection = self._started.pop((event.connection_id, event.request_id), "")
+        self.finished.append((
+            collection, event.command_name, event.duration_micros / 1e6,
+            _documents(event.command_name, event.reply), False
+        ))
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self._started.pop((event.connection_id, event.request_id), "")
+        self.finished.append((collection, event.command_name, event.duration_micros / 1e6, 0, True))
+
+# ==================== REGISTRY ====================
+
+class Metrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.in_flight = 0
+        self.http_requests: Dict[tuple, int] = defaultdict(int)
+        self.http_latency: Dict[tuple, Histogram] = {}
+        self.mongo_latency: Dict[tuple, Histogram] = {}
+        self.mongo_documents: Dict[tuple, int] = defaultdict(int)
+        self.mongo_failures: Dict[tuple, int] = defaultdict(int)
+        self.mongo_listener = MongoMetricsListener()
+
+    def record_request(self, method: str, route: str, status: int, seconds: float):
+        self.http_requests[(method, route, status)] += 1
+        key = (method, route)
+        histogram = self.http_latency.get(key)
+        if histogram is None:
+            histogram = self.http_latency[key] = Histogram(HTTP_BUCKETS)
+        histogram.observe(seconds)
+
+    def collect_mongo(self):
+        """Fold the commands finished on driver threads into the counters"""
+        finished = self.mongo_listener.finished
+        while finished:
+            collection, command, seconds, documents, failed = finished.popleft()
+            key = (collection, command)
+            histogram = self.mongo_latency.get(key)
+            if histogram is None:
+                histogram = self.mongo_latency[key] = Histogram(MONGO_BUCKETS)
+            histogram.observe(seconds)
+            self.mongo_documents[key] += documents
+            if failed:
+                self.mongo_failures[key] += 1
+
+    def render(self) -> str:
+        self.collect_mongo()
+        lines = [
+            "# TYPE initium_uptime_seconds gauge",
+            f"initium_uptime_seconds {time.time() - self.started_at:.0f}",
+            "# TYPE initium_http_requests_in_flight gauge",
+            f"initium_http_requests_in_flight {self.in_flight}",
+        ]
+        lines += _counter_lines("initium_http_requests_total", ("method", "route", "status"), self.http_requests)
+        lines += _histogram_lines("initium_http_request_duration_seconds", ("method", "route"), self.http_latency)
+        lines += _histogram_lines("initium_mongo_command_duration_seconds", ("collection", "command"), self.mongo_latency)
+        lines += _counter_lines("initium_mongo_documents_total", ("collection", "command"), self.mongo_documents)
+        lines += _counter_lines("initium_mongo_command_failures_total", ("collection", "command"), self.mongo_failures)
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+# ==================== HTTP ====================
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        token = request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_scope.reset(token)
+            metrics.in_flight -= 1
+            metrics.record_request(scope["method"], route_label(scope), status_code, time.perf_counter() - started)
+            if len(metrics.mongo_listener.finished) > 1000:
+                metrics.collect_mongo()
+
+async def metrics_endpoint(request: Request) -> Response:
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
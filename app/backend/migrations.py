@@ -0,0 +1,41 @@
+"""
+One-shot data migrations run at startup.
+
+A migration is recorded in `migrations` only after it succeeded, so a
+failed one is retried on the next startup. While it runs, its document
+holds a lease (`claimed_until`) so other workers starting at the same time
+skip it instead of running it concurrently; a worker that dies mid-way
+stops blocking the migration once the lease expires.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+from typing import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 600
+
+async def run_once(db: AsyncIOMotorDatabase, name: str, migrate: Callable[[AsyncIOMotorDatabase], Awaitable[None]]) -> bool:
+    """Run `migrate` unless it was applied or another worker holds it; True when it ran"""
+    now = datetime.now(timezone.utc)
+    try:
+        # Matches only an unapplied, unclaimed (or expired) record; otherwise the upsert hits the _id
+        await db.migrations.update_one(
+            {"_id": name, "applied_at": {"$exists": False}, "claimed_until": {"$not": {"$gt": now}}},
+            {"$set": {"claimed_until": now + timedelta(seconds=LEASE_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    try:
+        await migrate(db)
+    except Exception:
+        await db.migrations.update_one({"_id": name}, {"$unset": {"claimed_until": ""}})
+        raise
+    await db.migrations.update_one(
+        {"_id": name},
+        {"$set": {"applied_at": datetime.now(timezone.utc)}, "$unset": {"claimed_until": ""}}
+    )
+    return True
@@ -1,15 +1,25 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import UserInDB
 from dependencies import get_db, get_current_active_user
 from advanced_models import BacklinkModel, NoteTemplateModel
+from catalog import StaticCatalog, dumps
+from notes_search import search_notes
+from wikilinks import full_graph, neighbourhood, invalidate as invalidate_graph
+from indexes import index_registry
+from pydantic import BaseModel, Field
 from typing import List
 from datetime import datetime, timezone
 
 router = APIRouter(prefix="/notes-advanced", tags=["notes-advanced"])
 
+index_registry.declare("note_templates", "user_id")
+
 # ==================== BACKLINKS ====================
 
+class BacklinkBatchRequest(BaseModel):
+    note_ids: List[str] = Field(..., max_length=500)
+
 @router.get("/backlinks/{note_id}")
 async def get_backlinks(
     note_id: str,
@@ -24,6 +34,23 @@ async def get_backlinks(
     
     return {"backlinks": backlinks}
 
+@router.post("/backlinks/batch")
+async def get_backlinks_batch(
+    request: BacklinkBatchRequest,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get backlinks for many notes in one query, grouped by target note"""
+    grouped = {note_id: [] for note_id in request.note_ids}
+    
+    async for backlink in db.backlinks.find(
+        {"user_id": current_user.id, "target_id": {"$in": request.note_ids}},
+        {"_id": 0}
+    ):
+        grouped[backlink["target_id"]].append(backlink)
+    
+    return {"backlinks": grouped}
+
 @router.post("/backlinks")
 async def create_backlink(
     source_id: str,
@@ -32,16 +59,6 @@ async def create_backlink(
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Create a backlink between notes"""
-    # Check if backlink already exists
-    existing = await db.backlinks.find_one({
-        "source_id": source_id,
-        "target_id": target_id,
-        "user_id": current_user.id
-    })
-    
-    if existing:
-        return {"success": True, "message": "Backlink already exists"}
-    
     backlink = BacklinkModel(
         source_id=source_id,
         target_id=target_id,
@@ -52,10 +69,57 @@ async def create_backlink(
     doc['created_at'] = doc['created_at'].isoformat()
     doc['user_id'] = current_user.id
     
-    await db.backlinks.insert_one(doc)
+    # Idempotent upsert against the unique (user_id, source_id, target_id) index;
+    # tagging the edge "manual" keeps it when a wikilink to the same note is removed
+    result = await db.backlinks.update_one(
+        {"user_id": current_user.id, "source_id": source_id, "target_id": target_id},
+        {"$setOnInsert": doc, "$addToSet": {"origins": "manual"}},
+        upsert=True
+    )
+    
+    if result.upserted_id is None:
+        return {"success": True, "message": "Backlink already exists"}
+    
+    invalidate_graph(current_user.id)
     
     return {"success": True, "backlink_id": backlink.id}
 
+# ==================== GRAPH ====================
+
+@router.get("/graph")
+async def get_graph(
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get the user's whole note link graph"""
+    return await full_graph(db, current_user.id)
+
+@router.get("/graph/{note_id}")
+async def get_note_graph(
+    note_id: str,
+    depth: int = 1,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get the N-hop neighbourhood of a note (max 3 hops)"""
+    return await neighbourhood(db, current_user.id, note_id, depth)
+
+# ==================== SEARCH ====================
+
+@router.get("/search")
+async def search(
+    q: str,
+    page: int = 1,
+    page_size: int = 20,
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Full-text search over the user's notes (BM25-ranked, with snippets)"""
+    page_size = max(1, min(page_size, 100))
+    results, total = await search_notes(db, current_user.id, q, page, page_size)
+    
+    return {"results": results, "total": total, "page": page, "page_size": page_size}
+
 # ==================== TEMPLATES ====================
 
 PREDEFINED_TEMPLATES = [
@@ -81,22 +145,28 @@ PREDEFINED_TEMPLATES = [
     },
 ]
 
+TEMPLATES_CATALOG = StaticCatalog(PREDEFINED_TEMPLATES, envelope="predefined")
+
 @router.get("/templates")
 async def get_templates(
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get all note templates"""
-    # Get predefined templates
-    templates = PREDEFINED_TEMPLATES.copy()
-    
     # Get user's custom templates
     custom = await db.note_templates.find(
         {"user_id": current_user.id},
         {"_id": 0}
     ).to_list(1000)
     
-    return {"predefined": templates, "custom": custom}
+    # Predefined templates are spliced in from their pre-serialized bytes
+    body = b'{"predefined":' + TEMPLATES_CATALOG.items_json + b',"custom":' + dumps(custom) + b'}'
+    return Response(content=body, media_type="application/json")
+
+@router.get("/templates/predefined")
+async def get_predefined_templates(request: Request):
+    """Get predefined note templates (cacheable, ETag-aware)"""
+    return TEMPLATES_CATALOG.response(request)
 
 @router.post("/templates")
 async def create_template(
@@ -0,0 +1,296 @@
+"""
+Server-side full-text search for notes.
+
+Each user has an inverted index stored in Mongo (`note_postings`: one
+posting per (term, note) with its term frequency) plus a per-note term
+vector (`note_index`) used to diff updates. Notes pushed through sync are
+re-indexed incrementally: only terms whose frequency changed are written.
+Queries are scored with BM25 over the postings of the query terms and
+returned ranked and paginated with highlighted snippets. Document
+frequencies are counted in Mongo, and only the MAX_POSTINGS_PER_TERM
+highest-tf postings of each term are loaded, so a common term does not pull
+every note of the user into memory (the total then counts ranked candidates).
+
+    python notes_search.py bench [notes]   # seed a throwaway user, report query latency
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne, DeleteOne
+from typing import Dict, List, Any, Optional, Tuple
+from collections import Counter
+import asyncio
+import html
+import logging
+import math
+import re
+import unicodedata
+
+from indexes import index_registry
+
+K1 = 1.2
+B = 0.75
+TITLE_BOOST = 2
+SNIPPET_CHARS = 160
+MAX_QUERY_TERMS = 10
+MAX_POSTINGS_PER_TERM = 2000
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+index_registry.declare("note_postings", [("user_id", 1), ("term", 1), ("note_id", 1)], unique=True)
+index_registry.declare("note_postings", [("user_id", 1), ("note_id", 1)])
+index_registry.declare("note_postings", [("user_id", 1), ("term", 1), ("tf", -1)])
+index_registry.declare("note_index", [("user_id", 1), ("note_id", 1)], unique=True)
+index_registry.declare("note_search_stats", "user_id", unique=True)
+
+# ==================== TOKENIZATION ====================
+
+def normalize(token: str) -> str:
+    """Lowercase and strip accents so "Étude" matches "etude" """
+    decomposed = unicodedata.normalize("NFKD", token.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in (normalize(m.group()) for m in WORD_RE.finditer(text or "")) if len(t) > 1]
+
+def term_vector(note: Dict[str, Any]) -> Counter:
+    terms = Counter(tokenize(note.get("content", "")))
+    for term in tokenize(note.get("title", "")):
+        terms[term] += TITLE_BOOST
+    return terms
+
+# ==================== INDEXING ====================
+
+async def index_notes(db: AsyncIOMotorDatabase, user_id: str, notes: List[Dict[str, Any]]):
+    """Incrementally (re)index pushed notes: diff term vectors, write changed postings"""
+    notes = [n for n in notes if n.get("id")]
+    if not notes:
+        return
+    stored = {
+        doc["note_id"]: doc
+        async for doc in db.note_index.find(
+            {"user_id": user_id, "note_id": {"$in": [n["id"] for n in notes]}},
+            {"_id": 0, "note_id": 1, "length": 1, "terms": 1}
+        )
+    }
+
+    postings: List[Any] = []
+    vectors: List[Any] = []
+    doc_delta = 0
+    length_delta = 0
+
+    for note in notes:
+        note_id = note["id"]
+        new_terms = term_vector(note)
+        old = stored.get(note_id)
+        old_terms = old.get("terms", {}) if old else {}
+        if old is None:
+            doc_delta += 1
+        length = sum(new_terms.values())
+        length_delta += length - (old.get("length", 0) if old else 0)
+
+        for term, tf in new_terms.items():
+            if old_terms.get(term) != tf:
+                postings.append(UpdateOne(
+                    {"user_id": user_id, "term": term, "note_id": note_id},
+                    {"$set": {"tf": tf}},
+                    upsert=True
+                ))
+        for term in old_terms.keys() - new_terms.keys():
+            postings.append(DeleteOne({"user_id": user_id, "term": term, "note_id": note_id}))
+
+        if old is None or old_terms != dict(new_terms):
+            vectors.append(UpdateOne(
+                {"user_id": user_id, "note_id": note_id},
+                {"$set": {"length": length, "terms": dict(new_terms)}},
+                upsert=True
+            ))
+
+    if postings:
+        await db.note_postings.bulk_write(postings, ordered=False)
+    if vectors:
+        await db.note_index.bulk_write(vectors, ordered=False)
+    if doc_delta or length_delta:
+        await db.note_search_stats.update_one(
+            {"user_id": user_id},
+            {"$inc": {"doc_count": doc_delta, "total_length": length_delta}},
+            upsert=True
+        )
+
+async def clear_index(db: AsyncIOMotorDatabase, user_id: str):
+    await db.note_postings.delete_many({"user_id": user_id})
+    await db.note_index.delete_many({"user_id": user_id})
+    await db.note_search_stats.delete_one({"user_id": user_id})
+
+# ==================== QUERYING ====================
+
+def bm25_scores(
+    postings: List[Dict[str, Any]],
+    lengths: Dict[str, int],
+    doc_count: int,
+    avg_length: float,
+    df: Optional[Dict[str, int]] = None
+) -> Dict[str, float]:
+    """BM25 score per note id from the postings of the query terms (df counted from them by default)"""
+    if df is None:
+        df = Counter(p["term"] for p in postings)
+    scores: Dict[str, float] = {}
+    for p in postings:
+        idf = math.log(1 + (doc_count - df[p["term"]] + 0.5) / (df[p["term"]] + 0.5))
+        length = lengths.get(p["note_id"], avg_length)
+        tf = p["tf"]
+        norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / max(avg_length, 1)))
+        scores[p["note_id"]] = scores.get(p["note_id"], 0.0) + idf * norm
+    return scores
+
+def snippet(text: str, terms: set, width: int = SNIPPET_CHARS) -> str:
+    """Window of `text` around the first matching term, matches wrapped in <mark> (HTML-escaped)"""
+    text = text or ""
+    matches = [m for m in WORD_RE.finditer(text) if normalize(m.group()) in terms]
+    if not matches:
+        return html.escape(text[:width])
+    start = max(0, matches[0].start() - width // 4)
+    end = min(len(text), start + width)
+    out, cursor = [], start
+    for m in matches:
+        if m.start() < start or m.end() > end:
+            continue
+        out.append(html.escape(text[cursor:m.start()]))
+        out.append(f"<mark>{html.escape(m.group())}</mark>")
+        cursor = m.end()
+    out.append(html.escape(text[cursor:end]))
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return prefix + "".join(out) + suffix
+
+async def search_notes(
+    db: AsyncIOMotorDatabase,
+    user_id: str,
+    query: str,
+    page: int = 1,
+    page_size: int = 20
+) -> Tuple[List[Dict[str, Any]], int]:
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return [], 0
+
+    stats = await db.note_search_stats.find_one({"user_id": user_id}, {"_id": 0}) or {}
+    doc_count = max(stats.get("doc_count", 0), 1)
+    avg_length = stats.get("total_length", 0) / doc_count
+
+    df = {
+        doc["_id"]: doc["count"]
+        async for doc in db.note_postings.aggregate([
+            {"$match": {"user_id": user_id, "term": {"$in": terms}}},
+            {"$group": {"_id": "$term", "count": {"$sum": 1}}},
+        ])
+    }
+    if not df:
+        return [], 0
+    per_term = await asyncio.gather(*(
+        db.note_postings.find(
+            {"user_id": user_id, "term": term},
+            {"_id": 0, "term": 1, "note_id": 1, "tf": 1}
+        ).sort("tf", -1).limit(MAX_POSTINGS_PER_TERM).to_list(MAX_POSTINGS_PER_TERM)
+        for term in df
+    ))
+    postings = [p for term_postings in per_term for p in term_postings]
+    if not postings:
+        return [], 0
+
+    candidate_ids = list({p["note_id"] for p in postings})
+    lengths = {
+        doc["note_id"]: doc.get("length", 0)
+        async for doc in db.note_index.find(
+            {"user_id": user_id, "note_id": {"$in": candidate_ids}},
+            {"_id": 0, "note_id": 1, "length": 1}
+        )
+    }
+
+    scores = bm25_scores(postings, lengths, doc_count, avg_length, df)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    offset = (max(page, 1) - 1) * page_size
+    page_ids = [note_id for note_id, _ in ranked[offset:offset + page_size]]
+
+    notes = {
+        doc["id"]: doc
+        async for doc in db.notes.find(
+            {"user_id": user_id, "id": {"$in": page_ids}},
+            {"_id": 0, "id": 1, "title": 1, "content": 1, "tags": 1, "updatedAt": 1}
+        )
+    }
+    term_set = set(terms)
+    results = []
+    for note_id in page_ids:
+        note = notes.get(note_id)
+        if note is None:
+            continue
+        results.append({
+            "id": note_id,
+            "title": note.get("title", ""),
+            "score": round(scores[note_id], 4),
+            "snippet": snippet(note.get("content", ""), term_set),
+            "tags": note.get("tags"),
+            "updatedAt": note.get("updatedAt")
+        })
+    return results, len(ranked)
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+    import uuid
+    from database import connect, close
+
+    if sys.argv[1:2] != ["bench"]:
+        print("Usage: python notes_search.py bench [notes]")
+        sys.exit(1)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    rng = random.Random(42)
+    # Zipf-ish vocabulary: a few very common terms, a long tail of rare ones
+    vocabulary = [f"mot{i}" for i in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    def fake_note(i: int) -> Dict[str, Any]:
+        return {
+            "id": f"bench-{i}",
+            "title": " ".join(rng.choices(vocabulary, weights, k=4)),
+            "content": " ".join(rng.choices(vocabulary, weights, k=rng.randint(30, 200))),
+        }
+
+    QUERIES = {
+        "common term": "mot0",
+        "mid term": "mot150",
+        "rare term": "mot15000",
+        "two terms": "mot3 mot40",
+        "five terms": "mot1 mot20 mot300 mot4000 mot9000",
+    }
+
+    async def main():
+        db = connect()
+        user_id = f"bench-{uuid.uuid4()}"
+        try:
+            started = time.perf_counter()
+            for offset in range(0, count, 1000):
+                batch = [fake_note(i) for i in range(offset, min(offset + 1000, count))]
+                await db.notes.insert_many([{**note, "user_id": user_id} for note in batch])
+                await index_notes(db, user_id, batch)
+            print(f"seeded {count} notes in {time.perf_counter() - started:.1f}s")
+
+            for label, query in QUERIES.items():
+                timings = []
+                for _ in range(20):
+                    started = time.perf_counter()
+                    _, total = await search_notes(db, user_id, query)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                print(f"  {label:12} {total:7} hits  p50 {timings[len(timings) // 2]:8.1f} ms"
+                      f"  p95 {timings[int(len(timings) * 0.95)]:8.1f} ms  max {timings[-1]:8.1f} ms")
+        finally:
+            await db.notes.delete_many({"user_id": user_id})
+            await clear_index(db, user_id)
+            close()
+
+    asyncio.run(main())
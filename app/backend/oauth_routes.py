@@ -7,6 +7,7 @@ from datetime import datetime, timezone, timedelta
 from models import UserInDB, OAuthAccountInDB, Token
 from auth_utils import create_access_token, create_refresh_token
 from dependencies import get_db
+from indexes import index_registry
 import uuid
 
 router = APIRouter(prefix="/oauth", tags=["oauth"])
@@ -15,6 +16,8 @@ GITHUB_CLIENT_ID = os.environ.get("GITHUB_CLIENT_ID", "")
 GITHUB_CLIENT_SECRET = os.environ.get("GITHUB_CLIENT_SECRET", "")
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000")
 
+index_registry.declare("oauth_accounts", [("provider", 1), ("provider_user_id", 1)])
+
 # ==================== GITHUB OAUTH ====================
 
 @router.get("/github/login")
@@ -178,7 +181,6 @@ async def github_callback(
     
     token_dict = refresh_token_doc.model_dump()
     token_dict['created_at'] = token_dict['created_at'].isoformat()
-    token_dict['expires_at'] = token_dict['expires_at'].isoformat()
     
     await db.refresh_tokens.insert_one(token_dict)
     
@@ -0,0 +1,314 @@
+"""
+Durable event outbox.
+
+Domain writes append an event to the `outbox` collection right after the
+change they describe (`emit`). Where losing the event is not acceptable,
+the write that makes the change also stages the event on the changed
+document itself, in its `outbox_pending` array (`stage_events` /
+`staged_events_expr`), so the change and its event commit together;
+`publish_staged` then copies the events to the outbox and pulls them off
+the document. If that step fails or the process dies first, the relay
+sweeps every registered source collection for staged events older than
+STAGED_GRACE_SECONDS and publishes them (the outbox's unique `id` makes
+publishing twice harmless). A relay tails the collection in `_id` order
+and feeds every registered consumer (webhooks, leaderboards, achievement
+counters) in batches, advancing a per-consumer checkpoint in
+`outbox_checkpoints` only after the consumer succeeded, so delivery is
+at-least-once and survives crashes and restarts. Only one worker relays at
+a time (lease document, renewed before every batch), and events are only
+read once they are older than a short settle delay so concurrent inserts
+are never skipped.
+
+Consumers must be idempotent: non-idempotent effects (e.g. leaderboard XP
+increments) go through `unapplied()`, which records each (consumer, event
+id) pair once. A batch that keeps failing for reasons other than lost
+connectivity is retried event by event after MAX_CONSUMER_FAILURES
+attempts; the events that still fail go to `outbox_dead_letters` and the
+checkpoint moves on.
+
+A consumer registered with `from_now=True` starts at the current tail
+instead of replaying the retained events, for effects that were applied by
+other means before the consumer existed.
+
+Events are kept for OUTBOX_RETENTION_DAYS; `python outbox.py replay
+<consumer> <since>` rewinds a consumer's checkpoint to re-deliver them
+(events a consumer already applied are skipped, so a replay fills gaps).
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError
+from bson import ObjectId
+from typing import Awaitable, Callable, Dict, List, Any, Optional, Set
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import uuid
+
+from indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = float(os.environ.get("OUTBOX_POLL_SECONDS", "1"))
+SETTLE_SECONDS = 2
+BATCH_SIZE = 500
+LEASE_SECONDS = 30
+RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", "7"))
+MAX_CONSUMER_FAILURES = 5
+STAGED_FIELD = "outbox_pending"
+STAGED_GRACE_SECONDS = 10
+
+index_registry.declare("outbox", "created_at", ttl_seconds=RETENTION_DAYS * 86400)
+index_registry.declare("outbox", "id", unique=True)
+index_registry.declare("outbox_applied", "created_at", ttl_seconds=RETENTION_DAYS * 86400)
+index_registry.declare("outbox_dead_letters", [("consumer", 1), ("created_at", 1)])
+
+Consumer = Callable[[AsyncIOMotorDatabase, List[Dict[str, Any]]], Awaitable[None]]
+
+async def emit(db: AsyncIOMotorDatabase, user_id: str, event: str, payload: Dict[str, Any]):
+    await db.outbox.insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "event": event,
+        "payload": payload,
+        "created_at": datetime.now(timezone.utc)
+    })
+
+async def emit_many(db: AsyncIOMotorDatabase, events: List[Dict[str, Any]]):
+    """Append several {user_id, event, payload} events with one insert"""
+    if not events:
+        return
+    now = datetime.now(timezone.utc)
+    await db.outbox.insert_many([
+        {"id": str(uuid.uuid4()), "created_at": now, **event} for event in events
+    ])
+
+# ==================== STAGED EVENTS ====================
+
+# Collections whose documents may carry staged events, swept by the relay
+STAGED_SOURCES: Set[str] = set()
+
+def staged_source(collection: str):
+    STAGED_SOURCES.add(collection)
+    index_registry.declare(collection, f"{STAGED_FIELD}.created_at", sparse=True)
+
+def new_event(user_id: str, event: str, payload: Dict[str, Any], event_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "id": event_id or str(uuid.uuid4()),
+        "user_id": user_id,
+        "event": event,
+        "payload": payload,
+        "created_at": datetime.now(timezone.utc)
+    }
+
+def stage_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Update operator staging `events` on the document the update writes"""
+    return {"$push": {STAGED_FIELD: {"$each": events}}}
+
+def staged_events_expr(templates: List[Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pipeline-update expression for `outbox_pending` with one event per
+    template appended; `event` is evaluated against the document, with the
+    template bound to `$$t` (e.g. an event id, or a field path to one).
+    """
+    return {"$concatArrays": [
+        {"$ifNull": [f"${STAGED_FIELD}", []]},
+        {"$map": {"input": templates, "as": "t", "in": event}},
+    ]}
+
+async def publish_staged(db: AsyncIOMotorDatabase, collection: str, doc_filter: Dict[str, Any], events: List[Dict[str, Any]]):
+    """Copy staged events to the outbox, then pull them off the document(s) matching `doc_filter`"""
+    if not events:
+        return
+    try:
+        # Copies: insert_many would add the source document's _id to the caller's dicts
+        await db.outbox.insert_many([{k: v for k, v in event.items() if k != "_id"} for event in events], ordered=False)
+    except BulkWriteError as e:
+        # Already published by a previous attempt
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+    await db[collection].update_many(
+        doc_filter, {"$pull": {STAGED_FIELD: {"id": {"$in": [event["id"] for event in events]}}}}
+    )
+
+async def unapplied(db: AsyncIOMotorDatabase, consumer: str, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The events `consumer` has not applied yet, recorded as applied. Call
+    `forget()` with them if applying fails, so the retry applies them again.
+    """
+    if not events:
+        return []
+    now = datetime.now(timezone.utc)
+    try:
+        await db.outbox_applied.insert_many(
+            [{"_id": f"{consumer}:{event['id']}", "created_at": now} for event in events],
+            ordered=False
+        )
+        return events
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        seen = {err["index"] for err in errors}
+        return [event for index, event in enumerate(events) if index not in seen]
+
+async def forget(db: AsyncIOMotorDatabase, consumer: str, events: List[Dict[str, Any]]):
+    await db.outbox_applied.delete_many({"_id": {"$in": [f"{consumer}:{event['id']}" for event in events]}})
+
+# ==================== RELAY ====================
+
+class OutboxRelay:
+    def __init__(self):
+        self.consumers: Dict[str, Consumer] = {}
+        self.from_now: Set[str] = set()
+        self.owner = str(uuid.uuid4())
+        self._task: Optional[asyncio.Task] = None
+
+    def consumer(self, name: str, from_now: bool = False):
+        """Decorator registering an async (db, events) consumer under a checkpoint name"""
+        def register(handler: Consumer) -> Consumer:
+            self.consumers[name] = handler
+            if from_now:
+                self.from_now.add(name)
+            return handler
+        return register
+
+    async def _acquire_lease(self, db: AsyncIOMotorDatabase) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await db.outbox_checkpoints.update_one(
+                {"_id": "relay_lease", "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=LEASE_SECONDS)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Another worker holds a live lease
+            return False
+
+    async def publish_stranded(self, db: AsyncIOMotorDatabase) -> int:
+        """Publish staged events whose writer did not (crash, lost connection); returns how many"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=STAGED_GRACE_SECONDS)
+        published = 0
+        for collection in sorted(STAGED_SOURCES):
+            async for doc in db[collection].find(
+                {f"{STAGED_FIELD}.created_at": {"$lt": cutoff}}, {"_id": 1, STAGED_FIELD: 1}
+            ).limit(BATCH_SIZE):
+                # Newer events on the same document may be published concurrently: duplicates are skipped
+                await publish_staged(db, collection, {"_id": doc["_id"]}, doc[STAGED_FIELD])
+                published += len(doc[STAGED_FIELD])
+        if published:
+            logger.warning(f"Published {published} stranded outbox events")
+        return published
+
+    async def relay_once(self, db: AsyncIOMotorDatabase) -> int:
+        """Feed one batch to every consumer; returns the number of events handled"""
+        settled = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS))
+        checkpoints = {
+            doc["_id"]: doc
+            async for doc in db.outbox_checkpoints.find({"_id": {"$in": list(self.consumers)}})
+        }
+        handled = 0
+        for name, handler in self.consumers.items():
+            # A long drain can outlive the lease: renew it before every batch, stop if it was lost
+            if not await self._acquire_lease(db):
+                break
+            checkpoint = checkpoints.get(name) or {}
+            if not checkpoint and name in self.from_now:
+                # First run: skip the retained history
+                await db.outbox_checkpoints.update_one(
+                    {"_id": name},
+                    {"$setOnInsert": {"last_id": settled, "updated_at": datetime.now(timezone.utc), "failures": 0}},
+                    upsert=True
+                )
+                continue
+            id_range: Dict[str, Any] = {"$lt": settled}
+            if checkpoint.get("last_id") is not None:
+                id_range["$gt"] = checkpoint["last_id"]
+            events = await db.outbox.find({"_id": id_range}).sort("_id", 1).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+            if not events:
+                continue
+            try:
+                await handler(db, events)
+            except ConnectionFailure as e:
+                logger.error(f"Outbox consumer {name} lost the database, will retry: {e}")
+                continue
+            except Exception as e:
+                failures = checkpoint.get("failures", 0) + 1
+                if failures < MAX_CONSUMER_FAILURES:
+                    logger.error(f"Outbox consumer {name} failed ({failures}/{MAX_CONSUMER_FAILURES}), will retry: {e}")
+                    await db.outbox_checkpoints.update_one({"_id": name}, {"$set": {"failures": failures}}, upsert=True)
+                    continue
+                await self._isolate(db, name, handler, events)
+            await db.outbox_checkpoints.update_one(
+                {"_id": name},
+                {"$set": {"last_id": events[-1]["_id"], "updated_at": datetime.now(timezone.utc), "failures": 0}},
+                upsert=True
+            )
+            handled += len(events)
+        return handled
+
+    async def _isolate(self, db: AsyncIOMotorDatabase, name: str, handler: Consumer, events: List[Dict[str, Any]]):
+        """Retry a failing batch one event at a time and dead-letter the events that still fail"""
+        dead = []
+        for event in events:
+            try:
+                await handler(db, [event])
+            except Exception as e:
+                dead.append({"consumer": name, "event": event, "error": repr(e), "created_at": datetime.now(timezone.utc)})
+        if dead:
+            await db.outbox_dead_letters.insert_many(dead)
+            logger.error(f"Outbox consumer {name}: {len(dead)} events moved to outbox_dead_letters")
+
+    async def _loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                if await self._acquire_lease(db):
+                    await self.publish_stranded(db)
+                    # Drain backlog without waiting between full batches
+                    while await self.relay_once(db) >= BATCH_SIZE:
+                        pass
+            except Exception as e:
+                logger.error(f"Outbox relay failed: {e}")
+            await asyncio.sleep(POLL_SECONDS)
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        try:
+            # New consumers start from now rather than replaying the retained history
+            now = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS))
+            for name in self.consumers:
+                await db.outbox_checkpoints.update_one(
+                    {"_id": name}, {"$setOnInsert": {"last_id": now}}, upsert=True
+                )
+        except Exception as e:
+            logger.error(f"Could not prepare outbox: {e}")
+        self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+outbox_relay = OutboxRelay()
+
+async def replay(db: AsyncIOMotorDatabase, consumer: str, since: datetime):
+    """Rewind a consumer so events created after `since` are delivered again"""
+    await db.outbox_checkpoints.update_one(
+        {"_id": consumer},
+        {"$set": {"last_id": ObjectId.from_datetime(since), "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+if __name__ == "__main__":
+    import sys
+    from database import connect
+
+    if len(sys.argv) != 4 or sys.argv[1] != "replay":
+        print("Usage: python outbox.py replay <consumer> <since ISO datetime>")
+        sys.exit(1)
+    since = datetime.fromisoformat(sys.argv[3].replace("Z", "+00:00"))
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    asyncio.run(replay(connect(), sys.argv[2], since))
+    print(f"Consumer {sys.argv[2]} will re-deliver events since {since.isoformat()}")
@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import UserInDB
 from dependencies import get_db, get_current_active_user
 from advanced_models import PomodoroSessionModel
+from xp_service import xp_service
+from pomodoro_stats import get_stats, invalidate as invalidate_stats
+from pomodoro_timers import pomodoro_timers, ends_at, POMODORO_XP, OPEN_SESSION, MAX_DURATION_MINUTES
+from streaks import get_zone
+from timeseries import as_utc
+from outbox import new_event, publish_staged, stage_events
 from datetime import datetime, timezone
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/pomodoro", tags=["pomodoro"])
 
 @router.post("/start")
 async def start_pomodoro(
-    duration: int = 25,
+    duration: int = Query(25, ge=1, le=MAX_DURATION_MINUTES, description="Minutes"),
     task_id: str = None,
     session_type: str = "work",
     current_user: UserInDB = Depends(get_current_active_user),
@@ -22,15 +31,42 @@ async def start_pomodoro(
         duration=duration,
         type=session_type
     )
+    session.ends_at = ends_at(session.started_at, duration)
     
+    # Real BSON dates so stats can group by day/hour
     doc = session.model_dump()
-    doc['started_at'] = doc['started_at'].isoformat()
-    if doc.get('completed_at'):
-        doc['completed_at'] = doc['completed_at'].isoformat()
     
     await db.pomodoro_sessions.insert_one(doc)
+    invalidate_stats(current_user.id)
+    pomodoro_timers.schedule(session.id, session.ends_at)
+    
+    return {
+        "success": True,
+        "session_id": session.id,
+        "duration": duration,
+        "started_at": session.started_at,
+        "ends_at": session.ends_at
+    }
+
+@router.get("/current")
+async def get_current_pomodoro(
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get the open session with its server-side deadline (expired when it passes unreported)"""
+    session = await db.pomodoro_sessions.find_one(
+        {"user_id": current_user.id, **OPEN_SESSION},
+        {"_id": 0},
+        sort=[("started_at", -1)]
+    )
+    if not session:
+        return {"session": None}
+    
+    remaining = None
+    if session.get("ends_at"):
+        remaining = max(0, int((as_utc(session["ends_at"]) - datetime.now(timezone.utc)).total_seconds()))
     
-    return {"success": True, "session_id": session.id, "duration": duration}
+    return {"session": session, "remaining_seconds": remaining}
 
 @router.post("/complete/{session_id}")
 async def complete_pomodoro(
@@ -39,36 +75,47 @@ async def complete_pomodoro(
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Complete a pomodoro session"""
-    await db.pomodoro_sessions.update_one(
-        {"id": session_id, "user_id": current_user.id},
+    # The completion and its event are written together
+    event = new_event(current_user.id, "pomodoro_completed", {"session_id": session_id, "auto": False},
+                      event_id=f"pomodoro_completed:{session_id}")
+    result = await db.pomodoro_sessions.update_one(
+        {"id": session_id, "user_id": current_user.id, **OPEN_SESSION},
         {"$set": {
             "completed": True,
-            "completed_at": datetime.now(timezone.utc).isoformat()
-        }}
+            "completed_at": datetime.now(timezone.utc)
+        }, **stage_events([event])}
     )
     
-    # Award XP
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$inc": {"xp": 10}}
-    )
+    # Award XP only once per session, and never for an expired one
+    if result.modified_count == 0:
+        return {"success": True, "xp_earned": 0}
+    
+    invalidate_stats(current_user.id)
+    award = await xp_service.award(db, current_user.id, POMODORO_XP, source="pomodoro")
+    try:
+        await publish_staged(db, "pomodoro_sessions", {"id": session_id}, [event])
+    except Exception as e:
+        # Still staged on the session: the outbox relay publishes it
+        logger.warning(f"pomodoro_completed for {session_id} left to the outbox relay: {e}")
     
-    return {"success": True, "xp_earned": 10}
+    return {
+        "success": True,
+        "xp_earned": POMODORO_XP,
+        "level": award.level if award else current_user.level,
+        "leveled_up": award.leveled_up if award else False
+    }
 
 @router.get("/stats")
 async def get_pomodoro_stats(
+    days: int = 30,
+    tz: str = "UTC",
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Get pomodoro statistics"""
-    total = await db.pomodoro_sessions.count_documents({"user_id": current_user.id})
-    completed = await db.pomodoro_sessions.count_documents({
-        "user_id": current_user.id,
-        "completed": True
-    })
+    """Get pomodoro statistics, focus minutes per day and an hour-of-week heatmap"""
+    try:
+        get_zone(tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return {
-        "total_sessions": total,
-        "completed_sessions": completed,
-        "completion_rate": (completed / total * 100) if total > 0 else 0
-    }
+    return await get_stats(db, current_user.id, days, tz)
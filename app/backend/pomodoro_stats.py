@@ -0,0 +1,129 @@
+"""
+Pomodoro statistics.
+
+All figures (totals, completion rate, focus minutes per day and an
+hour-of-week heatmap) cover the same `days` window and come from one
+`$facet` aggregation over the (user_id, started_at) index, with
+`started_at` stored as a real date. Results are cached per worker until
+one of the user's sessions starts or completes on that worker, and for at
+most CACHE_TTL_SECONDS, which bounds staleness across workers.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Dict, List, Any, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import logging
+import time
+
+from indexes import index_registry
+from migrations import run_once
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 30
+MAX_WINDOW_DAYS = 365
+
+index_registry.declare("pomodoro_sessions", [("user_id", 1), ("started_at", 1)])
+
+# (user_id, days, tz) -> (loaded_at, stats)
+_cache: "OrderedDict[Tuple[str, int, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def invalidate(user_id: str):
+    for key in [k for k in _cache if k[0] == user_id]:
+        del _cache[key]
+
+# ==================== AGGREGATION ====================
+
+def _stats_pipeline(user_id: str, since: datetime, tz: str) -> List[dict]:
+    focus = {"completed": True, "type": "work"}
+    local = {"date": "$started_at", "timezone": tz}
+    return [
+        {"$match": {"user_id": user_id, "started_at": {"$gte": since}}},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "completed": {"$sum": {"$cond": ["$completed", 1, 0]}},
+                    "focus_minutes": {"$sum": {"$cond": [
+                        {"$and": ["$completed", {"$eq": ["$type", "work"]}]}, "$duration", 0
+                    ]}},
+                }}
+            ],
+            "per_day": [
+                {"$match": focus},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", **local}},
+                    "minutes": {"$sum": "$duration"},
+                    "sessions": {"$sum": 1},
+                }},
+                {"$sort": {"_id": 1}},
+            ],
+            "heatmap": [
+                {"$match": focus},
+                {"$group": {
+                    "_id": {"day": {"$isoDayOfWeek": local}, "hour": {"$hour": local}},
+                    "minutes": {"$sum": "$duration"},
+                }},
+            ],
+        }},
+    ]
+
+def _shape(facets: Dict[str, List[Dict[str, Any]]], days: int) -> Dict[str, Any]:
+    totals = facets["totals"][0] if facets["totals"] else {}
+    total = totals.get("total", 0)
+    completed = totals.get("completed", 0)
+
+    # 7 x 24 grid of focus minutes, Monday first
+    heatmap = [[0] * 24 for _ in range(7)]
+    for cell in facets["heatmap"]:
+        heatmap[cell["_id"]["day"] - 1][cell["_id"]["hour"]] = cell["minutes"]
+
+    return {
+        "total_sessions": total,
+        "completed_sessions": completed,
+        "completion_rate": (completed / total * 100) if total > 0 else 0,
+        "total_focus_minutes": totals.get("focus_minutes", 0),
+        "window_days": days,
+        "focus_minutes_per_day": [
+            {"date": row["_id"], "minutes": row["minutes"], "sessions": row["sessions"]}
+            for row in facets["per_day"]
+        ],
+        "heatmap": heatmap,
+    }
+
+async def get_stats(db: AsyncIOMotorDatabase, user_id: str, days: int = 30, tz: str = "UTC") -> Dict[str, Any]:
+    days = max(1, min(days, MAX_WINDOW_DAYS))
+    key = (user_id, days, tz)
+    cached = _cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < CACHE_TTL_SECONDS:
+        _cache.move_to_end(key)
+        return cached[1]
+
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    facets = await db.pomodoro_sessions.aggregate(_stats_pipeline(user_id, since, tz)).to_list(1)
+    result = _shape(facets[0], days)
+
+    _cache[key] = (time.monotonic(), result)
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+    return result
+
+# ==================== SETUP ====================
+
+async def _convert_string_dates(db: AsyncIOMotorDatabase):
+    for field in ("started_at", "completed_at"):
+        result = await db.pomodoro_sessions.update_many(
+            {field: {"$type": "string"}},
+            [{"$set": {field: {"$dateFromString": {"dateString": f"${field}"}}}}]
+        )
+        logger.info(f"Converted {result.modified_count} legacy pomodoro {field} values")
+
+async def setup_pomodoro(db: AsyncIOMotorDatabase):
+    try:
+        # Legacy sessions stored ISO strings: convert once so range/date operators work
+        await run_once(db, "pomodoro_dates_v1", _convert_string_dates)
+    except Exception as e:
+        logger.error(f"Pomodoro setup failed: {e}")
@@ -0,0 +1,154 @@
+"""
+Server-side pomodoro timers.
+
+Every started session carries `ends_at` (started_at + duration). Open
+sessions are kept in an in-process min-heap; a single asyncio task sleeps
+until the earliest deadline and, once the client has had GRACE_SECONDS to
+report completion, marks every session still open as `expired` with one
+`update_many`, which also stages their `pomodoro_expired` events (see
+`outbox`). Expired sessions were abandoned: they earn no XP and do not
+count as completed.
+
+Pending timers are simply the open sessions in Mongo. A worker schedules
+the sessions started through it, and at startup reloads every open session
+from the (completed, expired, ends_at) index, so sessions whose worker
+restarted are picked up again. Timers can therefore be held by more than
+one worker; a per-run claim token makes sure a session is expired (and
+reported) only once.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+import heapq
+import logging
+import os
+import uuid
+
+from timeseries import as_utc
+from outbox import STAGED_FIELD, publish_staged, staged_events_expr, staged_source
+from indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+POMODORO_XP = 10
+MAX_DURATION_MINUTES = 240
+# Leave clients a moment to report completion before the session is deemed abandoned
+GRACE_SECONDS = float(os.environ.get("POMODORO_GRACE_SECONDS", "30"))
+BATCH_WINDOW_SECONDS = 1.0
+
+index_registry.declare("pomodoro_sessions", [("completed", 1), ("expired", 1), ("ends_at", 1)])
+staged_source("pomodoro_sessions")
+
+# Sessions neither completed by their user nor expired by the server
+OPEN_SESSION = {"completed": False, "expired": {"$ne": True}}
+
+def ends_at(started_at: datetime, duration: int) -> datetime:
+    return as_utc(started_at) + timedelta(minutes=duration)
+
+class PomodoroTimerScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, session_id: str, due: datetime):
+        due = as_utc(due)
+        earliest = not self._heap or due < self._heap[0][0]
+        heapq.heappush(self._heap, (due, session_id))
+        if earliest:
+            self._wakeup.set()
+
+    async def _recover(self, db: AsyncIOMotorDatabase) -> int:
+        """Reload timers of every open session (including legacy ones without ends_at)"""
+        heap = []
+        async for doc in db.pomodoro_sessions.find(
+            OPEN_SESSION,
+            {"_id": 0, "id": 1, "started_at": 1, "duration": 1, "ends_at": 1}
+        ):
+            try:
+                due = doc.get("ends_at") or ends_at(doc["started_at"], doc.get("duration", 25))
+                heap.append((as_utc(due), doc["id"]))
+            except (KeyError, TypeError, ValueError, OverflowError):
+                continue
+        heapq.heapify(heap)
+        self._heap = heap
+        return len(heap)
+
+    def _pop_due(self, now: datetime) -> List[str]:
+        cutoff = now - timedelta(seconds=GRACE_SECONDS) + timedelta(seconds=BATCH_WINDOW_SECONDS)
+        due = []
+        while self._heap and self._heap[0][0] <= cutoff:
+            due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    async def _expire(self, db: AsyncIOMotorDatabase, session_ids: List[str]):
+        """Expire every still-open session in one write, then report the ones this run claimed"""
+        claim = str(uuid.uuid4())
+        await db.pomodoro_sessions.update_many(
+            {"id": {"$in": session_ids}, **OPEN_SESSION},
+            [{"$set": {
+                "expired": True,
+                "expired_at": {"$ifNull": ["$ends_at", "$$NOW"]},
+                "timer_claim": claim,
+                STAGED_FIELD: staged_events_expr(["pomodoro_expired:"], {
+                    "id": {"$concat": ["$$t", "$id"]},
+                    "user_id": "$user_id",
+                    "event": {"$literal": "pomodoro_expired"},
+                    "payload": {"session_id": "$id"},
+                    "created_at": {"$literal": datetime.now(timezone.utc)},
+                }),
+            }}]
+        )
+        events = [
+            event
+            async for doc in db.pomodoro_sessions.find(
+                {"id": {"$in": session_ids}, "timer_claim": claim},
+                {"_id": 0, "id": 1, STAGED_FIELD: 1}
+            )
+            for event in doc.get(STAGED_FIELD, [])
+            if event["id"] == f"pomodoro_expired:{doc['id']}"
+        ]
+        await publish_staged(db, "pomodoro_sessions", {"id": {"$in": session_ids}, "timer_claim": claim}, events)
+        if events:
+            logger.info(f"Expired {len(events)} abandoned pomodoro sessions")
+
+    async def _loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            self._wakeup.clear()
+            now = datetime.now(timezone.utc)
+            due = self._pop_due(now)
+            if due:
+                try:
+                    await self._expire(db, due)
+                except Exception as e:
+                    logger.error(f"Pomodoro expiry failed: {e}")
+                    for session_id in due:
+                        heapq.heappush(self._heap, (now, session_id))
+                    await asyncio.sleep(5)
+                continue
+
+            timeout = None
+            if self._heap:
+                fire_at = self._heap[0][0] + timedelta(seconds=GRACE_SECONDS)
+                timeout = max((fire_at - now).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        try:
+            pending = await self._recover(db)
+            logger.info(f"Recovered {pending} pending pomodoro timers")
+        except Exception as e:
+            logger.error(f"Could not recover pomodoro timers: {e}")
+        self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+pomodoro_timers = PomodoroTimerScheduler()
@@ -0,0 +1,244 @@
+"""
+Slow-query profiler.
+
+A pymongo CommandListener that keeps every command slower than
+SLOW_QUERY_MS, reduced to its query shape: filter, sort and pipeline keys
+with every value replaced by "?", so `{"user_id": "u1", "xp": {"$gt": 5}}`
+and `{"user_id": "u2", "xp": {"$gt": 9}}` are the same shape. Commands are
+reduced as soon as they start, so no raw command (and none of the user data
+in it) is ever kept. Each sample remembers the route that issued it (see
+`metrics.request_scope`). Shapes are aggregated into a top-N table by total
+time, served at /api/debug/slow-queries; `explain=N` attaches the query
+planner's winning plan (stage and index names only) to the N worst shapes,
+explained as a find with placeholder values.
+
+Like the metrics listener, driver threads only append to a deque (the
+newest MAX_PENDING_SAMPLES are kept) and the aggregation runs on the event
+loop when the table is read.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import monitoring
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import json
+import os
+
+from metrics import request_scope, route_label
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+MAX_SHAPES = 500
+MAX_PENDING_SAMPLES = 10000
+
+# Commands that are never interesting, or whose shape says nothing (cursor continuation)
+IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "buildInfo", "endSessions", "getMore", "killCursors"}
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Placeholders for operators whose "?" would not parse; everything else gets null
+PLACEHOLDERS = {"$in": [None], "$nin": [None], "$all": [None], "$exists": True, "$size": 0,
+                "$regex": "", "$type": "null", "$mod": [1, 0]}
+
+def normalize(value: Any) -> Any:
+    """Keys and operators are kept, values become "?" (lists of sub-queries are kept, e.g. $or)"""
+    if isinstance(value, dict):
+        return {key: normalize(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)) and value and all(isinstance(item, dict) for item in value):
+        return [normalize(item) for item in value]
+    return "?"
+
+def _sort_shape(sort: Any) -> List[str]:
+    # Sort direction is structural (index order), not a value
+    return [f"{key}:{direction}" for key, direction in (sort or {}).items()]
+
+def _pipeline_shape(pipeline: List[Dict[str, Any]]) -> List[Any]:
+    stages: List[Any] = []
+    for stage in pipeline:
+        name = next(iter(stage), "?")
+        if name == "$match":
+            stages.append({"$match": normalize(stage[name])})
+        elif name == "$sort":
+            stages.append({"$sort": _sort_shape(stage[name])})
+        else:
+            stages.append(name)
+    return stages
+
+def query_shape(command_name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    if command_name == "find":
+        return {"filter": normalize(command.get("filter", {})), "sort": _sort_shape(command.get("sort"))}
+    if command_name == "aggregate":
+        return {"pipeline": _pipeline_shape(command.get("pipeline", []))}
+    if command_name in ("count", "distinct"):
+        shape = {"query": normalize(command.get("query", {}))}
+        if command_name == "distinct":
+            shape["key"] = command.get("key")
+        return shape
+    if command_name == "findAndModify":
+        return {"query": normalize(command.get("query", {})), "sort": _sort_shape(command.get("sort"))}
+    if command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or [{}]
+        return {"q": normalize(statements[0].get("q", {})), "statements": "many" if len(statements) > 1 else "one"}
+    if command_name == "insert":
+        return {"documents": "many" if len(command.get("documents", [])) > 1 else "one"}
+    return {}
+
+def _collection(command_name: str, command: Dict[str, Any]) -> str:
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+@dataclass
+class ShapeStats:
+    collection: str
+    command: str
+    shape: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    routes: Counter = field(default_factory=Counter)
+    last_seen: Optional[datetime] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "collection": self.collection,
+            "command": self.command,
+            "shape": self.shape,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 1),
+            "avg_ms": round(self.total_ms / self.count, 1),
+            "max_ms": round(self.max_ms, 1),
+            "routes": dict(self.routes.most_common(5)),
+            "last_seen": self.last_seen,
+        }
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold_ms = threshold_ms
+        # (collection, shape, route) of in-flight commands
+        self._started: Dict[Tuple[Any, int], Tuple[str, Dict[str, Any], str]] = {}
+        self._pending: Deque[Tuple[str, str, Dict[str, Any], str, float]] = deque(maxlen=MAX_PENDING_SAMPLES)
+        self.shapes: Dict[Tuple[str, str, str], ShapeStats] = {}
+
+    # ---- driver threads: keep this cheap, shapes are only serialized for slow commands ----
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        scope = request_scope.get()
+        route = f"{scope['method']} {route_label(scope)}" if scope else "background"
+        self._started[(event.connection_id, event.request_id)] = (
+            _collection(event.command_name, event.command), query_shape(event.command_name, event.command), route
+        )
+
+    def _finished(self, event):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        elapsed_ms = event.duration_micros / 1000
+        if elapsed_ms >= self.threshold_ms:
+            collection, shape, route = started
+            self._pending.append((event.command_name, collection, shape, route, elapsed_ms))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finished(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finished(event)
+
+    # ---- event loop ----
+
+    def collect(self):
+        now = datetime.now(timezone.utc)
+        while self._pending:
+            command_name, collection, shape_doc, route, elapsed_ms = self._pending.popleft()
+            shape = json.dumps(shape_doc, separators=(",", ":"), default=str)
+            key = (collection, command_name, shape)
+            stats = self.shapes.get(key)
+            if stats is None:
+                if len(self.shapes) >= MAX_SHAPES:
+                    continue
+                stats = self.shapes[key] = ShapeStats(collection, command_name, shape)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.routes[route] += 1
+            stats.last_seen = now
+
+    def top(self, limit: int = 20) -> List[ShapeStats]:
+        self.collect()
+        return sorted(self.shapes.values(), key=lambda stats: stats.total_ms, reverse=True)[:limit]
+
+    def reset(self):
+        self._pending.clear()
+        self.shapes.clear()
+
+    async def report(self, db: AsyncIOMotorDatabase, limit: int = 20, explain: int = 0) -> Dict[str, Any]:
+        """Top shapes by total time; the `explain` worst ones get their winning plan"""
+        rows = []
+        for rank, stats in enumerate(self.top(limit)):
+            row = stats.as_dict()
+            if rank < explain and stats.command in EXPLAINABLE_COMMANDS:
+                row["plan"] = await explain_plan(db, stats.collection, stats.command, json.loads(stats.shape))
+            rows.append(row)
+        return {"threshold_ms": self.threshold_ms, "shapes": len(self.shapes), "queries": rows}
+
+def _placeholders(shape: Any, operator: Optional[str] = None) -> Any:
+    """A filter with the shape's structure, for the planner: values are placeholders"""
+    if isinstance(shape, dict):
+        return {key: _placeholders(value, key) for key, value in shape.items()}
+    if isinstance(shape, list):
+        return [_placeholders(item) for item in shape]
+    return PLACEHOLDERS.get(operator)
+
+def _sort_from_shape(sort: List[str]) -> Dict[str, Any]:
+    sort_doc: Dict[str, Any] = {}
+    for entry in sort:
+        key, _, direction = entry.rpartition(":")
+        sort_doc[key] = int(direction) if direction.lstrip("-").isdigit() else direction
+    return sort_doc
+
+def explain_command(collection: str, command_name: str, shape: Dict[str, Any]) -> Dict[str, Any]:
+    """The find that plans like the profiled command: its filter and sort from the shape"""
+    if command_name == "aggregate":
+        # Only a leading $match (and a $sort right after it) reach the query planner
+        stages = shape.get("pipeline", [])
+        first = stages[0] if stages and isinstance(stages[0], dict) else {}
+        query = first.get("$match", {})
+        after = stages[1] if "$match" in first and len(stages) > 1 and isinstance(stages[1], dict) else {}
+        sort = after.get("$sort", [])
+    else:
+        query = shape.get("filter", shape.get("query", shape.get("q", {})))
+        sort = shape.get("sort", [])
+    command: Dict[str, Any] = {"find": collection, "filter": _placeholders(query)}
+    if sort:
+        command["sort"] = _sort_from_shape(sort)
+    return command
+
+def _plan_summary(plan: Dict[str, Any]) -> Dict[str, Any]:
+    # Stage and index names only: parsed queries and bounds would echo the placeholders
+    summary: Dict[str, Any] = {"stage": plan.get("stage")}
+    if plan.get("indexName"):
+        summary["index"] = plan["indexName"]
+    children = plan.get("inputStages") or ([plan["inputStage"]] if "inputStage" in plan else [])
+    if children:
+        summary["inputs"] = [_plan_summary(child) for child in children]
+    return summary
+
+async def explain_plan(
+    db: AsyncIOMotorDatabase,
+    collection: str,
+    command_name: str,
+    shape: Dict[str, Any]
+) -> Dict[str, Any]:
+    target = explain_command(collection, command_name, shape)
+    try:
+        result = await db.command({"explain": target, "verbosity": "queryPlanner"})
+    except Exception as e:
+        return {"error": str(e)}
+    planner = result.get("queryPlanner")
+    if not planner:
+        return {"error": "no query plan"}
+    winning = planner.get("winningPlan", {})
+    # Slot-based engine (MongoDB 7+) nests the classic plan tree under queryPlan
+    return _plan_summary(winning.get("queryPlan", winning))
+
+
+query_profiler = QueryProfiler()
@@ -0,0 +1,161 @@
+"""
+In-memory XP rank index.
+
+Users are grouped into fixed-width XP buckets counted by a Fenwick tree, so
+"how many users have more XP than me" is answered in O(log n) instead of a
+count_documents scan over the users collection. Each bucket also keeps a
+sorted list of the XP values it holds to stay exact inside a bucket.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Dict, List, Optional
+from bisect import bisect_right, insort
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+BUCKET_WIDTH = int(os.environ.get("RANK_INDEX_BUCKET_WIDTH", "50"))
+REFRESH_SECONDS = int(os.environ.get("RANK_INDEX_REFRESH_SECONDS", "300"))
+INITIAL_CAPACITY = 1024  # buckets
+
+# ==================== FENWICK TREE ====================
+
+class FenwickTree:
+    """Binary indexed tree of counts (0-based public indices)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, index: int, delta: int):
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & (-i)
+
+    def prefix_sum(self, index: int) -> int:
+        """Sum of counts for indices [0, index]"""
+        total = 0
+        i = min(index, self.size - 1) + 1
+        while i > 0:
+            total += self.tree[i]
+            i -= i & (-i)
+        return total
+
+# ==================== RANK INDEX ====================
+
+class XPRankIndex:
+    """Order-statistics index over user XP"""
+
+    def __init__(self, bucket_width: int = BUCKET_WIDTH, capacity: int = INITIAL_CAPACITY):
+        self.bucket_width = bucket_width
+        self._reset(capacity)
+        self.ready = False
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _reset(self, capacity: int):
+        self.tree = FenwickTree(capacity)
+        self.buckets: Dict[int, List[int]] = {}
+        self.user_xp: Dict[str, int] = {}
+        self.total = 0
+
+    def _bucket(self, xp: int) -> int:
+        return max(xp, 0) // self.bucket_width
+
+    def _grow(self, bucket: int):
+        """Double the tree until `bucket` fits, re-adding existing counts"""
+        capacity = self.tree.size
+        while bucket >= capacity:
+            capacity *= 2
+        tree = FenwickTree(capacity)
+        for b, values in self.buckets.items():
+            tree.add(b, len(values))
+        self.tree = tree
+
+    def _insert(self, xp: int):
+        bucket = self._bucket(xp)
+        if bucket >= self.tree.size:
+            self._grow(bucket)
+        insort(self.buckets.setdefault(bucket, []), xp)
+        self.tree.add(bucket, 1)
+        self.total += 1
+
+    def _remove(self, xp: int):
+        bucket = self._bucket(xp)
+        values = self.buckets[bucket]
+        values.pop(bisect_right(values, xp) - 1)
+        if not values:
+            del self.buckets[bucket]
+        self.tree.add(bucket, -1)
+        self.total -= 1
+
+    def update(self, user_id: str, xp: int):
+        """Set a user's XP (inserting the user if unknown)"""
+        previous = self.user_xp.get(user_id)
+        if previous == xp:
+            return
+        if previous is not None:
+            self._remove(previous)
+        self._insert(xp)
+        self.user_xp[user_id] = xp
+
+    def remove(self, user_id: str):
+        previous = self.user_xp.pop(user_id, None)
+        if previous is not None:
+            self._remove(previous)
+
+    def count_above(self, xp: int) -> int:
+        """Number of users with strictly more XP than `xp`"""
+        bucket = self._bucket(xp)
+        at_or_below_bucket = self.tree.prefix_sum(bucket) if bucket < self.tree.size else self.total
+        values = self.buckets.get(bucket, [])
+        inside_above = len(values) - bisect_right(values, xp)
+        return self.total - at_or_below_bucket + inside_above
+
+    def rank(self, xp: int) -> int:
+        return self.count_above(xp) + 1
+
+    def percentile(self, xp: int) -> float:
+        """Share of users (in %) ranked at or above this XP, i.e. "top X%" """
+        if self.total == 0:
+            return 100.0
+        return round(self.rank(xp) / self.total * 100, 2)
+
+    # ==================== LOADING ====================
+
+    async def load(self, db: AsyncIOMotorDatabase):
+        """Rebuild the index from the users collection in one streaming pass"""
+        # Build aside and swap so queries never see a half-loaded index
+        fresh = XPRankIndex(self.bucket_width, self.tree.size)
+        async for user in db.users.find({}, {"_id": 0, "id": 1, "xp": 1}):
+            fresh.update(user["id"], user.get("xp", 0))
+        self.tree, self.buckets = fresh.tree, fresh.buckets
+        self.user_xp, self.total = fresh.user_xp, fresh.total
+        self.ready = True
+        logger.info(f"XP rank index loaded ({self.total} users)")
+
+    async def _refresh_loop(self, db: AsyncIOMotorDatabase):
+        # Other workers update their own copy; a periodic rebuild bounds drift
+        while True:
+            await asyncio.sleep(REFRESH_SECONDS)
+            try:
+                await self.load(db)
+            except Exception as e:
+                logger.error(f"XP rank index refresh failed: {e}")
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        try:
+            await self.load(db)
+        except Exception as e:
+            # Rank routes fall back to count_documents until the next refresh
+            logger.error(f"XP rank index load failed: {e}")
+        self._refresh_task = asyncio.create_task(self._refresh_loop(db))
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+rank_index = XPRankIndex()
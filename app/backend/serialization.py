@@ -0,0 +1,99 @@
+"""
+Fast JSON path.
+
+Responses are encoded with orjson: `ORJSONResponse` is the app's default
+response class. Documents the app wrote itself were validated by their model
+on the way in, so read paths rebuild them with `trusted()` (pydantic
+`model_construct`, no validation), and hot endpoints return an
+`ORJSONResponse` directly instead of re-validating their payload against
+`response_model` (which is kept for the OpenAPI schema).
+
+    python serialization.py bench [docs]   # CPU per request, validated vs fast path
+"""
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import Any, Dict, Mapping, Type, TypeVar
+import orjson
+
+M = TypeVar("M", bound=BaseModel)
+
+def dumps(payload: Any) -> bytes:
+    """Compact UTF-8 JSON; naive datetimes are UTC, unknown types (ObjectId, Decimal128...) fall back to str()"""
+    return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC)
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def trusted(model: Type[M], doc: Mapping[str, Any]) -> M:
+    """Model instance for a document this app wrote (validated on write), without revalidating it"""
+    return model.model_construct(**doc)
+
+def project(response_model: Type[BaseModel], obj: Any) -> Dict[str, Any]:
+    """The response_model's fields read from `obj`, ready to encode"""
+    return {field: getattr(obj, field) for field in response_model.model_fields}
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    import time
+    from datetime import datetime, timezone
+    from typing import List
+    from pydantic import TypeAdapter
+    from models import UserInDB, UserResponse
+    from sync_routes import PullResponse
+
+    if sys.argv[1:2] != ["bench"]:
+        print("Usage: python serialization.py bench [docs]")
+        sys.exit(1)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    def starlette_json(content: Any) -> bytes:
+        # What the stock JSONResponse does after FastAPI's response_model serialization
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+    def timed(label: str, fn, runs: int) -> float:
+        fn()
+        started = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        per_request = (time.perf_counter() - started) / runs * 1e6
+        print(f"  {label:10} {per_request:10.1f} us/request")
+        return per_request
+
+    now = datetime.now(timezone.utc)
+    docs: List[Dict[str, Any]] = [
+        {"id": f"t{i}", "user_id": "u1", "title": f"Task {i}", "status": "todo", "priority": i % 3,
+         "tags": ["work", "home"], "createdAt": now.isoformat(), "synced_at": now.isoformat()}
+        for i in range(count)
+    ]
+    pull_adapter = TypeAdapter(PullResponse)
+
+    def pull_validated():
+        response = PullResponse(success=True, data={"tasks": docs}, last_sync=now)
+        value = pull_adapter.validate_python(response)
+        return starlette_json(pull_adapter.dump_python(value, mode="json"))
+
+    def pull_fast():
+        return ORJSONResponse({"success": True, "data": {"tasks": docs}, "last_sync": now}).body
+
+    user_doc = UserInDB(email="bench@example.com", username="bench", hashed_password="x").model_dump()
+    user_doc["created_at"] = user_doc["created_at"].isoformat()
+    user_doc["updated_at"] = user_doc["updated_at"].isoformat()
+    me_adapter = TypeAdapter(UserResponse)
+
+    def me_validated():
+        user = UserInDB(**user_doc)
+        value = me_adapter.validate_python(UserResponse(**user.model_dump()))
+        return starlette_json(me_adapter.dump_python(value, mode="json"))
+
+    def me_fast():
+        return ORJSONResponse(project(UserResponse, trusted(UserInDB, user_doc))).body
+
+    print(f"/sync/pull ({count} docs)")
+    slow, fast = timed("validated", pull_validated, 50), timed("fast", pull_fast, 50)
+    print(f"  saved      {slow - fast:10.1f} us/request ({slow / fast:.1f}x)")
+    print("/auth/me")
+    slow, fast = timed("validated", me_validated, 20000), timed("fast", me_fast, 20000)
+    print(f"  saved      {slow - fast:10.1f} us/request ({slow / fast:.1f}x)")
@@ -1,7 +1,8 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
@@ -20,25 +21,57 @@ from notes_advanced_routes import router as notes_advanced_router
 from habits_advanced_routes import router as habits_advanced_router
 from integrations_routes import router as integrations_router
 from pomodoro_routes import router as pomodoro_router
+from debug_routes import router as debug_router
+from rank_index import rank_index
+from achievements import achievement_engine
+from leaderboards import leaderboard_rollup_job
+from guilds import setup_guilds
+from wikilinks import setup_backlinks
+from timeseries import setup_timeseries
+from streaks import streak_rollover_job
+from pomodoro_stats import setup_pomodoro
+from pomodoro_timers import pomodoro_timers
+from webhooks import webhook_dispatcher
+from outbox import outbox_relay
+from integration_tokens import token_refresh_scheduler
+from integration_sync import integration_sync_scheduler
+import database
+from serialization import ORJSONResponse
+from metrics import metrics, MetricsMiddleware, metrics_endpoint
+from query_profiler import query_profiler
+from indexes import index_registry
+from dependencies import get_db
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Connection verification and logging
 logger = logging.getLogger("uvicorn.error")
-logger.info(f"Connecting to MongoDB...")
 
 # CORS Configuration
 origins = os.environ.get('CORS_ORIGINS', '*').split(',')
 logger.info(f"CORS Allowed Origins: {origins}")
 
+# MongoDB connection: one shared client for the whole app, created in the lifespan
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Connecting to MongoDB...")
+    db = database.connect(event_listeners=[metrics.mongo_listener, query_profiler])
+    try:
+        await database.warm_up(db)
+    except Exception as e:
+        logger.error(f"MongoDB health check failed: {e}")
+    try:
+        report = await index_registry.reconcile(db)
+        logger.info(f"Indexes reconciled: {len(report['created'])} created, {len(report['rebuilt'])} rebuilt")
+    except Exception as e:
+        logger.error(f"Index reconciliation failed: {e}")
+    await start_background_services(db)
+    yield
+    await stop_background_services()
+    database.close()
+
 # Create the main app without a prefix
-app = FastAPI(title="INITIUM API", version="2.0.0")
+app = FastAPI(title="INITIUM API", version="2.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -65,7 +98,7 @@ async def root():
     }
 
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(input: StatusCheckCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     
@@ -77,16 +110,12 @@ async def create_status_check(input: StatusCheckCreate):
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    # Exclude MongoDB's _id field from the query results
-    status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
+async def get_status_checks(db: AsyncIOMotorDatabase = Depends(get_db)):
+    # Project exactly the StatusCheck fields; stored timestamps are already ISO strings
+    projection = {"_id": 0, **{field: 1 for field in StatusCheck.model_fields}}
+    status_checks = await db.status_checks.find({}, projection).to_list(1000)
     
-    # Convert ISO string timestamps back to datetime objects
-    for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
-    
-    return status_checks
+    return ORJSONResponse(status_checks)
 
 # Include all routes
 api_router.include_router(auth_router)
@@ -98,10 +127,14 @@ api_router.include_router(notes_advanced_router)
 api_router.include_router(habits_advanced_router)
 api_router.include_router(integrations_router)
 api_router.include_router(pomodoro_router)
+api_router.include_router(debug_router)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Prometheus scrape endpoint (outside /api, not part of the public schema)
+app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -109,6 +142,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so it is outermost and times the whole middleware stack
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -117,6 +152,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def start_background_services(db: AsyncIOMotorDatabase):
+    await rank_index.start(db)
+    await achievement_engine.start(db)
+    await leaderboard_rollup_job.start(db)
+    await setup_guilds(db)
+    await setup_backlinks(db)
+    await setup_timeseries(db)
+    await streak_rollover_job.start(db)
+    await setup_pomodoro(db)
+    await pomodoro_timers.start(db)
+    await webhook_dispatcher.start(db)
+    await outbox_relay.start(db)
+    await token_refresh_scheduler.start(db)
+    await integration_sync_scheduler.start(db)
+
+async def stop_background_services():
+    await rank_index.stop()
+    await achievement_engine.stop()
+    await leaderboard_rollup_job.stop()
+    await streak_rollover_job.stop()
+    await pomodoro_timers.stop()
+    await outbox_relay.stop()
+    await token_refresh_scheduler.stop()
+    await integration_sync_scheduler.stop()
+    await webhook_dispatcher.stop()
\ No newline at end of file
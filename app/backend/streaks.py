@@ -0,0 +1,234 @@
+"""
+Incremental streak tracking for habits.
+
+Each completion updates the habit's streak document and the user's overall
+streak (`habit_id` = "*") in O(1) with an atomic pipeline update keyed on the
+completion's local day number. A scheduled rollover job resets streaks whose
+last active day is older than yesterday in the user's timezone, and
+`python streaks.py backfill` recomputes every streak from the completion log
+in one streaming pass.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import asyncio
+import logging
+import os
+import uuid
+
+from achievements import achievement_engine
+from timeseries import as_utc
+from indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+USER_STREAK = "*"  # habit_id of the per-user "any habit" streak
+ROLLOVER_INTERVAL_SECONDS = int(os.environ.get("STREAK_ROLLOVER_SECONDS", "3600"))
+
+index_registry.declare("habit_streaks", [("user_id", 1), ("habit_id", 1)], unique=True)
+index_registry.declare("habit_streaks", [("tz", 1), ("current", 1), ("last_day", 1)])
+index_registry.declare("habit_completions", [("user_id", 1), ("habit_id", 1), ("day", 1)])
+
+def get_zone(tz: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {tz}")
+
+def local_day(when: datetime, tz: str) -> int:
+    """Proleptic ordinal of the local calendar day of `when` in `tz`"""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.astimezone(get_zone(tz)).date().toordinal()
+
+def _streak_pipeline(day: int, tz: str) -> List[dict]:
+    current = {"$ifNull": ["$current", 0]}
+    last_day = {"$ifNull": ["$last_day", -1]}
+    return [
+        {"$set": {"current": {"$switch": {
+            "branches": [
+                # Same day or an out-of-order older completion: unchanged
+                {"case": {"$gte": [last_day, day]}, "then": current},
+                {"case": {"$eq": [last_day, day - 1]}, "then": {"$add": [current, 1]}},
+            ],
+            "default": 1
+        }}}},
+        {"$set": {
+            "longest": {"$max": [{"$ifNull": ["$longest", 0]}, "$current"]},
+            "last_day": {"$max": [last_day, day]},
+            "tz": tz,
+        }},
+    ]
+
+async def _apply(db: AsyncIOMotorDatabase, user_id: str, habit_id: str, day: int, tz: str) -> Dict[str, Any]:
+    return await db.habit_streaks.find_one_and_update(
+        {"user_id": user_id, "habit_id": habit_id},
+        _streak_pipeline(day, tz),
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+# ==================== WRITE PATH ====================
+
+async def record_completion(
+    db: AsyncIOMotorDatabase,
+    user_id: str,
+    habit_id: str,
+    when: Optional[datetime] = None,
+    tz: str = "UTC"
+) -> Dict[str, Any]:
+    """Log a completion and update the habit and user streaks"""
+    when = when or datetime.now(timezone.utc)
+    day = local_day(when, tz)
+    await db.habit_completions.insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "habit_id": habit_id,
+        "completed_at": when,
+        "day": day,
+        "tz": tz
+    })
+    habit = await _apply(db, user_id, habit_id, day, tz)
+    overall = await _apply(db, user_id, USER_STREAK, day, tz)
+    await achievement_engine.record(db, user_id, maxima={"streak_days": overall["current"]})
+    return {"habit": habit, "overall": overall}
+
+async def record_sync_completions(
+    db: AsyncIOMotorDatabase,
+    user_id: str,
+    habits: List[Dict[str, Any]],
+    previous: Dict[str, Dict[str, Any]]
+):
+    """Record a completion for every synced habit whose lastCompleted moved forward"""
+    for habit in habits:
+        completed = habit.get("lastCompleted")
+        if not completed or not habit.get("id"):
+            continue
+        if completed == previous.get(habit["id"], {}).get("lastCompleted"):
+            continue
+        try:
+            when = as_utc(completed)
+        except (TypeError, ValueError):
+            continue
+        tz = habit.get("timezone") or "UTC"
+        try:
+            get_zone(tz)
+        except ValueError:
+            tz = "UTC"
+        await record_completion(db, user_id, habit["id"], when, tz)
+
+async def get_streaks(db: AsyncIOMotorDatabase, user_id: str) -> Dict[str, Any]:
+    docs = await db.habit_streaks.find({"user_id": user_id}, {"_id": 0}).to_list(1000)
+    overall = next((d for d in docs if d["habit_id"] == USER_STREAK), None)
+    return {"overall": overall, "habits": [d for d in docs if d["habit_id"] != USER_STREAK]}
+
+# ==================== ROLLOVER ====================
+
+async def rollover(db: AsyncIOMotorDatabase, now: Optional[datetime] = None) -> int:
+    """Reset streaks with no completion yesterday or today (per timezone)"""
+    now = now or datetime.now(timezone.utc)
+    reset = 0
+    for tz in await db.habit_streaks.distinct("tz", {"current": {"$gt": 0}}):
+        try:
+            today = local_day(now, tz)
+        except ValueError:
+            continue
+        result = await db.habit_streaks.update_many(
+            {"tz": tz, "current": {"$gt": 0}, "last_day": {"$lt": today - 1}},
+            {"$set": {"current": 0}}
+        )
+        reset += result.modified_count
+    return reset
+
+class StreakRolloverJob:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                reset = await rollover(db)
+                if reset:
+                    logger.info(f"Streak rollover reset {reset} streaks")
+            except Exception as e:
+                logger.error(f"Streak rollover failed: {e}")
+            await asyncio.sleep(ROLLOVER_INTERVAL_SECONDS)
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+streak_rollover_job = StreakRolloverJob()
+
+# ==================== BACKFILL ====================
+
+def _fold(state: Optional[Dict[str, Any]], day: int) -> Dict[str, Any]:
+    """Same transition as the pipeline update, for days visited in order"""
+    if state is None:
+        return {"current": 1, "longest": 1, "last_day": day}
+    if day <= state["last_day"]:
+        return state
+    current = state["current"] + 1 if day == state["last_day"] + 1 else 1
+    return {"current": current, "longest": max(state["longest"], current), "last_day": day}
+
+async def backfill(db: AsyncIOMotorDatabase, now: Optional[datetime] = None) -> int:
+    """Recompute all streaks from habit_completions in one pass sorted by user/day"""
+    written = 0
+    ops: List[UpdateOne] = []
+    user_id = None
+    states: Dict[str, Dict[str, Any]] = {}
+    tzs: Dict[str, str] = {}
+
+    async def flush_user():
+        nonlocal written
+        for habit_id, state in states.items():
+            ops.append(UpdateOne(
+                {"user_id": user_id, "habit_id": habit_id},
+                {"$set": {**state, "tz": tzs.get(habit_id, "UTC")}},
+                upsert=True
+            ))
+        if len(ops) >= 1000:
+            await db.habit_streaks.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops.clear()
+
+    cursor = db.habit_completions.find(
+        {}, {"_id": 0, "user_id": 1, "habit_id": 1, "day": 1, "tz": 1}
+    ).sort([("user_id", 1), ("day", 1)])
+    async for completion in cursor:
+        if completion["user_id"] != user_id:
+            if user_id is not None:
+                await flush_user()
+            user_id, states, tzs = completion["user_id"], {}, {}
+        tz = completion.get("tz", "UTC")
+        for habit_id in (completion["habit_id"], USER_STREAK):
+            states[habit_id] = _fold(states.get(habit_id), completion["day"])
+            tzs[habit_id] = tz
+    if user_id is not None:
+        await flush_user()
+    if ops:
+        await db.habit_streaks.bulk_write(ops, ordered=False)
+        written += len(ops)
+
+    # Apply missed-day rollover to the recomputed state
+    await rollover(db, now)
+    return written
+
+
+if __name__ == "__main__":
+    import sys
+    from database import connect
+
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python streaks.py backfill")
+        sys.exit(1)
+    count = asyncio.run(backfill(connect()))
+    print(f"Backfilled {count} streak documents")
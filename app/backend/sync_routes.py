@@ -5,7 +5,13 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime, timezone
 from models import UserInDB
 from dependencies import get_db, get_current_active_user
-import uuid
+from achievements import achievement_engine, counters_from_sync, SYNC_TRACKED_COLLECTIONS
+from notes_search import index_notes, clear_index
+from wikilinks import sync_note_links, clear_note_links
+from streaks import record_sync_completions, get_zone
+from outbox import emit_many
+from sync_store import SYNC_COLLECTIONS, bulk_upsert
+from serialization import ORJSONResponse
 
 router = APIRouter(prefix="/sync", tags=["synchronization"])
 
@@ -27,25 +33,51 @@ class PullResponse(BaseModel):
     data: Dict[str, List[Dict[str, Any]]]  # Collection name -> list of documents
     last_sync: datetime
 
+# ==================== ACHIEVEMENT COUNTERS ====================
+
+async def _previous_states(collection, user_id: str, documents: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Fetch stored state of the pushed documents in one $in query"""
+    ids = [doc['id'] for doc in documents if 'id' in doc]
+    if not ids:
+        return {}
+    cursor = collection.find(
+        {'user_id': user_id, 'id': {'$in': ids}},
+        {'_id': 0, 'id': 1, 'status': 1, 'lastCompleted': 1}
+    )
+    return {doc['id']: doc async for doc in cursor}
+
+async def _record_sync_counters(db, user_id: str, collection_name: str, documents, previous, tz: str):
+    inc, maxima = counters_from_sync(collection_name, documents, previous, tz)
+    await achievement_engine.record(db, user_id, inc=inc, maxima=maxima)
+    if collection_name == 'quests':
+        await emit_many(db, [
+            {'user_id': user_id, 'event': 'quest_completed', 'payload': {'quest_id': doc['id'], 'title': doc.get('title')}}
+            for doc in documents
+            if doc.get('status') == 'completed' and previous.get(doc.get('id'), {}).get('status') != 'completed'
+        ])
+
 # ==================== PUSH TO CLOUD ====================
 
 @router.post("/push", response_model=SyncResponse)
 async def push_to_cloud(
     sync_data: SyncDataModel,
+    tz: str = "UTC",
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Push local data to cloud MongoDB
-    Upserts documents based on 'id' field
+    Upserts documents based on 'id' field; `tz` is the user's timezone,
+    used for time-of-day achievements
     """
     collection_name = sync_data.collection
+    try:
+        get_zone(tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Validate collection name
-    allowed_collections = [
-        'quests', 'habits', 'projects', 'tasks', 'notes', 
-        'training', 'events', 'analytics', 'badges'
-    ]
+    allowed_collections = SYNC_COLLECTIONS
     
     if collection_name not in allowed_collections:
         raise HTTPException(
@@ -54,31 +86,22 @@ async def push_to_cloud(
         )
     
     collection = db[collection_name]
-    synced_count = 0
     
-    # Add user_id to all documents
-    for doc in sync_data.data:
-        doc['user_id'] = current_user.id
-        doc['synced_at'] = datetime.now(timezone.utc).isoformat()
-        
-        # Convert datetime objects to ISO strings if present
-        for key, value in doc.items():
-            if isinstance(value, datetime):
-                doc[key] = value.isoformat()
-        
-        # Upsert based on 'id' field
-        if 'id' in doc:
-            await collection.update_one(
-                {'id': doc['id'], 'user_id': current_user.id},
-                {'$set': doc},
-                upsert=True
-            )
-            synced_count += 1
-        else:
-            # If no id, create new document with generated id
-            doc['id'] = str(uuid.uuid4())
-            await collection.insert_one(doc)
-            synced_count += 1
+    tracked = collection_name in SYNC_TRACKED_COLLECTIONS
+    previous = await _previous_states(collection, current_user.id, sync_data.data) if tracked else {}
+    
+    # Upsert based on 'id' field (documents without one get a generated id)
+    synced_count = await bulk_upsert(collection, current_user.id, sync_data.data)
+    
+    if tracked:
+        await _record_sync_counters(db, current_user.id, collection_name, sync_data.data, previous, tz)
+    
+    if collection_name == 'habits':
+        await record_sync_completions(db, current_user.id, sync_data.data, previous)
+    
+    if collection_name == 'notes':
+        await index_notes(db, current_user.id, sync_data.data)
+        await sync_note_links(db, current_user.id, sync_data.data)
     
     return SyncResponse(
         success=True,
@@ -98,10 +121,7 @@ async def pull_from_cloud(
     Pull user's data from cloud MongoDB
     Returns all collections or specific ones
     """
-    allowed_collections = [
-        'quests', 'habits', 'projects', 'tasks', 'notes', 
-        'training', 'events', 'analytics', 'badges'
-    ]
+    allowed_collections = SYNC_COLLECTIONS
     
     # Determine which collections to pull
     if collections:
@@ -124,11 +144,12 @@ async def pull_from_cloud(
         # Convert ISO strings back to datetime if needed (optional, client handles this)
         result_data[collection_name] = docs
     
-    return PullResponse(
-        success=True,
-        data=result_data,
-        last_sync=datetime.now(timezone.utc)
-    )
+    # Stored documents are returned as-is: encoded directly, not revalidated as a PullResponse
+    return ORJSONResponse({
+        "success": True,
+        "data": result_data,
+        "last_sync": datetime.now(timezone.utc)
+    })
 
 # ==================== BULK SYNC (MIGRATE ALL) ====================
 
@@ -142,10 +163,7 @@ async def migrate_all_data(
     Migrate all local IndexedDB data to cloud in one go
     Accepts a dict with collection names as keys
     """
-    allowed_collections = [
-        'quests', 'habits', 'projects', 'tasks', 'notes', 
-        'training', 'events', 'analytics', 'badges'
-    ]
+    allowed_collections = SYNC_COLLECTIONS
     
     results = {}
     total_synced = 0
@@ -159,28 +177,21 @@ async def migrate_all_data(
             continue
         
         collection = db[collection_name]
-        synced_count = 0
         
-        for doc in documents:
-            doc['user_id'] = current_user.id
-            doc['synced_at'] = datetime.now(timezone.utc).isoformat()
-            
-            # Convert datetime objects to ISO strings
-            for key, value in doc.items():
-                if isinstance(value, datetime):
-                    doc[key] = value.isoformat()
-            
-            if 'id' in doc:
-                await collection.update_one(
-                    {'id': doc['id'], 'user_id': current_user.id},
-                    {'$set': doc},
-                    upsert=True
-                )
-                synced_count += 1
-            else:
-                doc['id'] = str(uuid.uuid4())
-                await collection.insert_one(doc)
-                synced_count += 1
+        tracked = collection_name in SYNC_TRACKED_COLLECTIONS
+        previous = await _previous_states(collection, current_user.id, documents) if tracked else {}
+        
+        synced_count = await bulk_upsert(collection, current_user.id, documents)
+        
+        if tracked:
+            await _record_sync_counters(db, current_user.id, collection_name, documents, previous)
+        
+        if collection_name == 'habits':
+            await record_sync_completions(db, current_user.id, documents, previous)
+        
+        if collection_name == 'notes':
+            await index_notes(db, current_user.id, documents)
+            await sync_note_links(db, current_user.id, documents)
         
         results[collection_name] = {
             'success': True,
@@ -208,10 +219,7 @@ async def clear_cloud_data(
     Clear user's data from cloud (specific collections or all)
     Use with caution!
     """
-    allowed_collections = [
-        'quests', 'habits', 'projects', 'tasks', 'notes', 
-        'training', 'events', 'analytics', 'badges'
-    ]
+    allowed_collections = SYNC_COLLECTIONS
     
     if collections:
         collections_to_clear = [c.strip() for c in collections.split(',')]
@@ -226,6 +234,10 @@ async def clear_cloud_data(
         result = await collection.delete_many({'user_id': current_user.id})
         deleted_counts[collection_name] = result.deleted_count
     
+    if 'notes' in collections_to_clear:
+        await clear_index(db, current_user.id)
+        await clear_note_links(db, current_user.id)
+    
     return {
         'success': True,
         'deleted_counts': deleted_counts,
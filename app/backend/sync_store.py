@@ -0,0 +1,49 @@
+"""
+Bulk write path for synced documents.
+
+Shared by the client sync endpoints and the integration sync workers:
+documents are stamped with their owner and sync time, datetimes are stored
+as ISO strings (the format clients push and pull), and the whole batch is
+upserted by `id` with unordered bulk writes.
+"""
+from pymongo import UpdateOne, InsertOne
+from typing import Dict, List, Any
+from datetime import datetime, timezone
+import uuid
+
+from indexes import index_registry
+
+SYNC_COLLECTIONS = [
+    'quests', 'habits', 'projects', 'tasks', 'notes',
+    'training', 'events', 'analytics', 'badges'
+]
+
+BULK_CHUNK_SIZE = 1000
+
+# Pulls filter on user_id, upserts on (id, user_id)
+for _collection in SYNC_COLLECTIONS:
+    index_registry.declare(_collection, [("user_id", 1), ("id", 1)])
+
+def prepare_document(doc: Dict[str, Any], user_id: str, synced_at: str) -> Dict[str, Any]:
+    doc['user_id'] = user_id
+    doc['synced_at'] = synced_at
+    for key, value in doc.items():
+        if isinstance(value, datetime):
+            doc[key] = value.isoformat()
+    return doc
+
+async def bulk_upsert(collection, user_id: str, documents: List[Dict[str, Any]]) -> int:
+    """Upsert documents by (id, user_id) in unordered chunks; returns how many were written"""
+    synced_at = datetime.now(timezone.utc).isoformat()
+    ops: List[Any] = []
+    for doc in documents:
+        prepare_document(doc, user_id, synced_at)
+        if 'id' in doc:
+            ops.append(UpdateOne({'id': doc['id'], 'user_id': user_id}, {'$set': doc}, upsert=True))
+        else:
+            # Documents without an id are always new
+            doc['id'] = str(uuid.uuid4())
+            ops.append(InsertOne(doc))
+    for start in range(0, len(ops), BULK_CHUNK_SIZE):
+        await collection.bulk_write(ops[start:start + BULK_CHUNK_SIZE], ordered=False)
+    return len(ops)
@@ -0,0 +1,203 @@
+"""
+Time-series storage for mood entries and habit metrics.
+
+Entries are stored with a real BSON `date` (range-indexable with
+(user_id, ..., date)) and every write also updates precomputed daily,
+weekly and monthly rollups (count/sum/min/max) in `metric_rollups`, so
+charts read a few dozen rollup rows instead of thousands of raw points.
+
+Rollups are rebuilt from the raw entries by the one-shot date migration.
+Each live write (entries plus their rollup update) first passes
+`rollup_gate`, which holds it back while that migration's lease is held, so
+no entry is both counted by the rebuild and incremented by its writer.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import time
+
+from indexes import index_registry
+from migrations import run_once
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("daily", "weekly", "monthly")
+
+MOOD_SERIES = "mood"
+
+ROLLUP_MIGRATION = "timeseries_dates_v1"
+# How stale a worker's view of the migration lease may be, and how long a gated write may take
+GATE_CHECK_SECONDS = 2.0
+WRITE_GRACE_SECONDS = 5.0
+
+index_registry.declare("mood_entries", [("user_id", 1), ("date", -1)])
+index_registry.declare("habit_metrics", [("user_id", 1), ("habit_id", 1), ("date", -1)])
+index_registry.declare("metric_rollups", [("user_id", 1), ("series", 1), ("period", 1), ("period_start", 1)], unique=True)
+
+def metric_series(habit_id: str, metric_type: str) -> str:
+    return f"metric:{habit_id}:{metric_type}"
+
+def as_utc(value: Any) -> datetime:
+    """Parse ISO strings and normalize naive datetimes (Mongo returns naive UTC)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def period_start(period: str, when: datetime) -> datetime:
+    day = as_utc(when).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "daily":
+        return day
+    if period == "weekly":
+        return day - timedelta(days=day.weekday())
+    if period == "monthly":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown rollup period: {period}")
+
+# ==================== WRITE PATH ====================
+
+class RollupGate:
+    """Holds live rollup writes back while the rollup rebuild migration holds its lease"""
+
+    def __init__(self):
+        self.settled = False
+        self.rebuilding = False
+        self.checked_at = float("-inf")
+
+    async def _check(self, db: AsyncIOMotorDatabase):
+        doc = await db.migrations.find_one({"_id": ROLLUP_MIGRATION}, {"applied_at": 1, "claimed_until": 1})
+        self.checked_at = time.monotonic()
+        # Once applied it never runs again: stop asking
+        self.settled = bool(doc and doc.get("applied_at"))
+        claimed_until = (doc or {}).get("claimed_until")
+        self.rebuilding = not self.settled and claimed_until is not None and as_utc(claimed_until) > datetime.now(timezone.utc)
+
+    async def wait(self, db: AsyncIOMotorDatabase):
+        while not self.settled:
+            if time.monotonic() - self.checked_at >= GATE_CHECK_SECONDS:
+                await self._check(db)
+            if not self.rebuilding:
+                return
+            await asyncio.sleep(GATE_CHECK_SECONDS)
+
+rollup_gate = RollupGate()
+
+def rollup_ops(user_id: str, points: Iterable[Tuple[str, datetime, float]]) -> List[UpdateOne]:
+    """Rollup upserts for (series, date, value) points, pre-aggregated per bucket"""
+    buckets: Dict[Tuple[str, str, datetime], Dict[str, float]] = {}
+    for series, when, value in points:
+        for period in PERIODS:
+            key = (series, period, period_start(period, when))
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = {"count": 1, "sum": value, "min": value, "max": value}
+            else:
+                agg["count"] += 1
+                agg["sum"] += value
+                agg["min"] = min(agg["min"], value)
+                agg["max"] = max(agg["max"], value)
+    return [
+        UpdateOne(
+            {"user_id": user_id, "series": series, "period": period, "period_start": start},
+            {
+                "$inc": {"count": agg["count"], "sum": agg["sum"]},
+                "$min": {"min": agg["min"]},
+                "$max": {"max": agg["max"]},
+            },
+            upsert=True
+        )
+        for (series, period, start), agg in buckets.items()
+    ]
+
+async def update_rollups(db: AsyncIOMotorDatabase, user_id: str, points: List[Tuple[str, datetime, float]]):
+    ops = rollup_ops(user_id, points)
+    if ops:
+        await db.metric_rollups.bulk_write(ops, ordered=False)
+
+def mood_point(doc: Dict[str, Any]) -> Tuple[str, datetime, float]:
+    return (MOOD_SERIES, doc["date"], float(doc["energy_level"]))
+
+def metric_point(doc: Dict[str, Any]) -> Tuple[str, datetime, float]:
+    return (metric_series(doc["habit_id"], doc["metric_type"]), doc["date"], float(doc["value"]))
+
+# ==================== READ PATH ====================
+
+def date_range(days: Optional[int], start: Optional[datetime], end: Optional[datetime]) -> Dict[str, datetime]:
+    """Mongo range filter for `date`; `days` counts back from now when no start is given"""
+    query: Dict[str, datetime] = {}
+    if start is None and days:
+        start = datetime.now(timezone.utc) - timedelta(days=days)
+    if start is not None:
+        query["$gte"] = as_utc(start)
+    if end is not None:
+        query["$lt"] = as_utc(end)
+    return query
+
+async def get_rollups(
+    db: AsyncIOMotorDatabase,
+    user_id: str,
+    series: str,
+    period: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    query: Dict[str, Any] = {"user_id": user_id, "series": series, "period": period}
+    window = date_range(None, start, end)
+    if window:
+        query["period_start"] = window
+    rows = await db.metric_rollups.find(
+        query,
+        {"_id": 0, "period_start": 1, "count": 1, "sum": 1, "min": 1, "max": 1}
+    ).sort("period_start", 1).to_list(1000)
+    for row in rows:
+        row["mean"] = row["sum"] / row["count"] if row.get("count") else None
+    return rows
+
+# ==================== MIGRATION ====================
+
+async def _convert_string_dates(db: AsyncIOMotorDatabase, collection: str) -> int:
+    result = await db[collection].update_many(
+        {"date": {"$type": "string"}},
+        [{"$set": {"date": {"$dateFromString": {"dateString": "$date"}}}}]
+    )
+    return result.modified_count
+
+async def rebuild_rollups(db: AsyncIOMotorDatabase, grace_seconds: float = GATE_CHECK_SECONDS + WRITE_GRACE_SECONDS):
+    """
+    Recompute all rollups from raw entries in one streaming pass per collection.
+
+    Must run under the ROLLUP_MIGRATION lease: live writes are then held by
+    `rollup_gate`. Waiting `grace_seconds` first lets every worker notice the
+    lease and finish the writes it had already let through, so nothing is
+    written while the rollups are cleared and recomputed.
+    """
+    await asyncio.sleep(grace_seconds)
+    await db.metric_rollups.delete_many({})
+    for collection, to_point in (("mood_entries", mood_point), ("habit_metrics", metric_point)):
+        user_id, points = None, []
+        async for doc in db[collection].find({}, {"_id": 0}).sort("user_id", 1):
+            if points and (doc["user_id"] != user_id or len(points) >= 1000):
+                await update_rollups(db, user_id, points)
+                points = []
+            user_id = doc["user_id"]
+            points.append(to_point(doc))
+        if points:
+            await update_rollups(db, user_id, points)
+
+async def _migrate_string_dates(db: AsyncIOMotorDatabase):
+    converted = 0
+    for collection in ("mood_entries", "habit_metrics"):
+        converted += await _convert_string_dates(db, collection)
+    logger.info(f"Converted {converted} legacy string dates, rebuilding rollups")
+    await rebuild_rollups(db)
+
+async def setup_timeseries(db: AsyncIOMotorDatabase):
+    try:
+        # Legacy entries stored ISO strings: one worker converts them and rebuilds rollups
+        await run_once(db, ROLLUP_MIGRATION, _migrate_string_dates)
+    except Exception as e:
+        logger.error(f"Time-series setup failed: {e}")
@@ -0,0 +1,593 @@
+"""
+Webhook delivery.
+
+The outbox relay hands events to `webhook_dispatcher.accept(...)`, which
+looks up the subscribed webhooks in an in-memory (user_id, event) routing
+index and stores one `webhook_deliveries` document per (event, webhook)
+before the relay advances its checkpoint; a replayed event maps to the same
+documents and is not delivered twice. The stored deliveries are claimed by
+the accepting worker and put on an in-memory queue, where a bounded pool of
+asyncio workers POSTs them through one shared, connection-pooled httpx client, with a
+concurrency cap per endpoint and an HMAC-SHA256 signature made with the
+webhook's secret. Webhooks created with `batch=True` receive the events of
+a short window in one POST (`{"events": [...]}`).
+
+Failed attempts get a next attempt time (exponential backoff, full
+jitter); every worker polls for due deliveries and claims them, so retries,
+and deliveries that did not fit in the queue, survive restarts. Deliveries
+that exhaust MAX_ATTEMPTS stay there as `failed` for
+DELIVERY_RETENTION_DAYS.
+
+Webhook URLs must be https and must not resolve to private, loopback,
+link-local or otherwise non-public addresses (`check_webhook_url`). The
+check runs again on every delivery and the request goes to the address it
+validated (with the original Host header and TLS server name), so a DNS
+answer that changes after registration cannot redirect deliveries to an
+internal address.
+
+`python webhooks.py bench [count]` accepts outbox events into an in-memory
+(mongomock) database, delivers them to a local stand-in receiver and prints
+deliveries/sec (mongomock bounds the absolute numbers; compare runs, not
+environments).
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+
+import httpx
+
+from outbox import BATCH_SIZE, outbox_relay
+from timeseries import as_utc
+from indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "8"))
+QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "10000"))
+PER_ENDPOINT_CONCURRENCY = int(os.environ.get("WEBHOOK_PER_ENDPOINT_CONCURRENCY", "2"))
+MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 300.0
+BATCH_WINDOW_SECONDS = float(os.environ.get("WEBHOOK_BATCH_WINDOW_MS", "500")) / 1000
+BATCH_MAX_EVENTS = 100
+TIMEOUT_SECONDS = 10.0
+RETRY_POLL_SECONDS = float(os.environ.get("WEBHOOK_RETRY_POLL_SECONDS", "5"))
+RETRY_BATCH = 500
+CLAIM_SECONDS = 60
+DELIVERY_RETENTION_DAYS = 7
+
+SIGNATURE_HEADER = "X-Initium-Signature"
+TIMESTAMP_HEADER = "X-Initium-Timestamp"
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """sha256=<hex HMAC of "<timestamp>.<body>">, so receivers can reject replays"""
+    mac = hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256)
+    return "sha256=" + mac.hexdigest()
+
+def _retryable(status_code: int) -> bool:
+    return status_code >= 500 or status_code in (408, 429)
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def _public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+class UnsafeWebhookURL(ValueError):
+    """The URL is not https or its host has a non-public address: never deliver to it"""
+
+async def _lookup(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+async def check_webhook_url(url: str) -> str:
+    """
+    Raise ValueError unless `url` is https and every address of its host is
+    public (UnsafeWebhookURL when it is not, plain ValueError when the host
+    does not resolve); returns the validated address to connect to.
+    """
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.hostname:
+        raise UnsafeWebhookURL("Webhook URL must be an https:// URL")
+    try:
+        addresses = await _lookup(parts.hostname, parts.port or 443)
+    except (ValueError, socket.gaierror):
+        raise ValueError(f"Cannot resolve webhook host {parts.hostname}")
+    if not addresses:
+        raise ValueError(f"Cannot resolve webhook host {parts.hostname}")
+    if not all(_public_address(address) for address in addresses):
+        raise UnsafeWebhookURL("Webhook URL must point to a public host")
+    return addresses[0]
+
+async def pinned_request(url: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """
+    (url, headers, extensions) sending a request for `url` to the address
+    `check_webhook_url` just validated, so DNS cannot change it in between
+    """
+    address = await check_webhook_url(url)
+    parts = urlsplit(url)
+    host = f"[{address}]" if ":" in address else address
+    netloc = f"{host}:{parts.port}" if parts.port else host
+    # Certificate checks and virtual hosting still use the registered hostname
+    return parts._replace(netloc=netloc).geturl(), {"Host": parts.netloc.rsplit("@", 1)[-1]}, {"sni_hostname": parts.hostname}
+
+ROUTES_POLL_SECONDS = float(os.environ.get("WEBHOOK_ROUTES_POLL_SECONDS", "5"))
+ROUTE_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "events": 1, "url": 1, "secret": 1, "batch": 1}
+
+index_registry.declare("webhooks", [("user_id", 1), ("events", 1)])
+index_registry.declare("webhook_deliveries", "key", unique=True)
+index_registry.declare("webhook_deliveries", [("status", 1), ("next_attempt_at", 1)])
+index_registry.declare("webhook_deliveries", "finished_at", ttl_seconds=DELIVERY_RETENTION_DAYS * 86400)
+
+class WebhookRoutes:
+    """(user_id, event) -> active webhooks, kept in memory.
+
+    Local creates/deletes apply immediately and bump a shared version in
+    `cache_versions`; other workers notice the bump when polling and reload.
+    """
+
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.version: Optional[int] = None
+        self.loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, user_id: str, event: str) -> List[Dict[str, Any]]:
+        return self._routes.get((user_id, event), [])
+
+    def _add(self, routes: Dict[Tuple[str, str], List[Dict[str, Any]]], webhook: Dict[str, Any]):
+        target = {k: webhook.get(k) for k in ("id", "url", "secret", "batch")}
+        for event in set(webhook.get("events") or []):
+            routes.setdefault((webhook["user_id"], event), []).append(target)
+
+    def _discard(self, webhook_id: str):
+        for key in list(self._routes):
+            remaining = [w for w in self._routes[key] if w["id"] != webhook_id]
+            if remaining:
+                self._routes[key] = remaining
+            else:
+                del self._routes[key]
+
+    async def _current_version(self, db: AsyncIOMotorDatabase) -> int:
+        doc = await db.cache_versions.find_one({"_id": "webhooks"})
+        return doc["version"] if doc else 0
+
+    async def load(self, db: AsyncIOMotorDatabase):
+        version = await self._current_version(db)
+        routes: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        async for webhook in db.webhooks.find({"active": True}, ROUTE_FIELDS):
+            self._add(routes, webhook)
+        self._routes, self.version, self.loaded = routes, version, True
+
+    async def _bump(self, db: AsyncIOMotorDatabase):
+        doc = await db.cache_versions.find_one_and_update(
+            {"_id": "webhooks"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        # Our own change is already applied; only skip the reload if nobody else changed anything
+        if self.version is not None and doc["version"] == self.version + 1:
+            self.version = doc["version"]
+
+    async def added(self, db: AsyncIOMotorDatabase, webhook: Dict[str, Any]):
+        if webhook.get("active", True):
+            self._add(self._routes, webhook)
+        await self._bump(db)
+
+    async def removed(self, db: AsyncIOMotorDatabase, webhook_id: str):
+        self._discard(webhook_id)
+        await self._bump(db)
+
+    async def _poll(self, db: AsyncIOMotorDatabase):
+        while True:
+            await asyncio.sleep(ROUTES_POLL_SECONDS)
+            try:
+                if await self._current_version(db) != self.version:
+                    await self.load(db)
+            except Exception as e:
+                logger.error(f"Webhook routes refresh failed: {e}")
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        try:
+            await self.load(db)
+            logger.info(f"Webhook routes loaded ({len(self._routes)} keys)")
+        except Exception as e:
+            logger.error(f"Could not load webhook routes: {e}")
+        self._task = asyncio.create_task(self._poll(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+def _envelope(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Body of one outbox event as sent to receivers (the stable id lets them de-duplicate)"""
+    return {
+        "id": event["id"],
+        "event": event["event"],
+        "occurred_at": as_utc(event["created_at"]).isoformat(),
+        "data": event["payload"],
+    }
+
+@dataclass
+class _Delivery:
+    webhook: Dict[str, Any]
+    events: List[Dict[str, Any]]
+    attempt: int = 0
+    stored: bool = False  # has webhook_deliveries documents to settle
+
+    def keys(self) -> List[str]:
+        return [delivery_key(event["id"], self.webhook["id"]) for event in self.events]
+
+def delivery_key(event_id: str, webhook_id: str) -> str:
+    return f"{event_id}:{webhook_id}"
+
+class WebhookDispatcher:
+    def __init__(self):
+        self.db: Optional[AsyncIOMotorDatabase] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # webhook id -> [semaphore, deliveries holding or waiting for it]; dropped when idle
+        self._endpoint_limits: Dict[str, List[Any]] = {}
+        self._retry_task: Optional[asyncio.Task] = None
+        self._batches: Dict[str, List[Dict[str, Any]]] = {}
+        self.routes = WebhookRoutes()
+        self.stats = {"published": 0, "delivered": 0, "retried": 0, "failed": 0, "dropped": 0}
+
+    # ---------- routing ----------
+
+    async def subscribers(self, user_id: str, event: str) -> List[Dict[str, Any]]:
+        if self.routes.loaded:
+            return self.routes.get(user_id, event)
+        return await self.db.webhooks.find(
+            {"user_id": user_id, "events": event, "active": True},
+            {"_id": 0, "id": 1, "url": 1, "secret": 1, "batch": 1}
+        ).to_list(100)
+
+    def _add_to_batch(self, webhook: Dict[str, Any], envelope: Dict[str, Any], stored: bool = False):
+        batch = self._batches.get(webhook["id"])
+        if batch is None:
+            batch = self._batches[webhook["id"]] = _Delivery(webhook, [], stored=stored)
+            asyncio.get_running_loop().call_later(BATCH_WINDOW_SECONDS, self._flush_batch, webhook)
+        batch.events.append(envelope)
+        batch.stored = batch.stored or stored
+        if len(batch.events) >= BATCH_MAX_EVENTS:
+            self._flush_batch(webhook)
+
+    def _flush_batch(self, webhook: Dict[str, Any]):
+        batch = self._batches.pop(webhook["id"], None)
+        if batch is not None and batch.events:
+            self._enqueue(batch)
+
+    async def accept(self, events: List[Dict[str, Any]]):
+        """
+        Durably accept outbox events: store their deliveries, then queue the new
+        ones. Raises if they could not be stored, so the relay retries the batch.
+        """
+        now = datetime.now(timezone.utc)
+        claimed_until = now + timedelta(seconds=CLAIM_SECONDS)
+        docs, targets = [], []
+        for event in events:
+            envelope = _envelope(event)
+            for webhook in await self.subscribers(event["user_id"], event["event"]):
+                docs.append({
+                    "key": delivery_key(event["id"], webhook["id"]),
+                    "webhook_id": webhook["id"],
+                    "event": envelope,
+                    "status": "pending",
+                    "attempt": 0,
+                    "next_attempt_at": now,
+                    "claimed_until": claimed_until,
+                    "created_at": now,
+                })
+                targets.append((webhook, envelope))
+        if not docs:
+            return
+        stored = set(range(len(docs)))
+        try:
+            await self.db.webhook_deliveries.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            # Already stored by an earlier (replayed or retried) batch: not delivered twice
+            stored -= {err["index"] for err in errors}
+        for index in sorted(stored):
+            webhook, envelope = targets[index]
+            self.stats["published"] += 1
+            if webhook.get("batch"):
+                self._add_to_batch(webhook, envelope, stored=True)
+            else:
+                self._enqueue(_Delivery(webhook, [envelope], stored=True))
+
+    def _enqueue(self, delivery: _Delivery):
+        try:
+            self._queue.put_nowait(delivery)
+        except asyncio.QueueFull:
+            if delivery.stored:
+                # Still pending in Mongo: picked up again once its claim expires
+                return
+            self.stats["dropped"] += 1
+            logger.warning(f"Webhook queue full, dropped delivery to {delivery.webhook['id']}")
+
+    # ---------- delivery ----------
+
+    def _body(self, delivery: _Delivery) -> bytes:
+        if delivery.webhook.get("batch"):
+            payload: Any = {"events": delivery.events}
+        else:
+            payload = delivery.events[0]
+        return json.dumps(payload, separators=(",", ":"), default=str).encode()
+
+    async def _deliver(self, delivery: _Delivery):
+        webhook = delivery.webhook
+        body = self._body(delivery)
+        timestamp = str(int(time.time()))
+        headers = {"Content-Type": "application/json", TIMESTAMP_HEADER: timestamp}
+        if webhook.get("secret"):
+            headers[SIGNATURE_HEADER] = sign(webhook["secret"], timestamp, body)
+
+        limit = self._endpoint_limits.setdefault(webhook["id"], [asyncio.Semaphore(PER_ENDPOINT_CONCURRENCY), 0])
+        limit[1] += 1
+        try:
+            async with limit[0]:
+                url, host, extensions = await self._target(webhook["url"])
+                response = await self.client.post(url, content=body, headers={**headers, **host}, extensions=extensions)
+            if response.status_code < 300:
+                self.stats["delivered"] += 1
+                await self._settle(delivery, "delivered")
+                return
+            retry = _retryable(response.status_code)
+            reason = f"HTTP {response.status_code}"
+        except UnsafeWebhookURL as e:
+            retry = False
+            reason = str(e)
+        except (httpx.HTTPError, ValueError) as e:
+            # ValueError: the host did not resolve, which may be temporary
+            retry = True
+            reason = repr(e)
+        finally:
+            limit[1] -= 1
+            if not limit[1]:
+                self._endpoint_limits.pop(webhook["id"], None)
+
+        delivery.attempt += 1
+        if retry and delivery.attempt < MAX_ATTEMPTS:
+            self.stats["retried"] += 1
+            await self._store(delivery, "pending", reason)
+        else:
+            self.stats["failed"] += 1
+            logger.warning(f"Webhook {webhook['id']} delivery failed after {delivery.attempt} attempts: {reason}")
+            await self._store(delivery, "failed", reason)
+
+    async def _target(self, url: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        return await pinned_request(url)
+
+    # ---------- durable retries ----------
+
+    async def _settle(self, delivery: _Delivery, status: str):
+        if not delivery.stored or self.db is None:
+            return
+        await self.db.webhook_deliveries.update_many(
+            {"key": {"$in": delivery.keys()}},
+            {"$set": {"status": status, "finished_at": datetime.now(timezone.utc), "claimed_until": None}}
+        )
+
+    async def _store(self, delivery: _Delivery, status: str, reason: str):
+        """Persist a failed attempt: `pending` with its next attempt time, or `failed` for good"""
+        if self.db is None:
+            return
+        now = datetime.now(timezone.utc)
+        update: Dict[str, Any] = {"status": status, "attempt": delivery.attempt, "last_error": reason, "claimed_until": None}
+        if status == "pending":
+            update["next_attempt_at"] = now + timedelta(seconds=backoff(delivery.attempt))
+        else:
+            update["finished_at"] = now
+        webhook = delivery.webhook
+        await self.db.webhook_deliveries.bulk_write([
+            UpdateOne(
+                {"key": key},
+                {"$set": update, "$setOnInsert": {
+                    "key": key, "webhook_id": webhook["id"], "event": event, "created_at": now
+                }},
+                upsert=True
+            )
+            for key, event in zip(delivery.keys(), delivery.events)
+        ], ordered=False)
+
+    async def requeue_due(self) -> int:
+        """Claim due pending deliveries and queue them; returns how many were claimed"""
+        db = self.db
+        now = datetime.now(timezone.utc)
+        due = {
+            "status": "pending",
+            "next_attempt_at": {"$lte": now},
+            "$or": [{"claimed_until": None}, {"claimed_until": {"$lt": now}}]
+        }
+        ids = [doc["_id"] async for doc in db.webhook_deliveries.find(due, {"_id": 1}).limit(RETRY_BATCH)]
+        if not ids:
+            return 0
+        claim = str(uuid.uuid4())
+        await db.webhook_deliveries.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"claim": claim, "claimed_until": now + timedelta(seconds=CLAIM_SECONDS)}}
+        )
+        by_webhook: Dict[str, List[Dict[str, Any]]] = {}
+        async for doc in db.webhook_deliveries.find({"_id": {"$in": ids}, "claim": claim}):
+            by_webhook.setdefault(doc["webhook_id"], []).append(doc)
+        if not by_webhook:
+            return 0
+
+        webhooks = {
+            webhook["id"]: webhook
+            async for webhook in db.webhooks.find({"id": {"$in": list(by_webhook)}, "active": True}, ROUTE_FIELDS)
+        }
+        gone = [doc["key"] for webhook_id, docs in by_webhook.items() if webhook_id not in webhooks for doc in docs]
+        if gone:
+            await db.webhook_deliveries.update_many(
+                {"key": {"$in": gone}},
+                {"$set": {"status": "failed", "last_error": "webhook removed", "finished_at": now}}
+            )
+        for webhook_id, docs in by_webhook.items():
+            webhook = webhooks.get(webhook_id)
+            if webhook is None:
+                continue
+            size = BATCH_MAX_EVENTS if webhook.get("batch") else 1
+            for start in range(0, len(docs), size):
+                chunk = docs[start:start + size]
+                self._enqueue(_Delivery(
+                    webhook, [doc["event"] for doc in chunk],
+                    attempt=max(doc.get("attempt", 0) for doc in chunk), stored=True
+                ))
+        return sum(len(docs) for docs in by_webhook.values())
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(RETRY_POLL_SECONDS)
+            try:
+                await self.requeue_due()
+            except Exception as e:
+                logger.error(f"Webhook retry poll failed: {e}")
+
+    async def _worker(self):
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await self._deliver(delivery)
+            except Exception as e:
+                logger.error(f"Webhook worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    # ---------- lifecycle ----------
+
+    async def start(self, db: AsyncIOMotorDatabase, client: Optional[httpx.AsyncClient] = None):
+        self.db = db
+        self.client = client or httpx.AsyncClient(
+            timeout=TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            follow_redirects=False
+        )
+        self._queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        if db is not None:
+            await self.routes.start(db)
+            self._retry_task = asyncio.create_task(self._retry_loop())
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(WORKERS)]
+
+    async def stop(self):
+        await self.routes.stop()
+        if self._retry_task:
+            self._retry_task.cancel()
+            self._retry_task = None
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+webhook_dispatcher = WebhookDispatcher()
+
+# ==================== OUTBOX CONSUMER ====================
+
+@outbox_relay.consumer("webhooks")
+async def _webhooks_consumer(db: AsyncIOMotorDatabase, events: List[Dict[str, Any]]):
+    await webhook_dispatcher.accept(events)
+
+
+if __name__ == "__main__":
+    import sys
+
+    class _StandInReceiver:
+        """Minimal keep-alive HTTP/1.1 server that verifies signatures and counts deliveries"""
+
+        def __init__(self, secret: str):
+            self.secret = secret
+            self.received = 0
+            self.bad_signatures = 0
+
+        async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                while True:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                    headers = {}
+                    for line in head.decode().split("\r\n")[1:]:
+                        if ":" in line:
+                            key, value = line.split(":", 1)
+                            headers[key.strip().lower()] = value.strip()
+                    body = await reader.readexactly(int(headers.get("content-length", 0)))
+                    expected = sign(self.secret, headers.get(TIMESTAMP_HEADER.lower(), ""), body)
+                    if not hmac.compare_digest(expected, headers.get(SIGNATURE_HEADER.lower(), "")):
+                        self.bad_signatures += 1
+                    self.received += 1
+                    writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+
+    class _BenchDispatcher(WebhookDispatcher):
+        async def _target(self, url: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+            # The stand-in receiver is plain http on loopback, which check_webhook_url rejects
+            return url, {}, {}
+
+    async def bench(count: int):
+        from mongomock_motor import AsyncMongoMockClient
+
+        db = AsyncMongoMockClient()["webhooks_bench"]
+        secret = "bench-secret"
+        receiver = _StandInReceiver(secret)
+        server = await asyncio.start_server(receiver.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/hook"
+        webhooks = [
+            {"id": f"wh{i}", "user_id": "bench", "url": url, "secret": secret,
+             "events": ["xp_gained"], "active": True}
+            for i in range(4)
+        ]
+        await db.webhooks.insert_many(webhooks)
+        dispatcher = _BenchDispatcher()
+        await dispatcher.start(db)
+        created_at = datetime.now(timezone.utc)
+        events = [
+            {"id": f"ev{i}", "user_id": "bench", "event": "xp_gained",
+             "payload": {"amount": i}, "created_at": created_at}
+            for i in range(count)
+        ]
+        started = time.perf_counter()
+        # Same batches the outbox relay hands to its consumers
+        for offset in range(0, count, BATCH_SIZE):
+            await dispatcher.accept(events[offset:offset + BATCH_SIZE])
+        while receiver.received < count * len(webhooks):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        await dispatcher.stop()
+        server.close()
+        print(f"Delivered {receiver.received} webhooks in {elapsed:.2f}s "
+              f"({receiver.received / elapsed:,.0f}/sec, {receiver.bad_signatures} bad signatures)")
+
+    if sys.argv[1:2] != ["bench"]:
+        print("Usage: python webhooks.py bench [count]")
+        sys.exit(1)
+    asyncio.run(bench(int(sys.argv[2]) if len(sys.argv) > 2 else 250))
@@ -0,0 +1,263 @@
+"""
+Automatic [[wikilink]] extraction and the note link graph.
+
+When notes are synced, their `[[Title]]` links are parsed and stored per
+source note in `note_links` (resolved or not), then resolved to note ids;
+the old and new edge sets are diffed so only added/removed edges are
+written to `backlinks`, in one bulk write. A pushed note also re-resolves
+the notes that link to its title (it may have just been created or renamed)
+and those that linked to it before (it may have been renamed away).
+
+An edge can exist both as a wikilink and as a manual link; `origins` lists
+every source of the edge, and an edge is deleted only once none is left.
+Graph queries are served
+from a per-user adjacency cache (invalidated on edge changes, with a TTL
+to bound staleness across workers).
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from advanced_models import BacklinkModel
+from typing import Dict, List, Any, Set, Tuple
+from collections import OrderedDict, deque
+import logging
+import re
+import time
+
+from indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+WIKILINK_RE = re.compile(r"\[\[([^\[\]|#]+)(?:[|#][^\[\]]*)?\]\]")
+
+CACHE_TTL_SECONDS = 60
+CACHE_MAX_USERS = 256
+MAX_GRAPH_DEPTH = 3
+
+index_registry.declare("backlinks", [("user_id", 1), ("target_id", 1)])
+index_registry.declare("backlinks", [("user_id", 1), ("source_id", 1), ("target_id", 1)], unique=True)
+index_registry.declare("note_links", [("user_id", 1), ("source_id", 1)], unique=True)
+index_registry.declare("note_links", [("user_id", 1), ("titles", 1)])
+
+def extract_links(content: str) -> Set[str]:
+    """Link targets (note titles) referenced as [[Title]], [[Title|alias]] or [[Title#section]]"""
+    return {m.group(1).strip() for m in WIKILINK_RE.finditer(content or "") if m.group(1).strip()}
+
+# ==================== ADJACENCY CACHE ====================
+
+class _Adjacency:
+    def __init__(self, edges: List[Tuple[str, str]]):
+        self.edges = edges
+        self.neighbours: Dict[str, Set[str]] = {}
+        for source, target in edges:
+            self.neighbours.setdefault(source, set()).add(target)
+            self.neighbours.setdefault(target, set()).add(source)
+        self.loaded_at = time.monotonic()
+
+_cache: "OrderedDict[str, _Adjacency]" = OrderedDict()
+
+def invalidate(user_id: str):
+    _cache.pop(user_id, None)
+
+async def get_adjacency(db: AsyncIOMotorDatabase, user_id: str) -> _Adjacency:
+    adjacency = _cache.get(user_id)
+    if adjacency is not None and time.monotonic() - adjacency.loaded_at < CACHE_TTL_SECONDS:
+        _cache.move_to_end(user_id)
+        return adjacency
+    edges = [
+        (doc["source_id"], doc["target_id"])
+        async for doc in db.backlinks.find(
+            {"user_id": user_id},
+            {"_id": 0, "source_id": 1, "target_id": 1}
+        )
+    ]
+    adjacency = _Adjacency(edges)
+    _cache[user_id] = adjacency
+    _cache.move_to_end(user_id)
+    while len(_cache) > CACHE_MAX_USERS:
+        _cache.popitem(last=False)
+    return adjacency
+
+# ==================== SYNC ====================
+
+async def _affected_sources(db: AsyncIOMotorDatabase, user_id: str, notes: List[Dict[str, Any]]) -> Set[str]:
+    """Notes linking to a pushed note's title, or whose wikilinks pointed at a pushed note"""
+    note_ids = [n["id"] for n in notes]
+    titles = [n["title"] for n in notes if n.get("title")]
+    sources: Set[str] = set()
+    if titles:
+        async for doc in db.note_links.find(
+            {"user_id": user_id, "titles": {"$in": titles}},
+            {"_id": 0, "source_id": 1}
+        ):
+            sources.add(doc["source_id"])
+    async for doc in db.backlinks.find(
+        {"user_id": user_id, "target_id": {"$in": note_ids}, "origins": "wikilink"},
+        {"_id": 0, "source_id": 1}
+    ):
+        sources.add(doc["source_id"])
+    return sources
+
+async def sync_note_links(db: AsyncIOMotorDatabase, user_id: str, notes: List[Dict[str, Any]]):
+    """Store the wikilinks of pushed notes, re-resolve every affected note and apply edge changes"""
+    notes = [n for n in notes if n.get("id")]
+    if not notes:
+        return
+    links_by_source = {n["id"]: extract_links(n.get("content", "")) for n in notes}
+    await db.note_links.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "source_id": source},
+            {"$set": {"titles": sorted(links)}},
+            upsert=True
+        )
+        for source, links in links_by_source.items()
+    ], ordered=False)
+
+    others = await _affected_sources(db, user_id, notes) - links_by_source.keys()
+    if others:
+        async for doc in db.note_links.find(
+            {"user_id": user_id, "source_id": {"$in": list(others)}},
+            {"_id": 0, "source_id": 1, "titles": 1}
+        ):
+            links_by_source[doc["source_id"]] = set(doc.get("titles", []))
+    titles = set().union(*links_by_source.values())
+
+    # Resolve titles to ids (pushed notes are already upserted)
+    title_to_id: Dict[str, str] = {}
+    if titles:
+        async for doc in db.notes.find(
+            {"user_id": user_id, "title": {"$in": list(titles)}},
+            {"_id": 0, "id": 1, "title": 1}
+        ):
+            title_to_id.setdefault(doc["title"], doc["id"])
+
+    new_edges = {
+        (source, title_to_id[title])
+        for source, links in links_by_source.items()
+        for title in links
+        if title in title_to_id and title_to_id[title] != source
+    }
+    old_edges = {
+        (doc["source_id"], doc["target_id"])
+        async for doc in db.backlinks.find(
+            {"user_id": user_id, "source_id": {"$in": list(links_by_source)}, "origins": "wikilink"},
+            {"_id": 0, "source_id": 1, "target_id": 1}
+        )
+    }
+
+    ops: List[Any] = []
+    for source, target in new_edges - old_edges:
+        backlink = BacklinkModel(source_id=source, target_id=target, origin="wikilink")
+        doc = backlink.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        doc['user_id'] = user_id
+        ops.append(UpdateOne(
+            {"user_id": user_id, "source_id": source, "target_id": target},
+            {"$setOnInsert": doc, "$addToSet": {"origins": "wikilink"}},
+            upsert=True
+        ))
+    removed = old_edges - new_edges
+    for source, target in removed:
+        ops.append(UpdateOne(
+            {"user_id": user_id, "source_id": source, "target_id": target},
+            {"$pull": {"origins": "wikilink"}}
+        ))
+
+    if ops:
+        await db.backlinks.bulk_write(ops, ordered=False)
+        if removed:
+            # Edges that were only wikilinks; manual links keep their "manual" origin
+            await db.backlinks.delete_many({
+                "user_id": user_id,
+                "source_id": {"$in": list({source for source, _ in removed})},
+                "origins": {"$size": 0}
+            })
+        invalidate(user_id)
+
+async def clear_note_links(db: AsyncIOMotorDatabase, user_id: str):
+    """Forget a user's whole link graph, when all their notes are cleared"""
+    # Every edge joins two of the user's notes, so manual links go too
+    await db.backlinks.delete_many({"user_id": user_id})
+    await db.note_links.delete_many({"user_id": user_id})
+    invalidate(user_id)
+
+# ==================== GRAPH ====================
+
+async def neighbourhood(db: AsyncIOMotorDatabase, user_id: str, note_id: str, depth: int) -> Dict[str, Any]:
+    """Nodes within `depth` hops of a note (links followed in both directions)"""
+    adjacency = await get_adjacency(db, user_id)
+    depth = max(1, min(depth, MAX_GRAPH_DEPTH))
+    distances = {note_id: 0}
+    queue = deque([note_id])
+    while queue:
+        current = queue.popleft()
+        if distances[current] == depth:
+            continue
+        for neighbour in adjacency.neighbours.get(current, ()):
+            if neighbour not in distances:
+                distances[neighbour] = distances[current] + 1
+                queue.append(neighbour)
+
+    edges = [
+        {"source": s, "target": t}
+        for s, t in adjacency.edges
+        if s in distances and t in distances
+    ]
+    return await _with_titles(db, user_id, distances, edges)
+
+async def full_graph(db: AsyncIOMotorDatabase, user_id: str) -> Dict[str, Any]:
+    adjacency = await get_adjacency(db, user_id)
+    edges = [{"source": s, "target": t} for s, t in adjacency.edges]
+    return await _with_titles(db, user_id, {node: None for node in adjacency.neighbours}, edges)
+
+async def _with_titles(db: AsyncIOMotorDatabase, user_id: str, nodes: Dict[str, Any], edges: List[Dict[str, str]]) -> Dict[str, Any]:
+    titles = {
+        doc["id"]: doc.get("title", "")
+        async for doc in db.notes.find(
+            {"user_id": user_id, "id": {"$in": list(nodes)}},
+            {"_id": 0, "id": 1, "title": 1}
+        )
+    }
+    return {
+        "nodes": [
+            {"id": node, "title": titles.get(node), "distance": distance}
+            for node, distance in nodes.items()
+        ],
+        "edges": edges
+    }
+
+# ==================== INDEXES ====================
+
+async def _drop_duplicate_edges(db: AsyncIOMotorDatabase):
+    """Keep one document per (user_id, source_id, target_id) edge"""
+    duplicates = db.backlinks.aggregate([
+        {"$group": {
+            "_id": {"user_id": "$user_id", "source_id": "$source_id", "target_id": "$target_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    async for group in duplicates:
+        await db.backlinks.delete_many({"_id": {"$in": group["ids"][1:]}})
+
+async def _tag_edge_origins(db: AsyncIOMotorDatabase):
+    """Edges written before `origins` existed carry their single creator in `origin`"""
+    await db.backlinks.update_many(
+        {"origins": {"$exists": False}, "origin": "wikilink"},
+        {"$set": {"origins": ["wikilink"]}}
+    )
+    await db.backlinks.update_many(
+        {"origins": {"$exists": False}},
+        {"$set": {"origins": ["manual"]}}
+    )
+
+async def setup_backlinks(db: AsyncIOMotorDatabase):
+    try:
+        await _tag_edge_origins(db)
+        report = await index_registry.reconcile(db, ["backlinks"])
+        if report["failed"]:
+            # Racy find_one/insert_one creation may have left duplicates behind
+            await _drop_duplicate_edges(db)
+            await index_registry.reconcile(db, ["backlinks"])
+    except Exception as e:
+        logger.error(f"Could not ensure backlinks indexes: {e}")
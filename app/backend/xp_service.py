@@ -0,0 +1,275 @@
+"""
+Central XP award pipeline.
+
+Any module awards XP through `xp_service.award`. Awards for the same user
+that arrive within a short window are coalesced into a single
+find_one_and_update whose pipeline also recomputes `level` and
+`xp_to_next_level`, so derived fields stay consistent under concurrency.
+The same write stages the `xp_awarded`/`level_up` events on the user
+document, so they cannot be lost; they are then published to the outbox
+(whose consumers below update the windowed leaderboards, guild XP and
+achievement counters, and award the XP reward of each unlocked achievement
+once), the in-process rank index is updated, and level-ups are published to
+registered listeners, off the request path.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import asyncio
+import logging
+import os
+import uuid
+
+from rank_index import rank_index
+from leaderboards import record_xp_batch
+from guilds import record_member_xp
+from achievements import achievement_engine, ACHIEVEMENT_CATALOG
+from outbox import (
+    STAGED_FIELD, outbox_relay, publish_staged, staged_events_expr, staged_source, unapplied, forget
+)
+from timeseries import as_utc
+
+logger = logging.getLogger(__name__)
+
+COALESCE_SECONDS = float(os.environ.get("XP_COALESCE_MS", "20")) / 1000
+
+staged_source("users")
+
+# ==================== LEVEL CURVE ====================
+
+def build_level_thresholds(first: int = 100, factor: float = 1.5, cap: int = 10 ** 15) -> List[int]:
+    """Cumulative XP needed to leave each level (same curve as the web client)"""
+    thresholds = [first]
+    while thresholds[-1] < cap:
+        thresholds.append(int(thresholds[-1] * factor))
+    return thresholds
+
+LEVEL_THRESHOLDS = build_level_thresholds()
+
+def level_for_xp(xp: int) -> int:
+    return bisect_right(LEVEL_THRESHOLDS, xp) + 1
+
+def xp_to_next_level(xp: int) -> int:
+    level = level_for_xp(xp)
+    return LEVEL_THRESHOLDS[min(level - 1, len(LEVEL_THRESHOLDS) - 1)]
+
+def _level_expr(xp: Any) -> dict:
+    return {"$add": [1, {"$size": {"$filter": {
+        "input": LEVEL_THRESHOLDS, "as": "t", "cond": {"$lte": ["$$t", xp]}
+    }}}]}
+
+def _award_pipeline(
+    amount: int,
+    user_id: str,
+    sources: List[str],
+    award_id: str,
+    level_up_id: str,
+    now: datetime
+) -> List[dict]:
+    """
+    Update pipeline: add XP, derive level and next threshold from it, and
+    stage the xp_awarded (and level_up, when a level was crossed) events
+    """
+    previous_level = _level_expr({"$subtract": ["$xp", amount]})
+    common = {"id": "$$t", "user_id": {"$literal": user_id}, "created_at": {"$literal": now}}
+    return [
+        {"$set": {"xp": {"$add": [{"$ifNull": ["$xp", 0]}, amount]}}},
+        {"$set": {
+            "level": {"$add": [1, {"$size": {"$filter": {
+                "input": LEVEL_THRESHOLDS, "as": "t", "cond": {"$lte": ["$$t", "$xp"]}
+            }}}]},
+            "xp_to_next_level": {"$ifNull": [
+                {"$arrayElemAt": [{"$filter": {
+                    "input": LEVEL_THRESHOLDS, "as": "t", "cond": {"$gt": ["$$t", "$xp"]}
+                }}, 0]},
+                LEVEL_THRESHOLDS[-1]
+            ]},
+        }},
+        {"$set": {STAGED_FIELD: staged_events_expr([award_id], {
+            **common,
+            "event": {"$literal": "xp_awarded"},
+            "payload": {"amount": {"$literal": amount}, "xp": "$xp", "level": "$level",
+                        "sources": {"$literal": sources}},
+        })}},
+        {"$set": {STAGED_FIELD: staged_events_expr(
+            {"$cond": [{"$gt": ["$level", previous_level]}, [level_up_id], []]},
+            {
+                **common,
+                "event": {"$literal": "level_up"},
+                "payload": {"level": "$level", "previous_level": previous_level, "xp": "$xp"},
+            }
+        )}},
+    ]
+
+# ==================== SERVICE ====================
+
+@dataclass
+class XPAwardResult:
+    user_id: str
+    awarded: int
+    xp: int
+    level: int
+    previous_level: int
+    xp_to_next_level: int
+    sources: List[str] = field(default_factory=list)
+
+    @property
+    def leveled_up(self) -> bool:
+        return self.level > self.previous_level
+
+@dataclass
+class _PendingAward:
+    db: AsyncIOMotorDatabase
+    future: asyncio.Future
+    amount: int = 0
+    sources: List[str] = field(default_factory=list)
+
+LevelUpListener = Callable[[AsyncIOMotorDatabase, XPAwardResult], Awaitable[None]]
+
+class XPService:
+    def __init__(self, coalesce_seconds: float = COALESCE_SECONDS):
+        self.coalesce_seconds = coalesce_seconds
+        self._pending: Dict[str, _PendingAward] = {}
+        self.level_up_listeners: List[LevelUpListener] = []
+
+    async def award(self, db: AsyncIOMotorDatabase, user_id: str, amount: int, source: str = "general") -> Optional[XPAwardResult]:
+        """Queue an XP award; resolves once the coalesced write for this user lands"""
+        if amount <= 0:
+            return None
+        pending = self._pending.get(user_id)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = _PendingAward(db=db, future=loop.create_future())
+            self._pending[user_id] = pending
+            loop.call_later(self.coalesce_seconds, lambda: asyncio.ensure_future(self._flush(user_id)))
+        pending.amount += amount
+        pending.sources.append(source)
+        # Shielded: a cancelled request must not cancel the shared write
+        return await asyncio.shield(pending.future)
+
+    async def _flush(self, user_id: str):
+        pending = self._pending.pop(user_id, None)
+        if pending is None:
+            return
+        award_id, level_up_id = str(uuid.uuid4()), str(uuid.uuid4())
+        event_ids = {award_id, level_up_id}
+        try:
+            doc = await pending.db.users.find_one_and_update(
+                {"id": user_id},
+                _award_pipeline(pending.amount, user_id, pending.sources, award_id, level_up_id, datetime.now(timezone.utc)),
+                projection={"_id": 0, "xp": 1, "level": 1, "xp_to_next_level": 1, STAGED_FIELD: 1},
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            pending.future.set_exception(e)
+            return
+        if doc is None:
+            pending.future.set_result(None)
+            return
+
+        result = XPAwardResult(
+            user_id=user_id,
+            awarded=pending.amount,
+            xp=doc["xp"],
+            level=doc["level"],
+            previous_level=level_for_xp(doc["xp"] - pending.amount),
+            xp_to_next_level=doc["xp_to_next_level"],
+            sources=pending.sources
+        )
+        pending.future.set_result(result)
+        staged = [event for event in doc.get(STAGED_FIELD, []) if event["id"] in event_ids]
+        await self._publish(pending.db, user_id, staged)
+        await self._fan_out(pending.db, result)
+
+    async def _publish(self, db: AsyncIOMotorDatabase, user_id: str, events: List[Dict[str, Any]]):
+        """Hand the staged award events to the outbox consumers (leaderboards, achievements, webhooks)"""
+        try:
+            await publish_staged(db, "users", {"id": user_id}, events)
+        except Exception as e:
+            # Still staged on the user document: the relay publishes them
+            logger.warning(f"XP events for {user_id} left to the outbox relay: {e}")
+
+    async def _fan_out(self, db: AsyncIOMotorDatabase, result: XPAwardResult):
+        rank_index.update(result.user_id, result.xp)
+        if not result.leveled_up:
+            return
+        steps = [listener(db, result) for listener in self.level_up_listeners]
+        for outcome in await asyncio.gather(*steps, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                logger.error(f"XP fan-out failed for {result.user_id}: {outcome}")
+
+
+xp_service = XPService()
+
+# ==================== OUTBOX CONSUMERS ====================
+
+REWARD_XP = {ach["code"]: ach["reward_xp"] for ach in ACHIEVEMENT_CATALOG.items}
+
+def _xp_events(events: List[Dict]) -> List[Dict]:
+    return [e for e in events if e["event"] == "xp_awarded"]
+
+@outbox_relay.consumer("leaderboard")
+async def _leaderboard_consumer(db: AsyncIOMotorDatabase, events: List[Dict]):
+    # Bucket increments are not idempotent: skip events already counted (retries, replays)
+    fresh = await unapplied(db, "leaderboard", _xp_events(events))
+    try:
+        await record_xp_batch(db, [
+            (e["user_id"], e["payload"]["amount"], as_utc(e["created_at"])) for e in fresh
+        ])
+    except Exception:
+        await forget(db, "leaderboard", fresh)
+        raise
+
+async def _apply_once_per_user(
+    db: AsyncIOMotorDatabase,
+    consumer: str,
+    events: List[Dict],
+    apply: Callable[[str, List[Dict]], Awaitable[Any]]
+):
+    """
+    Apply non-idempotent effects once per event, one `apply(user_id, events)`
+    per user; the events of users whose effect failed are forgotten so the
+    retry applies them again
+    """
+    by_user: Dict[str, List[Dict]] = {}
+    for e in await unapplied(db, consumer, events):
+        by_user.setdefault(e["user_id"], []).append(e)
+    users = list(by_user)
+    outcomes = await asyncio.gather(*(apply(user_id, by_user[user_id]) for user_id in users), return_exceptions=True)
+    failures = [(user_id, outcome) for user_id, outcome in zip(users, outcomes) if isinstance(outcome, Exception)]
+    if failures:
+        await forget(db, consumer, [e for user_id, _ in failures for e in by_user[user_id]])
+        raise failures[0][1]
+
+# Guild XP before this consumer existed was added on the award path
+@outbox_relay.consumer("guilds", from_now=True)
+async def _guilds_consumer(db: AsyncIOMotorDatabase, events: List[Dict]):
+    async def contribute(user_id: str, user_events: List[Dict]):
+        await record_member_xp(db, user_id, sum(e["payload"]["amount"] for e in user_events))
+
+    await _apply_once_per_user(db, "guilds", _xp_events(events), contribute)
+
+@outbox_relay.consumer("achievements")
+async def _achievements_consumer(db: AsyncIOMotorDatabase, events: List[Dict]):
+    # Idempotent: counters only move up ($max) and each unlock is claimed once
+    latest: Dict[str, Dict] = {}
+    for e in _xp_events(events):
+        best = latest.setdefault(e["user_id"], {"total_xp": 0, "level": 1})
+        best["total_xp"] = max(best["total_xp"], e["payload"]["xp"])
+        best["level"] = max(best["level"], e["payload"]["level"])
+    for user_id, maxima in latest.items():
+        await achievement_engine.record(db, user_id, maxima=maxima)
+
+# Unlocks before this consumer existed were rewarded directly
+@outbox_relay.consumer("achievement_rewards", from_now=True)
+async def _achievement_rewards_consumer(db: AsyncIOMotorDatabase, events: List[Dict]):
+    async def reward(user_id: str, unlocks: List[Dict]):
+        amount = sum(REWARD_XP.get(e["payload"]["achievement"], 0) for e in unlocks)
+        await xp_service.award(db, user_id, amount, source="achievement")
+
+    # Awards are not idempotent: reward each unlock once (retries, replays)
+    unlocks = [e for e in events if e["event"] == "achievement_unlocked"]
+    await _apply_once_per_user(db, "achievement_rewards", unlocks, reward)
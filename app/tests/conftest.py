@@ -0,0 +1,28 @@
+"""
+Shared fixtures.
+
+Backend modules are imported the way the server imports them (flat, from
+app/backend). `db` is an in-memory Motor database (mongomock-motor), so
+tests run without a MongoDB server; async tests use anyio's pytest plugin.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "initium_test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()["initium_test"]
@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from achievements import AchievementEngine, _hour, counters_from_sync, newly_unlocked
+
+
+# ==================== RULES ====================
+
+@pytest.mark.parametrize("counters,touched,unlocked,expected", [
+    # Below, at and past a threshold
+    ({"quests_completed": 0}, ["quests_completed"], [], []),
+    ({"quests_completed": 1}, ["quests_completed"], [], ["first_quest"]),
+    ({"quests_completed": 60}, ["quests_completed"], [], ["first_quest", "quest_master"]),
+    # Already unlocked codes are not proposed again
+    ({"quests_completed": 60}, ["quests_completed"], ["first_quest"], ["quest_master"]),
+    ({"quests_completed": 60}, ["quests_completed"], ["first_quest", "quest_master"], []),
+    # Only rules on touched counters are checked
+    ({"quests_completed": 1, "streak_days": 30}, ["quests_completed"], [], ["first_quest"]),
+    ({"streak_days": 30}, ["streak_days"], [], ["streak_7", "streak_30"]),
+    # Several counters in one event
+    ({"total_xp": 1000, "level": 10}, ["total_xp", "level"], [], ["xp_1000", "level_10"]),
+    ({"notes_created": 49}, ["notes_created"], [], []),
+    ({}, ["unknown_counter"], [], []),
+])
+def test_newly_unlocked(counters, touched, unlocked, expected):
+    assert newly_unlocked(counters, touched, unlocked) == expected
+
+
+# ==================== SYNC COUNTERS ====================
+
+@pytest.mark.parametrize("collection,documents,previous,inc,maxima", [
+    ("quests", [{"id": "q1", "status": "completed", "progress": 100}], {},
+     {"quests_completed": 1, "perfect_quests": 1}, {}),
+    ("quests", [{"id": "q1", "status": "completed", "progress": 40}], {"q1": {"status": "active"}},
+     {"quests_completed": 1}, {}),
+    # Re-pushing an already completed quest counts nothing
+    ("quests", [{"id": "q1", "status": "completed", "progress": 100}], {"q1": {"status": "completed"}},
+     {}, {}),
+    ("quests", [{"id": "q1", "status": "active"}], {}, {}, {}),
+    ("tasks", [{"id": "t1", "status": "completed", "completedAt": "2024-03-01T07:59:00Z"}], {},
+     {"tasks_before_8am": 1}, {}),
+    ("tasks", [{"id": "t1", "status": "completed", "completed_at": "2024-03-01T22:00:00+00:00"}], {},
+     {"tasks_after_10pm": 1}, {}),
+    ("tasks", [{"id": "t1", "status": "completed", "completedAt": "2024-03-01T12:00:00Z"}], {}, {}, {}),
+    ("tasks", [{"id": "t1", "status": "completed", "completedAt": "not a date"}], {}, {}, {}),
+    ("notes", [{"id": "n1"}, {"id": "n2"}], {"n2": {"id": "n2"}}, {"notes_created": 1}, {}),
+    ("training", [{"id": "s1"}], {}, {"training_sessions": 1}, {}),
+    ("habits", [{"id": "h1", "streak": 3, "bestStreak": 12}, {"id": "h2", "streak": 9}], {},
+     {}, {"streak_days": 12}),
+])
+def test_counters_from_sync(collection, documents, previous, inc, maxima):
+    assert counters_from_sync(collection, documents, previous) == (inc, maxima)
+
+
+def test_completion_hours_are_judged_in_the_users_timezone():
+    # 05:30 UTC is 07:30 in Paris (summer) but 22:30 the day before in Los Angeles
+    task = [{"id": "t1", "status": "completed", "completedAt": "2024-07-01T05:30:00Z"}]
+    assert counters_from_sync("tasks", task, {}, tz="Europe/Paris") == ({"tasks_before_8am": 1}, {})
+    assert counters_from_sync("tasks", task, {}, tz="America/Los_Angeles") == ({"tasks_after_10pm": 1}, {})
+    assert counters_from_sync("tasks", task, {}, tz="UTC") == ({"tasks_before_8am": 1}, {})
+
+
+@pytest.mark.parametrize("value,zone,hour", [
+    ("2024-01-15T23:30:00Z", "UTC", 23),
+    ("2024-01-15T23:30:00Z", "Asia/Tokyo", 8),
+    ("2024-01-15T23:30:00+09:00", "UTC", 14),
+    # Naive timestamps are UTC
+    (datetime(2024, 1, 15, 6, 0), "Europe/Paris", 7),
+    (datetime(2024, 1, 15, 6, 0, tzinfo=timezone.utc), "America/New_York", 1),
+    ("garbage", "UTC", None),
+    (None, "UTC", None),
+    (1700000000, "UTC", None),
+])
+def test_hour(value, zone, hour):
+    assert _hour(value, ZoneInfo(zone)) == hour
+
+
+# ==================== ENGINE ====================
+
+@pytest.mark.anyio
+async def test_repeated_events_do_not_unlock_twice(db):
+    engine = AchievementEngine()
+    assert await engine.record(db, "u1", inc={"quests_completed": 1}) == ["first_quest"]
+    assert await engine.record(db, "u1", inc={"quests_completed": 1}) == []
+    assert await engine.record(db, "u1", maxima={"streak_days": 7}) == ["streak_7"]
+    # A lower maximum neither lowers the counter nor unlocks anything
+    assert await engine.record(db, "u1", maxima={"streak_days": 3}) == []
+
+    counters = await db.user_counters.find_one({"user_id": "u1"})
+    assert counters["counters"] == {"quests_completed": 2, "streak_days": 7}
+    assert sorted(counters["unlocked"]) == ["first_quest", "streak_7"]
+    assert await db.user_achievements.count_documents({"user_id": "u1"}) == 2
+    assert await db.outbox.count_documents({"event": "achievement_unlocked"}) == 2
@@ -0,0 +1,45 @@
+import importlib
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import debug_routes
+from dependencies import get_current_active_user, get_db
+from models import UserInDB
+
+
+def _user(email, verified=True):
+    return UserInDB(email=email, username="u", hashed_password="x", is_verified=verified)
+
+
+async def _get(user, enabled=True, admins=("admin@example.com",), monkeypatch=None):
+    monkeypatch.setattr(debug_routes, "DEBUG_ENDPOINTS", enabled)
+    monkeypatch.setattr(debug_routes, "ADMIN_EMAILS", set(admins))
+    app = FastAPI()
+    app.include_router(debug_routes.router)
+    app.dependency_overrides[get_current_active_user] = lambda: user
+    app.dependency_overrides[get_db] = lambda: None
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.get("/debug/slow-queries")
+
+
+@pytest.mark.anyio
+async def test_debug_endpoints_are_off_by_default(monkeypatch):
+    monkeypatch.delenv("DEBUG_ENDPOINTS", raising=False)
+    monkeypatch.setenv("ENV", "development")
+    assert not importlib.reload(debug_routes).DEBUG_ENDPOINTS
+
+    response = await _get(_user("admin@example.com"), enabled=False, monkeypatch=monkeypatch)
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_debug_endpoints_are_for_verified_admins_only(monkeypatch):
+    assert (await _get(_user("someone@example.com"), monkeypatch=monkeypatch)).status_code == 403
+    assert (await _get(_user("admin@example.com", verified=False), monkeypatch=monkeypatch)).status_code == 403
+
+    response = await _get(_user("Admin@Example.com"), monkeypatch=monkeypatch)
+    assert response.status_code == 200
+    assert "queries" in response.json()
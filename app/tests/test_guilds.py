@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from guilds import add_member, reconcile_member_counts, remove_member
+from indexes import index_registry
+from xp_service import _guilds_consumer
+
+
+async def _guild(db, guild_id="g1", owner="owner", members=()):
+    await index_registry.reconcile(db, ["guild_members", "guilds"])
+    await db.guilds.insert_one({"id": guild_id, "owner_id": owner, "member_count": 0, "total_xp": 0, "level": 1})
+    await add_member(db, guild_id, owner, role="owner")
+    for user_id in members:
+        await add_member(db, guild_id, user_id)
+
+
+async def _count(db, guild_id="g1"):
+    return (await db.guilds.find_one({"id": guild_id}))["member_count"]
+
+
+# ==================== MEMBERSHIP ====================
+
+@pytest.mark.anyio
+async def test_member_count_is_recounted_on_join_and_leave(db):
+    await _guild(db, members=["a"])
+    # Drifted (e.g. a crash between the two writes): repaired by the next change
+    await db.guilds.update_one({"id": "g1"}, {"$set": {"member_count": 7}})
+
+    assert await add_member(db, "g1", "b")
+    assert await _count(db) == 3
+    assert not await add_member(db, "g1", "b")
+    assert await _count(db) == 3
+
+    assert await remove_member(db, "g1", "a")
+    assert not await remove_member(db, "g1", "a")
+    assert await _count(db) == 2
+
+
+@pytest.mark.anyio
+async def test_owner_leaving_hands_the_guild_to_the_longest_standing_member(db):
+    await _guild(db, members=["first", "second"])
+    await db.guild_members.update_one({"user_id": "second"}, {"$set": {"joined_at": "2020-01-01T00:00:00+00:00"}})
+
+    assert await remove_member(db, "g1", "owner")
+    guild = await db.guilds.find_one({"id": "g1"})
+    assert guild["owner_id"] == "second"
+    assert guild["member_count"] == 2
+    roles = {m["user_id"]: m["role"] async for m in db.guild_members.find({"guild_id": "g1"})}
+    assert roles == {"first": "member", "second": "owner"}
+
+
+@pytest.mark.anyio
+async def test_guild_is_deleted_when_its_last_member_leaves(db):
+    await _guild(db)
+    assert await remove_member(db, "g1", "owner")
+    assert await db.guilds.find_one({"id": "g1"}) is None
+
+
+@pytest.mark.anyio
+async def test_reconcile_resets_drifted_member_counts(db):
+    await _guild(db, "g1", members=["a", "b"])
+    await _guild(db, "g2")
+    await db.guilds.insert_one({"id": "empty", "owner_id": "x", "member_count": 4})
+    await db.guilds.update_one({"id": "g1"}, {"$set": {"member_count": 0}})
+
+    assert await reconcile_member_counts(db) == 2
+    assert [await _count(db, g) for g in ("g1", "g2", "empty")] == [3, 1, 0]
+    assert await reconcile_member_counts(db) == 0
+
+
+# ==================== GUILD XP ====================
+
+def _award(event_id, user_id, amount):
+    return {"id": event_id, "user_id": user_id, "event": "xp_awarded", "created_at": datetime.now(timezone.utc),
+            "payload": {"amount": amount, "xp": amount, "level": 1, "sources": ["test"]}}
+
+
+@pytest.mark.anyio
+async def test_guild_xp_is_added_once_per_event(db):
+    await _guild(db, members=["a"])
+    events = [_award("e1", "a", 600), _award("e2", "a", 500), _award("e3", "owner", 50),
+              {**_award("e4", "a", 1), "event": "level_up"}]
+
+    await _guilds_consumer(db, events)
+    # Replayed batch
+    await _guilds_consumer(db, events)
+
+    guild = await db.guilds.find_one({"id": "g1"})
+    assert (guild["total_xp"], guild["level"]) == (1150, 2)
+    member = await db.guild_members.find_one({"user_id": "a"})
+    assert member["xp_contributed"] == 1100
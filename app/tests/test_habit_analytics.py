@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import habit_analytics
+from habit_analytics import _slopes, _streaks, compute_analytics, get_analytics
+
+
+# ==================== SLOPES ====================
+
+def test_slopes_match_a_least_squares_fit_per_column():
+    frame = pd.DataFrame({
+        "rising": [1.0, 3.0, 5.0, 7.0],
+        "flat": [4.0, 4.0, 4.0, 4.0],
+        "noisy": [2.0, 1.0, 4.0, 3.0],
+    })
+    slopes = _slopes(frame)
+    assert slopes["rising"] == pytest.approx(2.0)
+    assert slopes["flat"] == pytest.approx(0.0)
+    assert slopes["noisy"] == pytest.approx(np.polyfit(np.arange(4), frame["noisy"], 1)[0])
+
+
+def test_slopes_skip_missing_days():
+    frame = pd.DataFrame({"gaps": [1.0, np.nan, 5.0, np.nan, 9.0]})
+    # Points at x = 0, 2, 4: still 2 per day
+    assert _slopes(frame)["gaps"] == pytest.approx(2.0)
+
+
+def test_slopes_need_two_points():
+    frame = pd.DataFrame({"one": [np.nan, 3.0, np.nan], "none": [np.nan] * 3})
+    slopes = _slopes(frame)
+    assert np.isnan(slopes["one"]) and np.isnan(slopes["none"])
+
+
+# ==================== STREAKS ====================
+
+@pytest.mark.parametrize("days,current,longest", [
+    ([1, 1, 0, 1, 1, 1, 0], 0, 3),
+    ([0, 1, 1, 0, 1, 1], 2, 2),
+    ([1, 1, 1, 1], 4, 4),
+    ([0, 0, 0], 0, 0),
+    ([1], 1, 1),
+    ([1, 0, 1, 1, 1, 1, 0, 1], 1, 4),
+])
+def test_streaks(days, current, longest):
+    stats = _streaks(pd.DataFrame({"h": [bool(d) for d in days]}))
+    assert stats["h"] == {"current": current, "longest": longest, "active_days": sum(days)}
+
+
+# ==================== SERVICE ====================
+
+@pytest.mark.anyio
+async def test_daily_aggregation_in_mongo_matches_the_raw_entries(db, monkeypatch):
+    monkeypatch.setattr(habit_analytics, "_cache", type(habit_analytics._cache)())
+    now = datetime.now(timezone.utc)
+    today = now.replace(hour=12, minute=0, second=0, microsecond=0)
+    if today > now:
+        today -= timedelta(days=1)
+    moods, metrics = [], []
+    for day in range(10):
+        date = today - timedelta(days=day)
+        moods += [{"user_id": "u1", "date": date, "energy_level": 3 + day % 3},
+                  {"user_id": "u1", "date": date - timedelta(hours=2), "energy_level": 8}]
+        if day % 4 != 1:
+            metrics += [{"user_id": "u1", "date": date - timedelta(hours=h), "habit_id": "run",
+                         "metric_type": "km", "value": 1.5 + h} for h in range(3)]
+    await db.mood_entries.insert_many([dict(m) for m in moods])
+    await db.habit_metrics.insert_many([dict(m) for m in metrics])
+
+    result = await get_analytics(db, "u1", days=14)
+    expected = compute_analytics(moods, metrics, 14, today=now)
+    assert result == expected
+    assert result["habits"][0]["daily"][-1] == pytest.approx(1.5 + 2.5 + 3.5)
+    assert result["mood"]["daily"][-1] == pytest.approx((3 + 8) / 2)
@@ -0,0 +1,148 @@
+import importlib
+import os
+
+import pytest
+
+from indexes import HOT_QUERIES, IndexRegistry, _existing_keys, _stages, explain_hot_queries, index_registry
+
+
+@pytest.fixture
+def registry():
+    registry = IndexRegistry()
+    registry.declare("items", "id", unique=True)
+    registry.declare("items", [("user_id", 1), ("created_at", -1)])
+    return registry
+
+
+@pytest.mark.anyio
+async def test_reconcile_creates_missing_indexes_once(db, registry):
+    report = await registry.reconcile(db)
+    assert sorted(report["created"]) == ["items.id_1", "items.user_id_1_created_at_-1"]
+    info = await db["items"].index_information()
+    assert info["id_1"]["unique"]
+
+    assert await registry.reconcile(db) == {"created": [], "rebuilt": [], "extra": [], "failed": []}
+
+
+@pytest.mark.anyio
+async def test_reconcile_rebuilds_indexes_whose_options_changed(db, registry):
+    await db["items"].create_index("id")  # not unique yet
+    report = await registry.reconcile(db)
+    assert report["rebuilt"] == ["items.id_1"]
+    assert (await db["items"].index_information())["id_1"]["unique"]
+
+
+@pytest.mark.anyio
+async def test_dry_run_changes_nothing(db, registry):
+    await db["items"].create_index("id")
+    report = await registry.reconcile(db, dry_run=True)
+    assert report["rebuilt"] == ["items.id_1"]
+    assert report["created"] == ["items.user_id_1_created_at_-1"]
+    info = await db["items"].index_information()
+    assert set(info) == {"_id_", "id_1"} and not info["id_1"].get("unique")
+
+
+@pytest.mark.anyio
+async def test_undeclared_indexes_are_reported_and_pruned_on_request(db, registry):
+    await db["items"].create_index([("location", "2dsphere")], name="location_2dsphere")
+    await db["items"].create_index("legacy")
+
+    report = await registry.reconcile(db)
+    assert sorted(report["extra"]) == ["items.legacy_1", "items.location_2dsphere"]
+    assert "legacy_1" in await db["items"].index_information()
+
+    await registry.reconcile(db, prune=True)
+    assert set(await db["items"].index_information()) == {"_id_", "id_1", "user_id_1_created_at_-1"}
+
+
+def test_text_and_geo_keys_match_their_declarations():
+    registry = IndexRegistry()
+    text = registry.declare("notes", [("user_id", 1), ("title", "text"), ("content", "text")])
+    geo = registry.declare("places", [("location", "2dsphere")])
+
+    server_text = {
+        "key": [("user_id", 1), ("_fts", "text"), ("_ftsx", 1)],
+        "weights": {"title": 1, "content": 1},
+    }
+    assert _existing_keys(server_text) == text.keys
+    assert _existing_keys({"key": [("location", "2dsphere")]}) == geo.keys
+    assert _existing_keys({"key": [("xp", -1.0)]}) == (("xp", -1),)
+
+
+def test_stages_walk_the_whole_plan_tree():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]},
+    }
+    assert _stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+
+class _Cursor:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def sort(self, sort):
+        return self
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": self.plan}}
+
+
+class _PlannedDb:
+    """Answers explain() with an index scan, except on `collscan` collections"""
+
+    def __init__(self, collscan):
+        self.collscan = collscan
+
+    def __getitem__(self, collection):
+        db = self
+
+        class Collection:
+            def find(self, query):
+                if collection in db.collscan:
+                    return _Cursor({"stage": "COLLSCAN"})
+                # Slot-based engine layout
+                return _Cursor({"queryPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}})
+        return Collection()
+
+
+@pytest.mark.anyio
+async def test_explain_flags_collection_scans():
+    results = await explain_hot_queries(_PlannedDb({"webhooks"}))
+    assert len(results) == len(HOT_QUERIES)
+    assert [description for description, indexed in results if not indexed] == [
+        f"webhooks {query} sort={sort}" for collection, query, sort in HOT_QUERIES if collection == "webhooks"
+    ]
+
+
+@pytest.fixture
+def app_registry():
+    """The shared registry with every module's declarations (importing the app registers them)"""
+    importlib.import_module("server")
+    return index_registry
+
+
+def test_every_hot_query_has_a_declared_index(app_registry):
+    for collection, query, sort in HOT_QUERIES:
+        fields = set(query) | {field for field, _ in sort or []}
+        leading = {keys[0][0] for keys in app_registry.specs.get(collection, {})}
+        assert fields & leading, f"no declared index leads with a field of {collection} {query} sort={sort}"
+
+
+@pytest.mark.anyio
+async def test_hot_queries_use_an_index_on_a_real_server(app_registry):
+    """Runs against MONGO_TEST_URL when one is available (mongomock has no query planner)"""
+    url = os.environ.get("MONGO_TEST_URL")
+    if not url:
+        pytest.skip("MONGO_TEST_URL not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=2000)
+    db = client["initium_explain_test"]
+    try:
+        await app_registry.reconcile(db)
+        results = await explain_hot_queries(db)
+    finally:
+        await client.drop_database("initium_explain_test")
+        client.close()
+    assert [description for description, indexed in results if not indexed] == []
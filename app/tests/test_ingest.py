@@ -0,0 +1,140 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+import ingest
+from ingest import METRIC_ADAPTER, MOOD_ADAPTER, _BadLine, _insert_chunk, ingest_moods, iter_items, validate_item
+
+
+class _Request:
+    def __init__(self, body: bytes, content_type="application/json", chunk_size=7):
+        self.headers = {"content-type": content_type}
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for offset in range(0, len(self.body), self.chunk_size):
+            yield self.body[offset:offset + self.chunk_size]
+
+
+async def _items(request):
+    return [item async for item in iter_items(request)]
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+# ==================== PARSING ====================
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("body", [b'[{"a": 1}, {"a": 2}]', b'{"entries": [{"a": 1}, {"a": 2}]}'])
+async def test_json_array_and_entries_object(body):
+    assert await _items(_Request(body)) == [{"a": 1}, {"a": 2}]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("body", [b"{oops", b'{"a": 1}', b'"text"'])
+async def test_invalid_json_bodies_are_refused(body):
+    with pytest.raises(ValueError):
+        await _items(_Request(body))
+
+
+@pytest.mark.anyio
+async def test_large_json_bodies_are_refused_before_parsing(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_JSON_BODY_BYTES", 64)
+    body = json.dumps([{"value": n} for n in range(20)]).encode()
+    with pytest.raises(ValueError, match="NDJSON"):
+        await _items(_Request(body))
+
+
+@pytest.mark.anyio
+async def test_ndjson_lines_are_parsed_across_chunks():
+    body = b'{"a": 1}\n\n{"a": 2}\nnot json\n{"a": 3}'
+    items = await _items(_Request(body, "application/x-ndjson; charset=utf-8", chunk_size=3))
+    assert items[0] == {"a": 1} and items[1] == {"a": 2} and items[3] == {"a": 3}
+    assert isinstance(items[2], _BadLine)
+
+
+@pytest.mark.anyio
+async def test_overlong_ndjson_line_is_reported_once_and_skipped(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_LINE_BYTES", 16)
+    body = b'{"a": 1}\n{"note": "' + b"x" * 100 + b'"}\n{"a": 2}\n'
+    items = await _items(_Request(body, "application/x-ndjson", chunk_size=5))
+    assert items[0] == {"a": 1} and items[2] == {"a": 2} and len(items) == 3
+    assert "longer than 16 bytes" in items[1].detail
+
+
+# ==================== VALIDATION ====================
+
+def test_validate_item_assigns_id_and_owner():
+    doc = validate_item(MOOD_ADAPTER, "u1", {"id": "forged", "user_id": "other", "mood": "ok", "energy_level": 3})
+    assert doc["user_id"] == "u1"
+    assert doc["id"] != "forged"
+    assert doc["date"] is not None
+
+
+@pytest.mark.parametrize("item,error", [
+    ({"mood": "ok", "energy_level": 9}, ValidationError),
+    ({"mood": "ok"}, ValidationError),
+    ({"mood": "ok", "energy_level": 3, "date": "yesterday"}, ValidationError),
+    ([1, 2], ValueError),
+    ("text", ValueError),
+    (_BadLine("Invalid JSON: x"), ValueError),
+])
+def test_validate_item_rejects(item, error):
+    with pytest.raises(error):
+        validate_item(MOOD_ADAPTER, "u1", item)
+
+
+# ==================== WRITE PATH ====================
+
+def _metric(n, **fields):
+    return validate_item(METRIC_ADAPTER, "u1", {"habit_id": "h1", "metric_type": "km", "value": n, "unit": "km",
+                                                **fields})
+
+
+@pytest.mark.anyio
+async def test_write_errors_are_reported_at_their_request_index(db):
+    await db.habit_metrics.create_index("id", unique=True)
+    existing = _metric(0)
+    await db.habit_metrics.insert_one(dict(existing))
+
+    errors = []
+    chunk = [(5, _metric(1)), (9, {**_metric(2), "id": existing["id"]}), (12, _metric(3))]
+    written = await _insert_chunk(db.habit_metrics, chunk, errors)
+
+    assert [doc["value"] for doc in written] == [1, 3]
+    assert [e["index"] for e in errors] == [9]
+    assert await db.habit_metrics.count_documents({}) == 3
+
+
+@pytest.mark.anyio
+async def test_ingest_reports_bad_items_by_index_and_keeps_the_rest(db, monkeypatch):
+    monkeypatch.setattr(ingest, "CHUNK_SIZE", 2)
+    items = [
+        {"mood": "ok", "energy_level": 3, "date": "2024-01-01T08:00:00Z"},
+        {"mood": "ok", "energy_level": 0},
+        "nope",
+        {"mood": "bien", "energy_level": 5, "date": "2024-01-01T20:00:00Z"},
+        {"mood": "bof", "energy_level": 1, "date": "2024-01-02T08:00:00Z"},
+    ]
+    result = await ingest_moods(db, "u1", _aiter(items))
+
+    assert (result["received"], result["inserted"], result["failed"]) == (5, 3, 2)
+    assert [e["index"] for e in result["errors"]] == [1, 2]
+    assert result["errors"][0]["detail"][0]["loc"] == ["energy_level"]
+    assert await db.mood_entries.count_documents({"user_id": "u1"}) == 3
+    daily = await db.metric_rollups.find({"user_id": "u1", "period": "daily"}).sort("period_start", 1).to_list(None)
+    assert [(row["count"], row["sum"]) for row in daily] == [(2, 8.0), (1, 1.0)]
+
+
+@pytest.mark.anyio
+async def test_ingest_truncates_oversized_batches(db, monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_BATCH_ITEMS", 3)
+    items = [{"mood": "ok", "energy_level": 3} for _ in range(5)]
+    result = await ingest_moods(db, "u1", _aiter(items))
+    assert (result["received"], result["inserted"]) == (3, 3)
+    assert result["errors"] == [{"index": 3, "detail": "Batch truncated at 3 entries"}]
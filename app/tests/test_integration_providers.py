@@ -0,0 +1,77 @@
+import pytest
+
+import integration_providers
+from integration_providers import (
+    IntegrationProvider, MockProvider, ProviderError, UnconfiguredProvider, fake_providers
+)
+
+
+def test_provider_must_implement_the_whole_contract():
+    class Partial(IntegrationProvider):
+        async def connect(self, client):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_providers_import_nothing_unless_fakes_are_enabled():
+    if integration_providers.INTEGRATIONS_FAKE:
+        pytest.skip("INTEGRATIONS_FAKE=1 in this environment")
+    assert set(integration_providers.PROVIDERS) == set(fake_providers())
+    for provider in integration_providers.PROVIDERS.values():
+        assert isinstance(provider, UnconfiguredProvider)
+        assert provider.collection is None
+
+
+@pytest.mark.anyio
+async def test_unconfigured_provider_has_no_credentials_and_no_data():
+    provider = UnconfiguredProvider("notion")
+    assert await provider.connect(None) == {}
+    page = await provider.fetch_changes(None, {"id": "i1"}, "c1", 100)
+    assert page.items == [] and page.cursor == "c1" and not page.has_more
+    with pytest.raises(ProviderError) as error:
+        await provider.refresh(None, {"id": "i1", "refresh_token": "r"})
+    assert not error.value.retryable
+
+
+@pytest.mark.anyio
+async def test_fake_provider_tokens_and_refresh():
+    provider = MockProvider("todoist", "tasks", integration_providers._task)
+    tokens = await provider.connect(None)
+    assert {"access_token", "refresh_token", "expires_at"} <= set(tokens)
+
+    refreshed = await provider.refresh(None, {"id": "i1", **tokens})
+    assert refreshed["access_token"] != tokens["access_token"]
+    with pytest.raises(ProviderError) as error:
+        await provider.refresh(None, {"id": "i1", "refresh_token": None})
+    assert not error.value.retryable
+
+
+@pytest.mark.anyio
+async def test_fake_provider_pages_changes_from_the_cursor():
+    provider = MockProvider("todoist", "tasks", integration_providers._task)
+    integration = {"id": "i1", "access_token": "t"}
+
+    first = await provider.fetch_changes(None, integration, None, 3)
+    assert len(first.items) == 3 and first.has_more
+    rest = await provider.fetch_changes(None, integration, first.cursor, 3)
+    assert len(rest.items) == MockProvider.INITIAL_ITEMS - 3 and not rest.has_more
+
+    # Only items added since the cursor come back on the next fetch
+    new = await provider.fetch_changes(None, integration, rest.cursor, 100)
+    assert [item["seq"] for item in new.items] == list(range(MockProvider.INITIAL_ITEMS, MockProvider.INITIAL_ITEMS + 2))
+
+    with pytest.raises(ProviderError):
+        await provider.fetch_changes(None, {"id": "i2"}, None, 3)
+
+
+@pytest.mark.anyio
+async def test_fake_provider_maps_items_to_stable_ids():
+    for provider in fake_providers().values():
+        if provider.collection is None:
+            continue
+        page = await provider.fetch_changes(None, {"id": "i1", "access_token": "t"}, None, 1)
+        doc = provider.map_item(page.items[0])
+        assert doc == provider.map_item(page.items[0])
+        assert doc["id"] == f"{provider.id}:i1-0" and doc["source"] == provider.id
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import integration_sync
+from integration_providers import MockProvider, ProviderError, _task
+from integration_sync import IntegrationSyncScheduler
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    fake = MockProvider("fake", "tasks", _task)
+    monkeypatch.setattr(integration_sync, "get_provider", lambda provider_id: fake)
+    monkeypatch.setattr(integration_sync, "SYNCING_PROVIDERS", ["fake"])
+    return fake
+
+
+def _naive(value):
+    return value.replace(tzinfo=None) if value.tzinfo else value
+
+
+async def _make_due(db, integration_id="i1"):
+    await db.integrations.update_one({"id": integration_id}, {"$set": {"sync_after": None}})
+
+
+@pytest.mark.anyio
+async def test_cursor_advances_and_only_new_items_are_imported(db, provider):
+    await db.integrations.insert_one({
+        "id": "i1", "user_id": "u1", "provider": "fake", "active": True, "access_token": "t",
+    })
+    scheduler = IntegrationSyncScheduler()
+
+    assert await scheduler.sync_due(db) == 1
+    integration = await db.integrations.find_one({"id": "i1"})
+    assert integration["sync_cursor"] == str(MockProvider.INITIAL_ITEMS)
+    assert integration["imported_count"] == MockProvider.INITIAL_ITEMS
+    assert await db.tasks.count_documents({"user_id": "u1"}) == MockProvider.INITIAL_ITEMS
+    # Not due again until the interval has passed
+    assert await scheduler.sync_due(db) == 0
+
+    await _make_due(db)
+    assert await scheduler.sync_due(db) == 1
+    integration = await db.integrations.find_one({"id": "i1"})
+    new_items = MockProvider.NEW_ITEMS_PER_FETCH
+    assert integration["sync_cursor"] == str(MockProvider.INITIAL_ITEMS + new_items)
+    assert integration["imported_count"] == MockProvider.INITIAL_ITEMS + new_items
+    assert await db.tasks.count_documents({"user_id": "u1"}) == MockProvider.INITIAL_ITEMS + new_items
+
+
+@pytest.mark.anyio
+async def test_backlog_larger_than_one_run_continues_on_next_scan(db, provider, monkeypatch):
+    monkeypatch.setattr(integration_sync, "PAGE_SIZE", 2)
+    monkeypatch.setattr(integration_sync, "MAX_PAGES_PER_RUN", 1)
+    await db.integrations.insert_one({
+        "id": "i1", "user_id": "u1", "provider": "fake", "active": True, "access_token": "t",
+    })
+
+    assert await IntegrationSyncScheduler().sync_due(db) == 1
+    integration = await db.integrations.find_one({"id": "i1"})
+    assert integration["sync_cursor"] == "2"
+    assert _naive(integration["sync_after"]) <= _naive(datetime.now(timezone.utc))
+
+
+@pytest.mark.anyio
+async def test_failure_backs_off_and_keeps_the_cursor(db, provider, monkeypatch):
+    async def broken(client, integration, cursor, page_size):
+        raise ProviderError("rate limited", retryable=True)
+
+    monkeypatch.setattr(provider, "fetch_changes", broken)
+    await db.integrations.insert_one({
+        "id": "i1", "user_id": "u1", "provider": "fake", "active": True, "access_token": "t",
+        "sync_cursor": "3", "sync_failures": 1,
+    })
+
+    assert await IntegrationSyncScheduler().sync_due(db) == 1
+    integration = await db.integrations.find_one({"id": "i1"})
+    assert integration["sync_cursor"] == "3"
+    assert integration["sync_failures"] == 2
+    assert integration["sync_error"] == "rate limited"
+    assert integration["sync_claim"] is None
+    delay = timedelta(seconds=integration_sync.SYNC_INTERVAL_SECONDS * 4)
+    assert _naive(integration["sync_after"]) > _naive(datetime.now(timezone.utc)) + delay - timedelta(minutes=1)
+
+
+@pytest.mark.anyio
+async def test_unconfigured_providers_are_never_synced(db):
+    await db.integrations.insert_one({
+        "id": "i1", "user_id": "u1", "provider": "notion", "active": True,
+    })
+    if integration_sync.SYNCING_PROVIDERS:
+        pytest.skip("INTEGRATIONS_FAKE=1 in this environment")
+    assert await IntegrationSyncScheduler().sync_due(db) == 0
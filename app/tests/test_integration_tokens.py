@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import integration_tokens
+from integration_providers import ProviderError
+from integration_tokens import TokenRefreshScheduler
+
+
+class FakeProvider:
+    """Records refreshes; fails with `error` when set"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.refreshed = []
+
+    async def refresh(self, client, integration):
+        self.refreshed.append(integration["id"])
+        if self.error:
+            raise self.error
+        return {
+            "access_token": f"new-{integration['id']}",
+            "refresh_token": f"rotated-{integration['id']}",
+            "expires_at": datetime.now(timezone.utc) + timedelta(hours=1),
+        }
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    fake = FakeProvider()
+    monkeypatch.setattr(integration_tokens, "get_provider", lambda provider_id: fake)
+    monkeypatch.setattr(integration_tokens, "JITTER_SECONDS", 0)
+    return fake
+
+
+def _integration(integration_id, expires_in, **fields):
+    return {
+        "id": integration_id, "user_id": "u1", "provider": "fake", "active": True,
+        "access_token": "old", "refresh_token": "refresh",
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=expires_in), **fields,
+    }
+
+
+def _naive(value):
+    return value.replace(tzinfo=None) if value.tzinfo else value
+
+
+@pytest.mark.anyio
+async def test_tokens_are_refreshed_before_they_expire(db, provider):
+    ahead = integration_tokens.REFRESH_AHEAD_SECONDS
+    await db.integrations.insert_many([
+        _integration("soon", ahead // 2),
+        _integration("expired", -60),
+        _integration("later", ahead * 10),
+        _integration("inactive", 60, active=False),
+        _integration("no-refresh-token", 60, refresh_token=None),
+    ])
+
+    assert await TokenRefreshScheduler().refresh_due(db) == 2
+    assert sorted(provider.refreshed) == ["expired", "soon"]
+
+    soon = await db.integrations.find_one({"id": "soon"})
+    assert soon["access_token"] == "new-soon"
+    assert soon["refresh_token"] == "rotated-soon"
+    assert _naive(soon["expires_at"]) > _naive(datetime.now(timezone.utc)) + timedelta(minutes=59)
+    assert soon["refresh_claim"] is None and soon["refresh_failures"] == 0
+    assert (await db.integrations.find_one({"id": "later"}))["access_token"] == "old"
+
+
+@pytest.mark.anyio
+async def test_integrations_claimed_by_another_worker_are_skipped(db, provider):
+    claimed_until = datetime.now(timezone.utc) + timedelta(seconds=60)
+    await db.integrations.insert_one(_integration("busy", 60, refresh_claimed_until=claimed_until))
+
+    assert await TokenRefreshScheduler().refresh_due(db) == 0
+    assert provider.refreshed == []
+
+
+@pytest.mark.anyio
+async def test_retryable_failure_backs_off(db, provider):
+    provider.error = ProviderError("rate limited", retryable=True)
+    await db.integrations.insert_one(_integration("flaky", 60))
+    scheduler = TokenRefreshScheduler()
+
+    assert await scheduler.refresh_due(db) == 1
+    doc = await db.integrations.find_one({"id": "flaky"})
+    assert doc["active"] is True
+    assert doc["refresh_failures"] == 1
+    assert _naive(doc["refresh_after"]) > _naive(datetime.now(timezone.utc))
+    # Backing off: not retried on the next scan
+    assert await scheduler.refresh_due(db) == 0
+
+
+@pytest.mark.anyio
+async def test_permanent_failure_deactivates_the_integration(db, provider):
+    provider.error = ProviderError("refresh token revoked", retryable=False)
+    await db.integrations.insert_one(_integration("revoked", 60))
+
+    await TokenRefreshScheduler().refresh_due(db)
+    doc = await db.integrations.find_one({"id": "revoked"})
+    assert doc["active"] is False
+    assert doc["refresh_error"] == "refresh token revoked"
@@ -0,0 +1,37 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import metrics
+from metrics import metrics_endpoint
+
+
+def _app():
+    app = FastAPI()
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"])
+    return app
+
+
+async def _scrape(headers=None):
+    transport = httpx.ASGITransport(app=_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.get("/metrics", headers=headers or {})
+
+
+@pytest.mark.anyio
+async def test_metrics_are_disabled_without_a_token(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+    assert (await _scrape({"Authorization": "Bearer "})).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_metrics_require_the_bearer_token(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+
+    assert (await _scrape()).status_code == 401
+    assert (await _scrape({"Authorization": "Bearer wrong"})).status_code == 401
+    assert (await _scrape({"Authorization": "Basic s3cret"})).status_code == 401
+
+    response = await _scrape({"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert "initium_uptime_seconds" in response.text
@@ -0,0 +1,135 @@
+import pytest
+
+import notes_search
+from notes_search import bm25_scores, index_notes, normalize, search_notes, snippet, term_vector, tokenize
+
+
+# ==================== TOKENIZATION ====================
+
+@pytest.mark.parametrize("text,tokens", [
+    ("Étude été", ["etude", "ete"]),
+    ("ÇA façade NAÏVE", ["ca", "facade", "naive"]),
+    ("Straße, Ærø!", ["straße", "ærø"]),
+    # Single characters are dropped
+    ("a b cd", ["cd"]),
+    ("", []),
+    (None, []),
+])
+def test_tokenize_folds_case_and_accents(text, tokens):
+    assert tokenize(text) == tokens
+
+
+def test_normalize_matches_precomposed_and_decomposed_forms():
+    assert normalize("café") == normalize("café") == "cafe"
+
+
+def test_title_terms_are_boosted():
+    terms = term_vector({"title": "Plan", "content": "plan de travail"})
+    assert terms["plan"] == 1 + notes_search.TITLE_BOOST
+    assert terms["travail"] == 1
+
+
+# ==================== BM25 ====================
+
+def _postings(notes, term):
+    return [{"term": term, "note_id": note_id, "tf": vector[term]}
+            for note_id, vector in notes.items() if term in vector]
+
+
+def _rank(notes, terms):
+    postings = [p for term in terms for p in _postings(notes, term)]
+    lengths = {note_id: sum(vector.values()) for note_id, vector in notes.items()}
+    avg = sum(lengths.values()) / len(lengths)
+    scores = bm25_scores(postings, lengths, len(notes), avg)
+    return [note_id for note_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
+
+
+def test_bm25_ranks_by_term_frequency_and_length():
+    notes = {
+        "many": term_vector({"content": "budget budget budget mars"}),
+        "once": term_vector({"content": "budget mars avril mai"}),
+        "long": term_vector({"content": "budget " + "remplissage " * 40}),
+        "none": term_vector({"content": "vacances"}),
+    }
+    assert _rank(notes, ["budget"]) == ["many", "once", "long"]
+
+
+def test_rarer_terms_weigh_more():
+    notes = {
+        "common": term_vector({"content": "projet projet"}),
+        "rare": term_vector({"content": "projet licorne"}),
+        "other": term_vector({"content": "projet suivi"}),
+    }
+    assert _rank(notes, ["projet", "licorne"])[0] == "rare"
+
+
+def test_title_boost_changes_the_order():
+    without = {
+        "body": term_vector({"title": "Notes", "content": "recette recette"}),
+        "title": term_vector({"title": "Divers", "content": "recette cuisine"}),
+    }
+    with_title = dict(without, title=term_vector({"title": "Recette", "content": "recette cuisine"}))
+    assert _rank(without, ["recette"]) == ["body", "title"]
+    assert _rank(with_title, ["recette"]) == ["title", "body"]
+
+
+def test_explicit_document_frequencies_override_the_postings():
+    postings = [{"term": "x", "note_id": "n1", "tf": 1}]
+    capped = bm25_scores(postings, {"n1": 5}, 100, 5)
+    counted = bm25_scores(postings, {"n1": 5}, 100, 5, df={"x": 90})
+    assert counted["n1"] < capped["n1"]
+
+
+# ==================== SNIPPETS ====================
+
+def test_snippet_escapes_html_and_marks_matches():
+    text = "<b>Réunion</b> & budget: voir réunion"
+    assert snippet(text, {"reunion"}) == (
+        "&lt;b&gt;<mark>Réunion</mark>&lt;/b&gt; &amp; budget: voir <mark>réunion</mark>"
+    )
+
+
+def test_snippet_without_match_is_the_escaped_prefix():
+    assert snippet("<script>alert(1)</script>", {"absent"}, width=10) == "&lt;script&gt;al"
+
+
+def test_snippet_windows_long_text_around_the_first_match():
+    text = "début " * 50 + "cible" + " fin" * 50
+    out = snippet(text, {"cible"}, width=40)
+    assert out.startswith("…") and out.endswith("…")
+    assert "<mark>cible</mark>" in out
+
+
+# ==================== SEARCH ====================
+
+async def _seed(db, notes):
+    await db.notes.insert_many([{**note, "user_id": "u1"} for note in notes])
+    await index_notes(db, "u1", notes)
+
+
+@pytest.mark.anyio
+async def test_search_ranks_and_paginates(db):
+    await _seed(db, [
+        {"id": "n1", "title": "Budget", "content": "budget annuel"},
+        {"id": "n2", "title": "Divers", "content": "un mot sur le budget"},
+        {"id": "n3", "title": "Cuisine", "content": "recette"},
+    ])
+    results, total = await search_notes(db, "u1", "BUDGET")
+    assert total == 2
+    assert [r["id"] for r in results] == ["n1", "n2"]
+    assert results[0]["snippet"] == "<mark>budget</mark> annuel"
+
+    page, total = await search_notes(db, "u1", "budget", page=2, page_size=1)
+    assert [r["id"] for r in page] == ["n2"] and total == 2
+    assert await search_notes(db, "u1", "inconnu") == ([], 0)
+
+
+@pytest.mark.anyio
+async def test_postings_per_term_are_capped_to_the_highest_tf(db, monkeypatch):
+    monkeypatch.setattr(notes_search, "MAX_POSTINGS_PER_TERM", 2)
+    await _seed(db, [
+        {"id": f"n{tf}", "title": "", "content": " ".join(["budget"] * tf)} for tf in range(1, 6)
+    ])
+    results, total = await search_notes(db, "u1", "budget")
+    assert total == 2
+    assert [r["id"] for r in results] == ["n5", "n4"]
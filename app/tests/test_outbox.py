@@ -0,0 +1,224 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+import outbox
+from indexes import index_registry
+from outbox import OutboxRelay, STAGED_FIELD, forget, new_event, publish_staged, stage_events, unapplied
+
+
+async def _insert_events(db, count, user_id="u1", event="xp_awarded", age_seconds=60):
+    created = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    docs = [
+        {"_id": ObjectId.from_datetime(created + timedelta(seconds=i)), "id": f"ev{i}",
+         "user_id": user_id, "event": event, "payload": {"n": i}, "created_at": created}
+        for i in range(count)
+    ]
+    await db.outbox.insert_many(docs)
+    return docs
+
+
+@pytest.mark.anyio
+async def test_unapplied_returns_each_event_once(db):
+    events = [{"id": "a"}, {"id": "b"}]
+    assert await unapplied(db, "leaderboard", events) == events
+    assert await unapplied(db, "leaderboard", events + [{"id": "c"}]) == [{"id": "c"}]
+    # Per consumer
+    assert await unapplied(db, "other", events) == events
+
+
+@pytest.mark.anyio
+async def test_forget_lets_a_failed_application_be_retried(db):
+    events = [{"id": "a"}]
+    await unapplied(db, "leaderboard", events)
+    await forget(db, "leaderboard", events)
+    assert await unapplied(db, "leaderboard", events) == events
+
+
+@pytest.mark.anyio
+async def test_checkpoint_advances_after_success(db):
+    relay = OutboxRelay()
+    seen = []
+
+    @relay.consumer("c")
+    async def consume(db, events):
+        seen.extend(e["id"] for e in events)
+
+    docs = await _insert_events(db, 3)
+    assert await relay.relay_once(db) == 3
+    assert await relay.relay_once(db) == 0
+    checkpoint = await db.outbox_checkpoints.find_one({"_id": "c"})
+    assert checkpoint["last_id"] == docs[-1]["_id"]
+    assert seen == ["ev0", "ev1", "ev2"]
+
+
+@pytest.mark.anyio
+async def test_from_now_consumer_skips_retained_events(db, monkeypatch):
+    monkeypatch.setattr(outbox, "SETTLE_SECONDS", 30)
+    relay = OutboxRelay()
+    seen = []
+
+    @relay.consumer("new", from_now=True)
+    async def consume(db, events):
+        seen.extend(e["id"] for e in events)
+
+    await _insert_events(db, 3, age_seconds=600)
+    await relay.relay_once(db)
+    assert seen == []
+
+    # Inserted after the first run's settled cutoff
+    await db.outbox.insert_one({"_id": ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=10)),
+                                "id": "later", "user_id": "u1", "event": "xp_awarded", "payload": {}})
+    monkeypatch.setattr(outbox, "SETTLE_SECONDS", 0)
+    await relay.relay_once(db)
+    assert seen == ["later"]
+
+
+@pytest.mark.anyio
+async def test_poison_event_is_dead_lettered_after_repeated_failures(db):
+    relay = OutboxRelay()
+    applied = []
+
+    @relay.consumer("c")
+    async def consume(db, events):
+        if any(e["id"] == "ev1" for e in events):
+            raise ValueError("cannot apply ev1")
+        applied.extend(e["id"] for e in events)
+
+    await _insert_events(db, 3)
+    for _ in range(outbox.MAX_CONSUMER_FAILURES - 1):
+        assert await relay.relay_once(db) == 0
+    assert (await db.outbox_checkpoints.find_one({"_id": "c"}))["failures"] == outbox.MAX_CONSUMER_FAILURES - 1
+
+    assert await relay.relay_once(db) == 3
+    assert applied == ["ev0", "ev2"]
+    dead = await db.outbox_dead_letters.find({}).to_list(10)
+    assert [d["event"]["id"] for d in dead] == ["ev1"]
+    assert (await db.outbox_checkpoints.find_one({"_id": "c"}))["failures"] == 0
+
+
+@pytest.mark.anyio
+async def test_relay_stops_when_another_worker_holds_the_lease(db):
+    relay = OutboxRelay()
+    calls = []
+
+    @relay.consumer("c")
+    async def consume(db, events):
+        calls.append(len(events))
+
+    await _insert_events(db, 2)
+    await db.outbox_checkpoints.insert_one({
+        "_id": "relay_lease", "owner": "someone-else",
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=outbox.LEASE_SECONDS)
+    })
+    assert await relay.relay_once(db) == 0
+    assert calls == []
+
+
+@pytest.mark.anyio
+async def test_lease_is_renewed_before_every_batch(db, monkeypatch):
+    relay = OutboxRelay()
+    renewals = []
+    acquire = relay._acquire_lease
+
+    async def counting_acquire(db):
+        renewals.append(1)
+        return await acquire(db)
+
+    monkeypatch.setattr(relay, "_acquire_lease", counting_acquire)
+    for name in ("a", "b"):
+        relay.consumer(name)(lambda db, events: asyncio.sleep(0))
+    await _insert_events(db, 2)
+    await relay.relay_once(db)
+    assert len(renewals) == 2
+
+
+@pytest.mark.anyio
+async def test_leaderboard_consumer_ignores_replayed_events(db):
+    from xp_service import _leaderboard_consumer
+
+    events = await _insert_events(db, 2)
+    for event in events:
+        event["payload"] = {"amount": 10, "xp": 10, "level": 1}
+    await _leaderboard_consumer(db, events)
+    await _leaderboard_consumer(db, events)
+
+    daily = await db.xp_buckets.find_one({"user_id": "u1", "window": "daily"})
+    assert daily["xp"] == 20
+
+
+@pytest.mark.anyio
+async def test_webhook_deliveries_are_stored_once_per_event(db):
+    from indexes import index_registry
+    from webhooks import WebhookDispatcher
+
+    await index_registry.reconcile(db, ["webhook_deliveries"])
+    dispatcher = WebhookDispatcher()
+    dispatcher.db = db
+    dispatcher._queue = asyncio.Queue()
+    await db.webhooks.insert_one({"id": "wh1", "user_id": "u1", "url": "https://hooks.example.com/in",
+                                  "events": ["xp_awarded"], "active": True, "batch": False})
+    events = await _insert_events(db, 2)
+
+    await dispatcher.accept(events)
+    await dispatcher.accept(events)
+
+    assert await db.webhook_deliveries.count_documents({}) == 2
+    assert dispatcher._queue.qsize() == 2
+
+
+@pytest.mark.anyio
+async def test_staged_events_are_published_once_and_pulled(db):
+    await index_registry.reconcile(db, ["outbox"])
+    event = new_event("u1", "pomodoro_completed", {"session_id": "s1"}, event_id="pomodoro_completed:s1")
+    await db.pomodoro_sessions.insert_one({"id": "s1"})
+    await db.pomodoro_sessions.update_one({"id": "s1"}, {"$set": {"completed": True}, **stage_events([event])})
+
+    await publish_staged(db, "pomodoro_sessions", {"id": "s1"}, [event])
+    await publish_staged(db, "pomodoro_sessions", {"id": "s1"}, [event])
+
+    assert [e["id"] for e in await db.outbox.find({}).to_list(10)] == ["pomodoro_completed:s1"]
+    assert (await db.pomodoro_sessions.find_one({"id": "s1"}))[STAGED_FIELD] == []
+
+
+@pytest.mark.anyio
+async def test_relay_publishes_events_stranded_on_documents(db, monkeypatch):
+    await index_registry.reconcile(db, ["outbox"])
+    monkeypatch.setattr(outbox, "STAGED_SOURCES", {"users"})
+    stranded = new_event("u1", "xp_awarded", {"amount": 5})
+    stranded["created_at"] -= timedelta(seconds=outbox.STAGED_GRACE_SECONDS + 1)
+    await db.users.insert_many([{"id": "u1", STAGED_FIELD: [stranded]}, {"id": "u2", STAGED_FIELD: []}])
+
+    relay = OutboxRelay()
+    assert await relay.publish_stranded(db) == 1
+    assert await relay.publish_stranded(db) == 0
+    assert [e["id"] for e in await db.outbox.find({}).to_list(10)] == [stranded["id"]]
+
+
+@pytest.mark.anyio
+async def test_xp_award_events_survive_a_failed_publish(db, monkeypatch):
+    import xp_service
+    from xp_service import XPService
+
+    await index_registry.reconcile(db, ["outbox"])
+    await db.users.insert_one({"id": "u1", "xp": 90, "level": 1})
+
+    async def unavailable(*args):
+        raise ConnectionError("outbox unavailable")
+
+    monkeypatch.setattr(xp_service, "publish_staged", unavailable)
+    result = await XPService(coalesce_seconds=0).award(db, "u1", 20, source="test")
+    await asyncio.sleep(0.01)
+    assert result.leveled_up
+    assert await db.outbox.count_documents({}) == 0
+    staged = (await db.users.find_one({"id": "u1"}))[STAGED_FIELD]
+    assert [e["event"] for e in staged] == ["xp_awarded", "level_up"]
+    assert staged[0]["payload"] == {"amount": 20, "xp": 110, "level": 2, "sources": ["test"]}
+    assert staged[1]["payload"] == {"level": 2, "previous_level": 1, "xp": 110}
+
+    monkeypatch.setattr(outbox, "STAGED_SOURCES", {"users"})
+    monkeypatch.setattr(outbox, "STAGED_GRACE_SECONDS", -1)
+    assert await OutboxRelay().publish_stranded(db) == 2
+    assert sorted(e["event"] for e in await db.outbox.find({}).to_list(10)) == ["level_up", "xp_awarded"]
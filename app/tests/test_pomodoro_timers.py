@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import pomodoro_routes
+import pomodoro_timers
+from dependencies import get_current_active_user, get_db
+from models import UserInDB
+from outbox import STAGED_FIELD
+from pomodoro_timers import PomodoroTimerScheduler, ends_at
+
+
+def _session(session_id, started_at, duration=25, **fields):
+    return {"id": session_id, "user_id": "u1", "started_at": started_at, "duration": duration,
+            "ends_at": ends_at(started_at, duration), "completed": False, **fields}
+
+
+# ==================== RECOVERY ====================
+
+@pytest.mark.anyio
+async def test_open_sessions_are_recovered_at_startup(db):
+    started = datetime(2024, 1, 1, 9, 0, tzinfo=timezone.utc)
+    legacy = _session("legacy", started, duration=50)
+    del legacy["ends_at"]
+    await db.pomodoro_sessions.insert_many([
+        _session("open", started),
+        legacy,
+        _session("done", started, completed=True),
+        _session("gone", started, expired=True),
+        {**_session("broken", started), "ends_at": None, "duration": 10 ** 12},
+    ])
+    scheduler = PomodoroTimerScheduler()
+    assert await scheduler._recover(db) == 2
+    assert sorted(scheduler._heap) == [
+        (started + timedelta(minutes=25), "open"),
+        (started + timedelta(minutes=50), "legacy"),
+    ]
+
+
+def test_sessions_are_due_after_the_grace_period(monkeypatch):
+    monkeypatch.setattr(pomodoro_timers, "GRACE_SECONDS", 30)
+    monkeypatch.setattr(pomodoro_timers, "BATCH_WINDOW_SECONDS", 0)
+    now = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    scheduler = PomodoroTimerScheduler()
+    scheduler.schedule("late", now - timedelta(seconds=31))
+    scheduler.schedule("grace", now - timedelta(seconds=10))
+    scheduler.schedule("running", now + timedelta(minutes=5))
+
+    assert scheduler._pop_due(now) == ["late"]
+    assert scheduler._pop_due(now + timedelta(seconds=20)) == ["grace"]
+    assert [session_id for _, session_id in scheduler._heap] == ["running"]
+
+
+# ==================== EXPIRY ====================
+
+@pytest.mark.anyio
+async def test_expiry_marks_open_sessions_once_and_reports_them(db):
+    started = datetime.now(timezone.utc) - timedelta(hours=1)
+    await db.pomodoro_sessions.insert_many([
+        _session("s1", started),
+        _session("s2", started, completed=True),
+    ])
+    scheduler = PomodoroTimerScheduler()
+    await scheduler._expire(db, ["s1", "s2"])
+    # A second worker holding the same timers
+    await PomodoroTimerScheduler()._expire(db, ["s1", "s2"])
+
+    s1 = await db.pomodoro_sessions.find_one({"id": "s1"})
+    assert s1["expired"] is True
+    assert s1[STAGED_FIELD] == []
+    assert "expired" not in await db.pomodoro_sessions.find_one({"id": "s2"})
+    events = await db.outbox.find({}, {"_id": 0}).to_list(10)
+    assert [(e["id"], e["event"], e["payload"]) for e in events] == [
+        ("pomodoro_expired:s1", "pomodoro_expired", {"session_id": "s1"})
+    ]
+
+
+# ==================== ROUTES ====================
+
+async def _start(db, monkeypatch, **params):
+    scheduler = PomodoroTimerScheduler()
+    monkeypatch.setattr(pomodoro_routes, "pomodoro_timers", scheduler)
+    app = FastAPI()
+    app.include_router(pomodoro_routes.router)
+    app.dependency_overrides[get_current_active_user] = lambda: UserInDB(
+        id="u1", email="u@example.com", username="u", hashed_password="x"
+    )
+    app.dependency_overrides[get_db] = lambda: db
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/pomodoro/start", params=params), scheduler
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("duration", [0, -5, 241, 10 ** 12])
+async def test_out_of_range_durations_are_rejected(db, monkeypatch, duration):
+    response, scheduler = await _start(db, monkeypatch, duration=duration)
+    assert response.status_code == 422
+    assert scheduler._heap == []
+    assert await db.pomodoro_sessions.count_documents({}) == 0
+
+
+@pytest.mark.anyio
+async def test_started_session_is_scheduled_at_its_deadline(db, monkeypatch):
+    response, scheduler = await _start(db, monkeypatch, duration=240)
+    assert response.status_code == 200
+    session = await db.pomodoro_sessions.find_one({"id": response.json()["session_id"]})
+    assert [session_id for _, session_id in scheduler._heap] == [session["id"]]
+    # Stored dates are truncated to the millisecond
+    assert abs(scheduler._heap[0][0] - ends_at(session["started_at"], 240)) < timedelta(milliseconds=1)
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+import query_profiler
+from query_profiler import QueryProfiler, explain_command
+
+
+def _run(profiler, request_id, command_name, command, elapsed_ms):
+    event = SimpleNamespace(
+        command_name=command_name, command=command, connection_id=("localhost", 27017),
+        request_id=request_id, duration_micros=int(elapsed_ms * 1000),
+    )
+    profiler.started(event)
+    profiler.succeeded(event)
+
+
+def test_slow_commands_are_kept_as_shapes_only():
+    profiler = QueryProfiler(threshold_ms=50)
+    _run(profiler, 1, "find", {"find": "users", "filter": {"email": "alice@example.com"}, "sort": {"xp": -1}}, 80)
+    _run(profiler, 2, "find", {"find": "users", "filter": {"email": "bob@example.com"}, "sort": {"xp": -1}}, 120)
+    _run(profiler, 3, "find", {"find": "users", "filter": {"email": "carol@example.com"}}, 10)
+
+    (stats,) = profiler.top()
+    assert (stats.collection, stats.command, stats.count) == ("users", "find", 2)
+    assert stats.shape == '{"filter":{"email":"?"},"sort":["xp:-1"]}'
+    assert stats.routes == {"background": 2}
+    assert profiler._started == {}
+    assert "example.com" not in repr(vars(profiler))
+
+
+def test_explain_command_rebuilds_filter_and_sort_with_placeholders():
+    shape = {"filter": {"user_id": "?", "tags": {"$in": "?"}, "$or": [{"a": "?"}, {"b": {"$exists": "?"}}]},
+             "sort": ["created_at:-1"]}
+    assert explain_command("notes", "find", shape) == {
+        "find": "notes",
+        "filter": {"user_id": None, "tags": {"$in": [None]}, "$or": [{"a": None}, {"b": {"$exists": True}}]},
+        "sort": {"created_at": -1},
+    }
+
+    pipeline = {"pipeline": [{"$match": {"user_id": "?"}}, {"$sort": ["xp:-1"]}, "$group"]}
+    assert explain_command("users", "aggregate", pipeline) == {
+        "find": "users", "filter": {"user_id": None}, "sort": {"xp": -1},
+    }
+    assert explain_command("users", "update", {"q": {"id": "?"}, "statements": "one"}) == {
+        "find": "users", "filter": {"id": None},
+    }
+
+
+@pytest.mark.anyio
+async def test_report_explains_the_worst_shapes(monkeypatch):
+    explained = []
+
+    async def explain_plan(db, collection, command_name, shape):
+        explained.append((collection, command_name, shape))
+        return {"stage": "IXSCAN"}
+
+    monkeypatch.setattr(query_profiler, "explain_plan", explain_plan)
+    profiler = QueryProfiler(threshold_ms=0)
+    _run(profiler, 1, "find", {"find": "users", "filter": {"id": "u1"}}, 200)
+    _run(profiler, 2, "insert", {"insert": "users", "documents": [{"id": "u2"}]}, 100)
+    _run(profiler, 3, "find", {"find": "notes", "filter": {"user_id": "u1"}}, 50)
+
+    report = await profiler.report(db=None, explain=2)
+    assert [row.get("plan") for row in report["queries"]] == [{"stage": "IXSCAN"}, None, None]
+    assert explained == [("users", "find", {"filter": {"id": "?"}, "sort": []})]
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+from rank_index import FenwickTree, XPRankIndex
+
+
+def _brute_count_above(values, xp):
+    return sum(1 for v in sorted(values) if v > xp)
+
+
+def _assert_matches(index, users):
+    values = list(users.values())
+    probes = set(values) | {v + 1 for v in values} | {v - 1 for v in values} | {0, -5, 10 ** 9}
+    for xp in probes:
+        assert index.count_above(xp) == _brute_count_above(values, xp), xp
+        assert index.rank(xp) == _brute_count_above(values, xp) + 1
+    assert index.total == len(values)
+
+
+# ==================== FENWICK TREE ====================
+
+def test_fenwick_prefix_sums_match_brute_force():
+    rng = random.Random(7)
+    counts = [0] * 37
+    tree = FenwickTree(len(counts))
+    for _ in range(500):
+        index, delta = rng.randrange(len(counts)), rng.choice([1, 1, 2, -1])
+        counts[index] += delta
+        tree.add(index, delta)
+    for index in range(len(counts)):
+        assert tree.prefix_sum(index) == sum(counts[:index + 1])
+    # Past the end: everything
+    assert tree.prefix_sum(1000) == sum(counts)
+
+
+# ==================== RANK INDEX ====================
+
+def test_ties_share_a_rank():
+    index = XPRankIndex(bucket_width=50)
+    users = {"a": 120, "b": 120, "c": 120, "d": 300, "e": 0}
+    for user_id, xp in users.items():
+        index.update(user_id, xp)
+    assert index.rank(300) == 1
+    assert index.rank(120) == 2
+    assert index.rank(0) == 5
+    _assert_matches(index, users)
+
+
+def test_xp_moving_between_buckets():
+    index = XPRankIndex(bucket_width=50)
+    users = {"a": 10, "b": 49, "c": 60}
+    for user_id, xp in users.items():
+        index.update(user_id, xp)
+    _assert_matches(index, users)
+
+    # Same bucket, then across a bucket boundary, then far past the initial capacity
+    for xp in (40, 50, 149, 10 ** 7):
+        users["a"] = xp
+        index.update("a", xp)
+        _assert_matches(index, users)
+
+    index.remove("c")
+    del users["c"]
+    _assert_matches(index, users)
+    assert 1 not in index.buckets  # emptied buckets are dropped
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_updates_match_a_sorted_scan(seed):
+    rng = random.Random(seed)
+    index = XPRankIndex(bucket_width=rng.choice([1, 7, 50]), capacity=4)
+    users = {}
+    for _ in range(400):
+        user_id = f"u{rng.randrange(60)}"
+        if users and rng.random() < 0.1:
+            index.remove(user_id)
+            users.pop(user_id, None)
+            continue
+        # Few distinct values, so plenty of ties
+        xp = rng.choice([0, 5, 50, 51, 99, 100, 1000]) if rng.random() < 0.5 else rng.randrange(5000)
+        index.update(user_id, xp)
+        users[user_id] = xp
+    _assert_matches(index, users)
+
+
+def test_percentile_is_the_share_ranked_at_or_above():
+    index = XPRankIndex()
+    assert index.percentile(0) == 100.0
+    for n in range(4):
+        index.update(f"u{n}", n * 100)
+    assert index.percentile(300) == 25.0
+    assert index.percentile(0) == 100.0
+
+
+@pytest.mark.anyio
+async def test_load_rebuilds_from_the_users_collection(db):
+    await db.users.insert_many([{"id": "a", "xp": 500}, {"id": "b", "xp": 20}, {"id": "c"}])
+    index = XPRankIndex()
+    index.update("stale", 10 ** 6)
+    await index.load(db)
+
+    assert index.ready
+    assert index.user_xp == {"a": 500, "b": 20, "c": 0}
+    assert index.rank(500) == 1 and index.rank(0) == 3
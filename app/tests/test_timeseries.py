@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import timeseries
+from migrations import run_once
+from timeseries import ROLLUP_MIGRATION, RollupGate, get_rollups, rebuild_rollups, rollup_ops
+
+
+def _mood(user_id, day, energy):
+    return {"user_id": user_id, "date": datetime(2024, 1, day, 12, tzinfo=timezone.utc), "energy_level": energy}
+
+
+def test_rollup_ops_pre_aggregate_per_bucket():
+    points = [("mood", datetime(2024, 1, 1, h, tzinfo=timezone.utc), v) for h, v in ((8, 2.0), (20, 4.0))]
+    daily = [op._doc for op in rollup_ops("u1", points) if op._filter["period"] == "daily"]
+    assert daily == [{"$inc": {"count": 2, "sum": 6.0}, "$min": {"min": 2.0}, "$max": {"max": 4.0}}]
+
+
+@pytest.mark.anyio
+async def test_rebuild_counts_every_entry_once(db):
+    await db.mood_entries.insert_many([_mood("u1", 1, 3), _mood("u1", 1, 5), _mood("u2", 2, 4)])
+    await db.metric_rollups.insert_one({"user_id": "u1", "series": "mood", "period": "daily",
+                                        "period_start": datetime(2024, 1, 1), "count": 99, "sum": 0})
+
+    await rebuild_rollups(db, grace_seconds=0)
+    await rebuild_rollups(db, grace_seconds=0)
+
+    (row,) = await get_rollups(db, "u1", "mood", "daily")
+    assert (row["count"], row["sum"], row["mean"]) == (2, 8.0, 4.0)
+
+
+@pytest.mark.anyio
+async def test_live_writes_wait_for_the_rebuild(db, monkeypatch):
+    monkeypatch.setattr(timeseries, "GATE_CHECK_SECONDS", 0.01)
+    gate = RollupGate()
+    rebuilding = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def migrate(db):
+        rebuilding.set()
+        await finish.wait()
+
+    migration = asyncio.create_task(run_once(db, ROLLUP_MIGRATION, migrate))
+    await rebuilding.wait()
+    writer = asyncio.create_task(gate.wait(db))
+    await asyncio.sleep(0.05)
+    assert not writer.done()
+
+    finish.set()
+    assert await migration
+    await asyncio.wait_for(writer, 1)
+    assert gate.settled
+
+
+@pytest.mark.anyio
+async def test_gate_is_open_when_no_rebuild_holds_the_lease(db):
+    await db.migrations.insert_one({"_id": ROLLUP_MIGRATION,
+                                    "claimed_until": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    gate = RollupGate()
+    await asyncio.wait_for(gate.wait(db), 1)
+    assert not gate.settled and not gate.rebuilding
@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import webhooks
+from webhooks import (
+    WebhookDispatcher, WebhookRoutes, _Delivery, backoff, check_webhook_url, delivery_key, sign,
+    SIGNATURE_HEADER, TIMESTAMP_HEADER,
+)
+
+
+DNS = {"hooks.example.com": ["93.184.216.34"], "localhost": ["127.0.0.1"]}
+
+
+@pytest.fixture(autouse=True)
+def dns(monkeypatch):
+    """Resolve from DNS (IP literals resolve to themselves) instead of the network"""
+    records = dict(DNS)
+
+    async def lookup(host, port):
+        return records.get(host, [host.strip("[]")])
+
+    monkeypatch.setattr(webhooks, "_lookup", lookup)
+    return records
+
+
+# ==================== SIGNATURE ====================
+
+def test_sign_is_hmac_sha256_of_timestamp_and_body():
+    body = b'{"event":"level_up"}'
+    expected = hmac.new(b"secret", b"1700000000." + body, hashlib.sha256).hexdigest()
+    assert sign("secret", "1700000000", body) == "sha256=" + expected
+
+
+def test_signature_changes_with_body_timestamp_and_secret():
+    reference = sign("secret", "1700000000", b"{}")
+    assert sign("secret", "1700000000", b"{ }") != reference
+    assert sign("secret", "1700000001", b"{}") != reference
+    assert sign("other", "1700000000", b"{}") != reference
+
+
+# ==================== BACKOFF ====================
+
+@pytest.mark.parametrize("attempt", range(12))
+def test_backoff_stays_within_the_exponential_cap(attempt):
+    cap = min(webhooks.BACKOFF_MAX_SECONDS, webhooks.BACKOFF_BASE_SECONDS * 2 ** attempt)
+    for _ in range(50):
+        assert 0 <= backoff(attempt) <= cap
+
+
+def test_backoff_uses_full_jitter(monkeypatch):
+    bounds = []
+    monkeypatch.setattr(webhooks.random, "uniform", lambda low, high: bounds.append((low, high)) or high)
+    assert [backoff(n) for n in range(4)] == [1.0, 2.0, 4.0, 8.0]
+    assert backoff(20) == webhooks.BACKOFF_MAX_SECONDS
+    assert all(low == 0 for low, _ in bounds)
+
+
+# ==================== URL CHECK ====================
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("url", [
+    "http://93.184.216.34/hook",
+    "https:///hook",
+    "https://127.0.0.1/hook",
+    "https://localhost/hook",
+    "https://10.0.0.5/hook",
+    "https://192.168.1.10/hook",
+    "https://169.254.169.254/latest/meta-data",
+    "https://[::1]/hook",
+    "https://[::ffff:127.0.0.1]/hook",
+])
+async def test_check_webhook_url_rejects_non_https_and_non_public_hosts(url):
+    with pytest.raises(ValueError):
+        await check_webhook_url(url)
+
+
+@pytest.mark.anyio
+async def test_check_webhook_url_accepts_public_https_host():
+    await check_webhook_url("https://93.184.216.34:8443/hook")
+
+
+# ==================== DELIVERY ====================
+
+def _dispatcher(db, handler):
+    dispatcher = WebhookDispatcher()
+    dispatcher.db = db
+    dispatcher.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return dispatcher
+
+
+def _delivery(**kwargs):
+    webhook = {"id": "wh1", "url": "https://hooks.example.com/in", "secret": "s3cret", "batch": False}
+    event = {"id": "ev1", "event": "level_up", "occurred_at": "2024-01-01T00:00:00+00:00", "data": {"level": 2}}
+    return _Delivery(webhook, [event], **kwargs)
+
+
+@pytest.mark.anyio
+async def test_delivery_is_signed_with_the_webhook_secret(db):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(204)
+
+    dispatcher = _dispatcher(db, handler)
+    await dispatcher._deliver(_delivery())
+
+    request = seen[0]
+    # Sent to the address validated at delivery time, for the registered host
+    assert request.url.host == "93.184.216.34"
+    assert request.headers["Host"] == "hooks.example.com"
+    assert request.extensions["sni_hostname"] == "hooks.example.com"
+    expected = sign("s3cret", request.headers[TIMESTAMP_HEADER], request.content)
+    assert request.headers[SIGNATURE_HEADER] == expected
+    assert json.loads(request.content)["id"] == "ev1"
+    assert dispatcher.stats["delivered"] == 1
+    assert dispatcher._endpoint_limits == {}
+
+
+@pytest.mark.anyio
+async def test_retryable_failure_is_stored_with_its_next_attempt(db):
+    dispatcher = _dispatcher(db, lambda request: httpx.Response(503))
+    before = datetime.now(timezone.utc).replace(tzinfo=None)
+    await dispatcher._deliver(_delivery())
+
+    doc = await db.webhook_deliveries.find_one({"key": delivery_key("ev1", "wh1")})
+    assert doc["status"] == "pending"
+    assert doc["attempt"] == 1
+    assert doc["last_error"] == "HTTP 503"
+    next_attempt = doc["next_attempt_at"].replace(tzinfo=None)
+    # attempt 1 waits up to BACKOFF_BASE_SECONDS * 2
+    assert before <= next_attempt <= before + timedelta(seconds=webhooks.BACKOFF_BASE_SECONDS * 2 + 1)
+    assert dispatcher._endpoint_limits == {}
+
+
+@pytest.mark.anyio
+async def test_client_error_is_not_retried(db):
+    dispatcher = _dispatcher(db, lambda request: httpx.Response(404))
+    await dispatcher._deliver(_delivery())
+
+    doc = await db.webhook_deliveries.find_one({"key": delivery_key("ev1", "wh1")})
+    assert doc["status"] == "failed"
+    assert dispatcher.stats["failed"] == 1
+
+
+@pytest.mark.anyio
+async def test_last_attempt_marks_the_delivery_failed(db):
+    dispatcher = _dispatcher(db, lambda request: httpx.Response(500))
+    await dispatcher._deliver(_delivery(attempt=webhooks.MAX_ATTEMPTS - 1))
+
+    doc = await db.webhook_deliveries.find_one({"key": delivery_key("ev1", "wh1")})
+    assert doc["status"] == "failed"
+    assert doc["finished_at"] is not None
+
+
+@pytest.mark.anyio
+async def test_due_retries_are_claimed_requeued_and_settled(db):
+    responses = iter([httpx.Response(500), httpx.Response(200)])
+    dispatcher = _dispatcher(db, lambda request: next(responses))
+    dispatcher._queue = asyncio.Queue()
+    await db.webhooks.insert_one({"id": "wh1", "user_id": "u1", "url": "https://hooks.example.com/in",
+                                  "secret": "s3cret", "events": ["level_up"], "active": True})
+    await dispatcher._deliver(_delivery())
+
+    # Not due yet
+    await db.webhook_deliveries.update_one({}, {"$set": {"next_attempt_at": datetime.now(timezone.utc) + timedelta(hours=1)}})
+    assert await dispatcher.requeue_due() == 0
+
+    await db.webhook_deliveries.update_one({}, {"$set": {"next_attempt_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    assert await dispatcher.requeue_due() == 1
+    # Claimed: a second poller (another worker) gets nothing
+    assert await dispatcher.requeue_due() == 0
+
+    retry = dispatcher._queue.get_nowait()
+    assert retry.stored and retry.attempt == 1
+    await dispatcher._deliver(retry)
+    doc = await db.webhook_deliveries.find_one({"key": delivery_key("ev1", "wh1")})
+    assert doc["status"] == "delivered"
+
+
+@pytest.mark.anyio
+async def test_retries_of_a_removed_webhook_are_dropped(db):
+    dispatcher = _dispatcher(db, lambda request: httpx.Response(500))
+    dispatcher._queue = asyncio.Queue()
+    await dispatcher._deliver(_delivery())
+    await db.webhook_deliveries.update_one({}, {"$set": {"next_attempt_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+    await dispatcher.requeue_due()
+    assert dispatcher._queue.empty()
+    doc = await db.webhook_deliveries.find_one({"key": delivery_key("ev1", "wh1")})
+    assert doc["status"] == "failed"
+    assert doc["last_error"] == "webhook removed"
+
+
+@pytest.mark.anyio
+async def test_host_rebound_to_a_private_address_is_never_contacted(db, dns):
+    seen = []
+    dispatcher = _dispatcher(db, lambda request: seen.append(request) or httpx.Response(204))
+    dns["hooks.example.com"] = ["10.0.0.7"]
+    await dispatcher._deliver(_delivery())
+
+    assert seen == []
+    doc = await db.webhook_deliveries.find_one({"key": delivery_key("ev1", "wh1")})
+    assert doc["status"] == "failed"
+    assert doc["last_error"] == "Webhook URL must point to a public host"
+
+
+@pytest.mark.anyio
+async def test_unresolvable_host_is_retried(db, dns, monkeypatch):
+    async def lookup(host, port):
+        raise webhooks.socket.gaierror("temporary failure")
+
+    monkeypatch.setattr(webhooks, "_lookup", lookup)
+    dispatcher = _dispatcher(db, lambda request: httpx.Response(204))
+    await dispatcher._deliver(_delivery())
+
+    doc = await db.webhook_deliveries.find_one({"key": delivery_key("ev1", "wh1")})
+    assert doc["status"] == "pending"
+
+
+# ==================== ROUTES ====================
+
+def _webhook(webhook_id, events=("level_up",), **fields):
+    return {"id": webhook_id, "user_id": "u1", "url": "https://hooks.example.com/in", "secret": "s",
+            "events": list(events), "active": True, "batch": False, **fields}
+
+
+async def _poll_once(routes, db, monkeypatch):
+    monkeypatch.setattr(webhooks, "ROUTES_POLL_SECONDS", 0)
+    task = asyncio.create_task(routes._poll(db))
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+
+
+@pytest.mark.anyio
+async def test_stale_worker_picks_up_a_new_subscription_after_the_version_bump(db, monkeypatch):
+    local, stale = WebhookRoutes(), WebhookRoutes()
+    await local.load(db)
+    await stale.load(db)
+
+    await db.webhooks.insert_one(_webhook("wh1", events=["level_up", "xp_awarded"]))
+    await local.added(db, _webhook("wh1", events=["level_up", "xp_awarded"]))
+    assert [w["id"] for w in local.get("u1", "xp_awarded")] == ["wh1"]
+    assert stale.get("u1", "level_up") == []
+
+    await _poll_once(stale, db, monkeypatch)
+    assert [w["id"] for w in stale.get("u1", "level_up")] == ["wh1"]
+    assert stale.version == local.version == 1
+
+    await db.webhooks.delete_one({"id": "wh1"})
+    await local.removed(db, "wh1")
+    await _poll_once(stale, db, monkeypatch)
+    assert stale.get("u1", "level_up") == [] and local.get("u1", "xp_awarded") == []
+
+
+@pytest.mark.anyio
+async def test_own_change_skips_the_reload_unless_another_worker_changed_too(db):
+    first, second = WebhookRoutes(), WebhookRoutes()
+    await first.load(db)
+    await second.load(db)
+
+    await first.added(db, _webhook("wh1"))
+    assert first.version == 1  # up to date: nothing to reload
+
+    await second.added(db, _webhook("wh2"))
+    await first.added(db, _webhook("wh3"))
+    # Version 3 includes wh2, which this worker has not loaded: keep the stale version so the poll reloads
+    assert first.version == 1
+    assert await first._current_version(db) == 3
+
+
+@pytest.mark.anyio
+async def test_inactive_webhooks_are_not_routed(db):
+    routes = WebhookRoutes()
+    await db.webhooks.insert_many([_webhook("on"), _webhook("off", active=False)])
+    await routes.load(db)
+    assert [w["id"] for w in routes.get("u1", "level_up")] == ["on"]
+
+    await routes.added(db, _webhook("paused", active=False))
+    assert [w["id"] for w in routes.get("u1", "level_up")] == ["on"]
+
+
+@pytest.mark.anyio
+async def test_subscribers_query_mongo_until_routes_are_loaded(db):
+    dispatcher = WebhookDispatcher()
+    dispatcher.db = db
+    await db.webhooks.insert_many([_webhook("wh1"), _webhook("other", user_id="u2"), _webhook("off", active=False)])
+
+    assert not dispatcher.routes.loaded
+    assert [w["id"] for w in await dispatcher.subscribers("u1", "level_up")] == ["wh1"]
+
+    await dispatcher.routes.load(db)
+    await db.webhooks.insert_one(_webhook("unannounced"))
+    # Served from memory once loaded
+    assert [w["id"] for w in await dispatcher.subscribers("u1", "level_up")] == ["wh1"]
@@ -0,0 +1,45 @@
+import pytest
+
+import wikilinks
+from wikilinks import clear_note_links, full_graph, sync_note_links
+
+
+async def _push(db, notes):
+    await db.notes.insert_many([{**note, "user_id": "u1"} for note in notes])
+    await sync_note_links(db, "u1", notes)
+
+
+@pytest.mark.anyio
+async def test_wikilinks_become_edges(db):
+    await _push(db, [
+        {"id": "a", "title": "A", "content": "see [[B]] and [[Missing]]"},
+        {"id": "b", "title": "B", "content": ""},
+    ])
+    edges = await db.backlinks.find({"user_id": "u1"}, {"_id": 0, "source_id": 1, "target_id": 1}).to_list(10)
+    assert edges == [{"source_id": "a", "target_id": "b"}]
+
+
+@pytest.mark.anyio
+async def test_unresolved_link_resolves_when_the_target_is_created(db):
+    await _push(db, [{"id": "a", "title": "A", "content": "[[B]]"}])
+    assert await db.backlinks.count_documents({}) == 0
+    await _push(db, [{"id": "b", "title": "B", "content": ""}])
+    assert await db.backlinks.count_documents({"source_id": "a", "target_id": "b"}) == 1
+
+
+@pytest.mark.anyio
+async def test_clearing_notes_drops_the_link_graph(db):
+    await _push(db, [
+        {"id": "a", "title": "A", "content": "[[B]]"},
+        {"id": "b", "title": "B", "content": ""},
+    ])
+    await db.backlinks.insert_one({"user_id": "u2", "source_id": "x", "target_id": "y", "origins": ["manual"]})
+    assert (await full_graph(db, "u1"))["edges"]
+
+    await clear_note_links(db, "u1")
+
+    assert await db.backlinks.count_documents({"user_id": "u1"}) == 0
+    assert await db.note_links.count_documents({"user_id": "u1"}) == 0
+    assert await db.backlinks.count_documents({"user_id": "u2"}) == 1
+    assert "u1" not in wikilinks._cache
+    assert (await full_graph(db, "u1"))["edges"] == []
@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import xp_service
+from outbox import STAGED_FIELD
+from xp_service import (
+    LEVEL_THRESHOLDS, REWARD_XP, XPService, _achievement_rewards_consumer, _award_pipeline,
+    level_for_xp, xp_to_next_level,
+)
+
+
+def _client_curve(max_xp):
+    """Replays AppContext.js addXP one point at a time: level, xpToNextLevel at every xp"""
+    level, next_level = 1, 100
+    for xp in range(max_xp + 1):
+        if xp >= next_level:
+            level += 1
+            next_level = next_level * 3 // 2  # Math.floor(xpToNextLevel * 1.5)
+        yield xp, level, next_level
+
+
+# ==================== LEVEL CURVE ====================
+
+def test_thresholds_follow_the_client_curve():
+    assert LEVEL_THRESHOLDS[:6] == [100, 150, 225, 337, 505, 757]
+    for previous, threshold in zip(LEVEL_THRESHOLDS, LEVEL_THRESHOLDS[1:]):
+        assert threshold == previous * 3 // 2
+
+
+def test_level_and_next_threshold_match_the_client_at_every_xp():
+    for xp, level, next_level in _client_curve(20000):
+        assert (level_for_xp(xp), xp_to_next_level(xp)) == (level, next_level), xp
+
+
+@pytest.mark.parametrize("xp,level", [(0, 1), (99, 1), (100, 2), (149, 2), (150, 3), (337, 5), (504, 5), (505, 6)])
+def test_level_boundaries(xp, level):
+    assert level_for_xp(xp) == level
+
+
+# ==================== AWARD PIPELINE ====================
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("start,amount", [(0, 1), (90, 10), (90, 400), (0, 20000), (505, 0)])
+async def test_award_pipeline_matches_the_curve(db, start, amount):
+    await db.users.insert_one({"id": "u1", "xp": start, "level": level_for_xp(start)})
+    await db.users.update_one(
+        {"id": "u1"}, _award_pipeline(amount, "u1", ["test"], "award", "level-up", datetime.now(timezone.utc))
+    )
+    doc = await db.users.find_one({"id": "u1"})
+    assert doc["xp"] == start + amount
+    assert doc["level"] == level_for_xp(start + amount)
+    assert doc["xp_to_next_level"] == xp_to_next_level(start + amount)
+
+
+@pytest.mark.anyio
+async def test_one_award_crossing_several_levels_stages_a_single_level_up(db):
+    await db.users.insert_one({"id": "u1", "xp": 90, "level": 1})
+    result = await XPService(coalesce_seconds=0).award(db, "u1", 400, source="test")
+
+    # 490 XP: past 100, 150, 225 and 337
+    assert (result.xp, result.previous_level, result.level, result.xp_to_next_level) == (490, 1, 5, 505)
+    assert result.leveled_up
+    events = await db.outbox.find({}, {"_id": 0}).sort("event", -1).to_list(10)
+    assert [e["event"] for e in events] == ["xp_awarded", "level_up"]
+    assert events[1]["payload"] == {"level": 5, "previous_level": 1, "xp": 490}
+    assert (await db.users.find_one({"id": "u1"}))[STAGED_FIELD] == []
+
+
+# ==================== ACHIEVEMENT REWARDS ====================
+
+def _unlock(user_id, code):
+    return {"id": f"achievement_unlocked:{user_id}:{code}", "user_id": user_id, "event": "achievement_unlocked",
+            "payload": {"achievement": code}, "created_at": datetime.now(timezone.utc)}
+
+
+@pytest.mark.anyio
+async def test_each_unlock_is_rewarded_once(db, monkeypatch):
+    monkeypatch.setattr(xp_service, "xp_service", XPService(coalesce_seconds=0))
+    await db.users.insert_one({"id": "u1", "xp": 0, "level": 1})
+    events = [_unlock("u1", "first_quest"), _unlock("u1", "streak_7")]
+
+    await _achievement_rewards_consumer(db, events)
+    # Replayed batch
+    await _achievement_rewards_consumer(db, events)
+
+    doc = await db.users.find_one({"id": "u1"})
+    assert doc["xp"] == REWARD_XP["first_quest"] + REWARD_XP["streak_7"]
+
+
+@pytest.mark.anyio
+async def test_failed_reward_is_applied_on_retry(db, monkeypatch):
+    service = XPService(coalesce_seconds=0)
+    monkeypatch.setattr(xp_service, "xp_service", service)
+    await db.users.insert_one({"id": "u1", "xp": 0, "level": 1})
+    events = [_unlock("u1", "first_quest")]
+
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("users unavailable")
+
+    monkeypatch.setattr(service, "award", unavailable)
+    with pytest.raises(ConnectionError):
+        await _achievement_rewards_consumer(db, events)
+
+    monkeypatch.undo()
+    monkeypatch.setattr(xp_service, "xp_service", XPService(coalesce_seconds=0))
+    await _achievement_rewards_consumer(db, events)
+    assert (await db.users.find_one({"id": "u1"}))["xp"] == REWARD_XP["first_quest"]